@@ -0,0 +1,71 @@
+"""
+Cold-start cost of importing proteotools modules, i.e. what every new worker process pays before it does any work.
+Each import is timed in a fresh interpreter, minus the time of starting an interpreter that imports nothing.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules proteotools.search --repeat 20 --breakdown 15
+
+Pass --path with another checkout to compare two versions.
+"""
+from argparse import ArgumentParser
+from statistics import median
+from pathlib import Path
+import subprocess
+import sys
+import time
+import os
+
+MODULES = ['proteotools', 'proteotools.config', 'proteotools.executors', 'proteotools.search', 'proteotools.tpp',
+           'proteotools.convert', 'proteotools.software', 'proteotools.pepxml', 'proteotools.mzml']
+
+
+def run(arguments: list, path: str, **kwargs) -> subprocess.CompletedProcess:
+    # with -c the current directory comes first on sys.path, so run there as well
+    return subprocess.run([sys.executable, *arguments], cwd=path, env={**os.environ, 'PYTHONPATH': path}, check=True,
+                          **kwargs)
+
+
+def time_import(statement: str, repeat: int, path: str) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(['-c', statement], path)
+        times.append(time.perf_counter() - start)
+    return median(times)
+
+
+def breakdown(module: str, top: int, path: str):
+    """
+    The imports that take longest (cumulative), from python -X importtime.
+    """
+    result = run(['-X', 'importtime', '-c', f'import {module}'], path, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines()[1:]:
+        self_us, cumulative_us, name = line.split('|')
+        rows.append((int(cumulative_us), int(self_us.split(':')[1]), name.rstrip()))
+    print(f'\n{module}, slowest imports (cumulative / self):')
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f'  {cumulative_us / 1000:8.1f} ms {self_us / 1000:8.1f} ms  {name}')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--path', default=str(Path(__file__).resolve().parent.parent),
+                        help='The proteotools checkout to import from. Default: this one.')
+    parser.add_argument('--breakdown', type=int, default=0, metavar='N',
+                        help='Also show the N slowest imports of each module.')
+    args = parser.parse_args()
+
+    baseline = time_import('pass', args.repeat, args.path)
+    print(f'interpreter start:                {baseline * 1000:8.1f} ms (median of {args.repeat})')
+    for module in args.modules:
+        elapsed = time_import(f'import {module}', args.repeat, args.path) - baseline
+        print(f'  import {module + ":":<26}{elapsed * 1000:8.1f} ms')
+    for module in args.modules if args.breakdown else []:
+        breakdown(module, args.breakdown, args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Read speed and peak memory of proteotools.pepxml against pyteomics.pepxml.
+
+    python benchmarks/pepxml_reader.py --spectra 200000
+    python benchmarks/pepxml_reader.py --file /path/to/interact-iproph.pep.xml
+
+Without --file, a synthetic pepXML file with the given number of spectra is written to a temporary directory.
+Each reader runs in its own process so the peak memory numbers don't affect each other.
+"""
+from argparse import ArgumentParser
+from multiprocessing import Process, Queue
+from tempfile import TemporaryDirectory
+from pathlib import Path
+import resource
+import random
+import time
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<msms_pipeline_analysis xmlns="http://regis-web.systemsbiology.net/pepXML" date="2022-01-01T00:00:00" summary_xml="x">
+<msms_run_summary base_name="/data/run" raw_data_type="raw" raw_data=".mzML">
+<search_summary base_name="/data/run" search_engine="Comet" precursor_mass_type="monoisotopic" fragment_mass_type="monoisotopic" search_id="1"/>
+'''
+
+QUERY = '''<spectrum_query spectrum="run.{scan}.{scan}.2" start_scan="{scan}" end_scan="{scan}" precursor_neutral_mass="{mass:.4f}" assumed_charge="2" index="{scan}" retention_time_sec="{rt:.2f}">
+<search_result>
+<search_hit hit_rank="1" peptide="{peptide}" peptide_prev_aa="K" peptide_next_aa="A" protein="{protein}" num_tot_proteins="2" calc_neutral_pep_mass="{mass:.4f}" massdiff="0.001">
+<alternative_protein protein="sp|Q9|OTHER"/>
+<search_score name="xcorr" value="{xcorr:.3f}"/>
+<search_score name="expect" value="{expect:.3e}"/>
+<analysis_result analysis="peptideprophet"><peptideprophet_result probability="{prob:.4f}"/></analysis_result>
+<analysis_result analysis="interprophet"><interprophet_result probability="{prob:.4f}"/></analysis_result>
+</search_hit>
+</search_result>
+</spectrum_query>
+'''
+
+
+def write_synthetic(path: Path, spectra: int):
+    rng = random.Random(0)
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for scan in range(1, spectra + 1):
+            peptide = ''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(rng.randint(8, 12)))
+            protein = ('rev_' if rng.random() < 0.3 else '') + f'sp|P{rng.randint(10000, 99999)}|PROT'
+            f.write(QUERY.format(scan=scan, mass=rng.uniform(800, 1500), rt=scan * 0.1, peptide=peptide,
+                                 protein=protein, xcorr=rng.uniform(0, 5), expect=rng.uniform(1e-8, 10),
+                                 prob=rng.random()))
+        f.write('</msms_run_summary>\n</msms_pipeline_analysis>\n')
+
+
+def run_proteotools(path, queue):
+    from proteotools.pepxml import iter_pepxml
+    start = time.perf_counter()
+    n = sum(len(table['spectrum']) for table in iter_pepxml(path))
+    queue.put((n, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_pyteomics(path, queue):
+    from pyteomics import pepxml
+    start = time.perf_counter()
+    with pepxml.read(str(path)) as reader:
+        n = sum(len(x.get('search_hit', [])) for x in reader)
+    queue.put((n, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(target, path):
+    queue = Queue()
+    p = Process(target=target, args=(path, queue))
+    p.start()
+    p.join()
+    return queue.get() if p.exitcode == 0 else None
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--file', default=None)
+    parser.add_argument('--spectra', type=int, default=100000)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        path = args.file
+        if path is None:
+            path = Path(tmp) / 'synthetic.pep.xml'
+            write_synthetic(path, args.spectra)
+        size = Path(path).stat().st_size / 1024 ** 2
+        print(f'{path}: {size:.1f} MB')
+
+        for name, target in [('proteotools', run_proteotools), ('pyteomics', run_pyteomics)]:
+            result = measure(target, path)
+            if result is None:
+                print(f'  {name:12s} failed (is it installed?)')
+                continue
+            n, seconds, maxrss = result
+            print(f'  {name:12s} {n:10d} PSMs {seconds:8.2f} s {n / seconds:12.0f} PSMs/s '
+                  f'{size / seconds:8.1f} MB/s  peak RSS {maxrss / 1024:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Throughput and scaling of the whole pipeline (run_thermorawfileparser -> run_all_with_defaults -> run_prophets) with
+stand-in tools, so proteotools' own overhead can be measured without instruments, search engines or containers.
+
+    python benchmarks/pipeline.py --files 12 --workers 1,2,4,8
+    python benchmarks/pipeline.py --files 4 --spectra 20000 --cpu 0 --sleep 0 --cache
+    python benchmarks/pipeline.py --config '{"comet": {"cpu": 2.0}}' --json results.json
+    python benchmarks/pipeline.py --files 2 --workers 1,4 --split chunks
+
+The stand-ins are in benchmarks/stub_tools.py. Each run happens in a new process with HOME pointing to a fresh
+temporary directory, so the tools proteotools finds (and its cache) are the stubs in there and not a real install.
+For each stage the report gives the wall time, the time tools were actually running and the rest, which is
+proteotools' overhead: starting processes, hashing, merging files, waiting on dependencies.
+"""
+from argparse import ArgumentParser, SUPPRESS
+from tempfile import TemporaryDirectory
+from pathlib import Path
+import subprocess
+import json
+import sys
+import os
+
+STUBS = Path(__file__).resolve().parent / 'stub_tools.py'
+STAGES = ['convert', 'search', 'validate']
+
+
+def write_executable(path: Path, tool: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f'#!/bin/sh\nexec {sys.executable} {STUBS} {tool} "$@"\n')
+    path.chmod(0o755)
+
+
+def set_up(root: Path, n_files: int, n_proteins: int):
+    """
+    A home directory with the stub tools installed where proteotools looks for them, stubs for the tools it expects
+    on the PATH, and a study of n_files raw files.
+    """
+    tool_dir = root / 'home' / '.proteotools_software'
+    write_executable(tool_dir / 'comet' / 'comet.linux.exe', 'comet')
+    write_executable(tool_dir / 'tandem' / 'bin' / 'static_link_ubuntu' / 'tandem.exe', 'tandem')
+    for placeholder in [tool_dir / 'msgfplus' / 'MSGFPlus.jar',
+                        tool_dir / 'tpp' / 'tpp_6-0-0.sif',
+                        tool_dir / 'ThermoRawFileParser' / 'ThermoRawFileParser.exe']:
+        placeholder.parent.mkdir(parents=True, exist_ok=True)
+        placeholder.write_bytes(b'stub')
+    for tool in ['mono', 'java', 'runtandem', 'singularity']:
+        write_executable(root / 'bin' / tool, tool)
+
+    data = root / 'data'
+    data.mkdir()
+    for i in range(n_files):
+        (data / f'run{i + 1:03d}.raw').write_bytes(os.urandom(1024))
+    with open(data / 'db.fasta', 'w') as f:
+        for i in range(n_proteins):
+            sequence = ('PEPTIDEK' * (i % 20 + 5))
+            f.write(f'>sp|P{i:05d}|STUB\n{sequence}\n>rev_sp|P{i:05d}|STUB\n{sequence[::-1]}\n')
+    (data / 'comet.params').write_text('# comet_version 2021.01 rev. 0\nnum_threads = 0\n')
+    (data / 'msgf.conf').write_text('NumThreads=1\n')
+    (data / 'tandem.xml').write_text('<?xml version="1.0"?>\n<bioml></bioml>\n')
+    return data
+
+
+def worker(settings: dict):
+    """
+    Run the pipeline once and print a JSON summary. Runs in its own process, with HOME and PATH already pointing at
+    the stubs.
+    """
+    import time
+    from proteotools import convert, search, tpp, execute
+
+    data = Path(settings['data'])
+    workers = settings['workers']
+    use_cache = settings['cache']
+    records = []
+    execute.add_hook(records.append)
+
+    stages = {}
+
+    def stage(name, function):
+        start = time.time()
+        result = function()
+        stages[name] = (start, time.time())
+        return result
+
+    mzml_files = stage('convert', lambda: convert.run_thermorawfileparser(sorted(data.glob('*.raw')),
+                                                                         max_parallel=workers,
+                                                                         use_cache=use_cache))
+
+    def search_all():
+        if settings['split'] == 'none':
+            # each engine gets max_parallel // 3 = workers search processes
+            return search.run_all_with_defaults(data / 'comet.params', data / 'msgf.conf', data / 'tandem.xml',
+                                                data / 'db.fasta', mzml_files, threads=3 * workers,
+                                                max_parallel=3 * workers, use_cache=use_cache)
+        # split every file (or the database) into one piece per worker, one engine after the other
+        chunks, shards = (workers, 1) if settings['split'] == 'chunks' else (1, workers)
+        common = dict(fasta=data / 'db.fasta', max_parallel=workers, use_cache=use_cache, fasta_shards=shards)
+        return (search.comet(data / 'comet.params', mzml_files=mzml_files, mzml_chunks=chunks, **common) +
+                search.msgfplus(data / 'msgf.conf', mzml_files=mzml_files, mzml_chunks=chunks, **common) +
+                search.tandem(data / 'tandem.xml', ms_files=mzml_files, **common))  # X! Tandem can't be chunked
+
+    pepxml_files = stage('search', search_all)
+    stage('validate', lambda: tpp.run_prophets(pepxml_files, data / 'db.fasta', threads=workers,
+                                               use_cache=use_cache))
+
+    result = {}
+    for name, (start, end) in stages.items():
+        # time during which at least one tool was running, from the union of the tool call intervals
+        intervals = sorted((max(r.start_time, start), min(r.start_time + r.wall_time, end)) for r in records
+                           if r.start_time < end and r.start_time + r.wall_time > start)
+        busy = 0.0
+        current_start, current_end = None, None
+        for a, b in intervals:
+            if current_end is None or a > current_end:
+                if current_end is not None:
+                    busy += current_end - current_start
+                current_start, current_end = a, b
+            else:
+                current_end = max(current_end, b)
+        if current_end is not None:
+            busy += current_end - current_start
+        in_stage = [r for r in records if start <= r.start_time < end]
+        result[name] = {'wall_time': end - start,
+                        'tool_time': busy,
+                        'overhead': end - start - busy,
+                        'tool_calls': len(in_stage),
+                        'tool_cpu_time': sum(r.cpu_time for r in in_stage)}
+    print(json.dumps(result))
+
+
+def run(settings: dict, stub_config: dict, verbose: bool = False) -> dict:
+    root = Path(settings['root'])
+    env = dict(os.environ,
+               HOME=str(root / 'home'),
+               PATH=f'{root / "bin"}{os.pathsep}{os.environ.get("PATH", "")}',
+               PYTHONPATH=f'{Path(__file__).resolve().parent.parent}{os.pathsep}{os.environ.get("PYTHONPATH", "")}',
+               STUB_CONFIG=json.dumps(stub_config))
+    p = subprocess.run([sys.executable, __file__, '--worker', json.dumps(settings)], env=env,
+                       stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f'The pipeline failed with {settings}. Run it with --verbose to see why.')
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=8, help='Number of raw files in the study.')
+    parser.add_argument('--spectra', type=int, default=2000, help='Spectra per raw file.')
+    parser.add_argument('--proteins', type=int, default=5000, help='Target proteins in the FASTA file.')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts to run the pipeline with.')
+    parser.add_argument('--sleep', type=float, default=0.2, help='Wall time every tool call waits, in seconds.')
+    parser.add_argument('--cpu', type=float, default=0.1, help='CPU time every tool call burns, in seconds.')
+    parser.add_argument('--container-start', type=float, default=0.1,
+                        help='Time singularity exec takes to start a container, in seconds.')
+    parser.add_argument('--config', default='{}', help='Extra stub settings as JSON, e.g. per tool costs. See '
+                                                       'benchmarks/stub_tools.py.')
+    parser.add_argument('--cache', action='store_true', help='Also time a second run with use_cache=True on the '
+                                                             'same study.')
+    parser.add_argument('--split', choices=['none', 'chunks', 'shards'], default='none',
+                        help='Also split the search stage into one piece per worker: chunks of every mzML file or '
+                             'shards of the database. The engines then run one after the other.')
+    parser.add_argument('--json', default=None, help='Write the results to this file as well.')
+    parser.add_argument('--worker', default=None, help=SUPPRESS)
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the pipeline.')
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        worker(json.loads(args.worker))
+        return
+
+    stub_config = {'default': {'sleep': args.sleep, 'cpu': args.cpu},
+                   'spectra': args.spectra,
+                   'container_start': args.container_start,
+                   **json.loads(args.config)}
+    worker_counts = [int(x) for x in args.workers.split(',')]
+
+    results = []
+    for workers in worker_counts:
+        with TemporaryDirectory() as root:
+            data = set_up(Path(root), args.files, args.proteins)
+            settings = {'root': root, 'data': str(data), 'workers': workers, 'cache': args.cache,
+                        'split': args.split}
+            runs = {'cold': run(settings, stub_config, args.verbose)}
+            if args.cache:
+                runs['cached'] = run(settings, stub_config, args.verbose)
+        for kind, stages in runs.items():
+            results.append({'workers': workers, 'run': kind, 'stages': stages})
+
+    print(f'{args.files} files x {args.spectra} spectra, tool calls: {args.sleep}s wait + {args.cpu}s CPU, '
+          f'container start {args.container_start}s')
+    print(f'{"workers":>7} {"run":>6} {"stage":>9} {"wall s":>8} {"tools s":>8} {"overhead s":>10} '
+          f'{"calls":>6}')
+    for r in results:
+        for name in STAGES:
+            s = r['stages'][name]
+            print(f'{r["workers"]:>7} {r["run"]:>6} {name:>9} {s["wall_time"]:8.2f} {s["tool_time"]:8.2f} '
+                  f'{s["overhead"]:10.2f} {s["tool_calls"]:6d}')
+
+    print()
+    print(f'{"workers":>7} {"run":>6} {"total s":>8} {"files/min":>10} {"spectra/s":>10} {"speedup":>8}')
+    baseline = {}
+    for r in results:
+        total = sum(s['wall_time'] for s in r['stages'].values())
+        baseline.setdefault(r['run'], total)
+        r['total_time'] = total
+        r['files_per_minute'] = args.files / total * 60
+        r['spectra_per_second'] = args.files * args.spectra / total
+        r['speedup'] = baseline[r['run']] / total
+        print(f'{r["workers"]:>7} {r["run"]:>6} {total:8.2f} {r["files_per_minute"]:10.1f} '
+              f'{r["spectra_per_second"]:10.0f} {r["speedup"]:8.2f}')
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'stub_config': stub_config, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Per-call overhead of running TPP or ProteoWizard tools with a fresh container each time versus through a persistent
+instance (tpp.instance / proteowizard.instance).
+
+    python benchmarks/singularity_instance.py --calls 20
+    python benchmarks/singularity_instance.py --image proteowizard --tool msconvert --args=--help
+
+Requires Singularity and the images from proteotools.software.download_all() / get_proteowizard().
+"""
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+import time
+import proteotools.tpp as tpp
+import proteotools.proteowizard as proteowizard
+
+
+def time_calls(module, tool, args, calls, bind) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        module.run_tool(tool, args, path_to_bind=bind)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--image', choices=['tpp', 'proteowizard'], default='tpp')
+    parser.add_argument('--tool', default=None, help="Tool to run. Default: 'true' for TPP, 'cmd /c exit' for "
+                                                     "ProteoWizard.")
+    parser.add_argument('--args', default='', help='Arguments passed to the tool.')
+    parser.add_argument('--calls', type=int, default=10)
+    args = parser.parse_args()
+
+    module = tpp if args.image == 'tpp' else proteowizard
+    tool = args.tool or ('true' if args.image == 'tpp' else 'cmd')
+    tool_args = args.args or ('' if args.image == 'tpp' else '/c exit')
+
+    with TemporaryDirectory() as bind:
+        fresh = time_calls(module, tool, tool_args, args.calls, bind)
+
+        start = time.perf_counter()
+        with module.instance([bind]):
+            startup = time.perf_counter() - start
+            reused = time_calls(module, tool, tool_args, args.calls, bind)
+
+    print(f'{args.image}: {tool} {tool_args}, {args.calls} calls')
+    print(f'  singularity exec per call:      {fresh * 1000:8.1f} ms')
+    print(f'  instance start (once):          {startup * 1000:8.1f} ms')
+    print(f'  exec instance:// per call:      {reused * 1000:8.1f} ms')
+    print(f'  saved per call:                 {(fresh - reused) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Stand-ins for the external tools proteotools runs (ThermoRawFileParser under mono, Comet, MS-GF+ under java,
+X! Tandem through runtandem, and the TPP tools through singularity), for benchmarks/pipeline.py. Each one reads the
+same arguments as the real tool and writes small but well-formed output files where the real tool would.
+
+    python stub_tools.py <tool> [arguments of the real tool]
+
+How much work each call does comes from the STUB_CONFIG environment variable, a JSON object like
+
+    {"default": {"sleep": 0.1, "cpu": 0.2}, "comet": {"cpu": 1.0}, "spectra": 2000, "container_start": 0.3}
+
+'sleep' is wall time spent waiting, 'cpu' is CPU time burned in a busy loop, 'spectra' is the number of spectra
+per raw file (which sets the size of every output file) and 'container_start' is how long singularity exec takes to
+start a new container (exec into a running instance doesn't pay it).
+"""
+from pathlib import Path
+import hashlib
+import base64
+import random
+import struct
+import json
+import zlib
+import time
+import sys
+import os
+import re
+
+CONFIG = json.loads(os.environ.get('STUB_CONFIG', '{}'))
+PEPXML_NS = 'http://regis-web.systemsbiology.net/pepXML'
+
+
+def work(tool: str):
+    cost = {'sleep': 0.0, 'cpu': 0.0, **CONFIG.get('default', {}), **CONFIG.get(tool, {})}
+    time.sleep(cost['sleep'])
+    end = time.process_time() + cost['cpu']
+    while time.process_time() < end:
+        pass
+
+
+def option(args, flag, default=None):
+    for i, arg in enumerate(args):
+        if arg == flag and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(flag) and len(flag) == 2 and len(arg) > 2:  # Comet style: -Dfile
+            return arg[2:]
+    return default
+
+
+def scans_in(path) -> list:
+    with open(path, 'rb') as f:
+        return [int(x) for x in re.findall(rb'scan=(\d+)', f.read())]
+
+
+def write_atomic(path, text: str):
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.stub{os.getpid()}')
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _binary_array(values, dtype: str, accession: str, name: str) -> str:
+    data = base64.b64encode(zlib.compress(struct.pack(f'<{len(values)}{dtype}', *values))).decode()
+    precision = ('MS:1000523', '64-bit float') if dtype == 'd' else ('MS:1000521', '32-bit float')
+    return (f'<binaryDataArray encodedLength="{len(data)}">'
+            f'<cvParam cvRef="MS" accession="{precision[0]}" name="{precision[1]}" value=""/>'
+            f'<cvParam cvRef="MS" accession="MS:1000574" name="zlib compression" value=""/>'
+            f'<cvParam cvRef="MS" accession="{accession}" name="{name}" value=""/>'
+            f'<binary>{data}</binary></binaryDataArray>')
+
+
+def write_mzml(path, n_spectra: int, seed: str):
+    """
+    An indexed mzML file with n_spectra MS2 spectra of 100 peaks each, with zlib compressed 64-bit m/z and 32-bit
+    intensity arrays like ThermoRawFileParser writes.
+    """
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n'
+             '<indexedmzML xmlns="http://psi.hupo.org/ms/mzml">\n'
+             f'  <mzML xmlns="http://psi.hupo.org/ms/mzml" id="{Path(path).stem}" version="1.1.0">\n'
+             f'    <run id="{Path(path).stem}">\n'
+             f'      <spectrumList count="{n_spectra}" defaultDataProcessingRef="stub">\n']
+    offsets = []
+    position = len(parts[0].encode())
+    for scan in range(1, n_spectra + 1):
+        peaks = random.Random(f'{seed}{scan}')
+        mz = sorted(peaks.uniform(100, 2000) for _ in range(100))
+        intensity = [peaks.uniform(0, 1e6) for _ in range(100)]
+        spectrum = (f'        <spectrum index="{scan - 1}" id="controllerType=0 controllerNumber=1 scan={scan}" '
+                    f'defaultArrayLength="100">\n'
+                    f'          <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="2"/>\n'
+                    f'          <scanList count="1"><scan><cvParam cvRef="MS" accession="MS:1000016" '
+                    f'name="scan start time" value="{scan * 0.01:.4f}" unitCvRef="UO" unitAccession="UO:0000031" '
+                    f'unitName="minute"/></scan></scanList>\n'
+                    f'          <precursorList count="1"><precursor><selectedIonList count="1"><selectedIon>'
+                    f'<cvParam cvRef="MS" accession="MS:1000744" name="selected ion m/z" '
+                    f'value="{400 + scan % 800 + 0.5}"/>'
+                    f'<cvParam cvRef="MS" accession="MS:1000041" name="charge state" value="{2 + scan % 3}"/>'
+                    f'</selectedIon></selectedIonList></precursor></precursorList>\n'
+                    f'          <binaryDataArrayList count="2">'
+                    f'{_binary_array(mz, "d", "MS:1000514", "m/z array")}'
+                    f'{_binary_array(intensity, "f", "MS:1000515", "intensity array")}</binaryDataArrayList>\n'
+                    f'        </spectrum>\n')
+        offsets.append(position + len('        '))  # the index points at the <spectrum tag itself
+        position += len(spectrum.encode())
+        parts.append(spectrum)
+    parts.append('      </spectrumList>\n    </run>\n  </mzML>\n')
+    position += len(parts[-1].encode())
+    index = ['  <indexList count="1">\n    <index name="spectrum">\n']
+    for scan, offset in enumerate(offsets, start=1):
+        index.append(f'      <offset idRef="controllerType=0 controllerNumber=1 scan={scan}">{offset}</offset>\n')
+    index.append('    </index>\n  </indexList>\n')
+    parts += index
+    parts.append(f'  <indexListOffset>{position + len("  ")}</indexListOffset>\n</indexedmzML>\n')
+    write_atomic(path, ''.join(parts))
+
+
+def write_pepxml(path, base_name: str, scans: list, engine: str, score: str, seed: str):
+    """
+    A pepXML file with one rank 1 hit per scan, about one in five of them to a decoy.
+    """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             f'<msms_pipeline_analysis xmlns="{PEPXML_NS}">\n'
+             f'<msms_run_summary base_name="{base_name}" raw_data=".mzML">\n'
+             f'<search_summary base_name="{base_name}" search_engine="{engine}"/>\n']
+    name = Path(base_name).name
+    for index, scan in enumerate(scans, start=1):
+        digest = hashlib.md5(f'{seed}{scan}'.encode()).digest()
+        decoy = digest[0] % 5 == 0
+        value = digest[1] / 25.6 if decoy else digest[1] / 2560
+        protein = f'{"rev_" if decoy else ""}sp|P{digest[2]:05d}|STUB'
+        parts.append(f'<spectrum_query spectrum="{name}.{scan:05d}.{scan:05d}.2" start_scan="{scan}" '
+                     f'end_scan="{scan}" assumed_charge="2" index="{index}">\n<search_result>\n'
+                     f'<search_hit hit_rank="1" peptide="PEPTIDE{digest[3] % 50}K" protein="{protein}" '
+                     f'num_tot_proteins="1"><search_score name="{score}" value="{value:.4g}"/></search_hit>\n'
+                     f'</search_result>\n</spectrum_query>\n')
+    parts.append('</msms_run_summary>\n</msms_pipeline_analysis>\n')
+    write_atomic(path, ''.join(parts))
+
+
+def mono(args):
+    if '--version' in args:
+        print('Mono JIT compiler version 6.12 (stub)' if args[0] == '--version' else '1.3.4 (stub)')
+        return
+    work('thermorawfileparser')
+    raw = Path(option(args, '-i'))
+    output_directory = Path(option(args, '-o', raw.parent))
+    write_mzml(output_directory / raw.with_suffix('.mzML').name, CONFIG.get('spectra', 1000), raw.name)
+
+
+def comet(args):
+    work('comet')
+    fasta, name, mzml = option(args, '-D'), option(args, '-N'), args[-1]
+    write_pepxml(f'{name}.pep.xml', name, scans_in(mzml), 'Comet', 'expect', f'comet{fasta}')
+
+
+def java(args):
+    if 'edu.ucsd.msjava.msdbsearch.BuildSA' in args:
+        work('buildsa')
+        fasta = Path(option(args, '-d'))
+        for suffix in ['.canno', '.cseq', '.csarr', '.cnlcp']:
+            write_atomic(fasta.with_suffix(suffix), 'stub index\n')
+        return
+    work('msgfplus')
+    mzml, mzid, fasta = option(args, '-s'), option(args, '-o'), option(args, '-d')
+    # one rank 1 hit per scan, laid out the way MS-GF+ writes them, for idconvert or proteotools.mzid to convert
+    scans = list(dict.fromkeys(scans_in(mzml)))  # the mzML index repeats every id
+    results = ''.join(f'<SpectrumIdentificationResult spectraData_ref="SID_1" spectrumID="scan={scan}" id="SIR_{scan}">'
+                      f'<SpectrumIdentificationItem rank="1" peptide_ref="Pep_{scan}" chargeState="2" '
+                      f'calculatedMassToCharge="500.0" experimentalMassToCharge="500.001" id="SII_{scan}">'
+                      f'<PeptideEvidenceRef peptideEvidence_ref="PepEv_{scan}"/>'
+                      f'<cvParam name="MS-GF:SpecEValue" value="{1e-3 / scan:.3g}"/></SpectrumIdentificationItem>'
+                      f'</SpectrumIdentificationResult>\n' for scan in scans)
+    sequences = ''.join(f'<Peptide id="Pep_{scan}"><PeptideSequence>PEPTIDEK</PeptideSequence></Peptide>\n'
+                        f'<PeptideEvidence pre="K" post="A" peptide_ref="Pep_{scan}" dBSequence_ref="DBSeq_1" '
+                        f'id="PepEv_{scan}"/>\n' for scan in scans)
+    write_atomic(mzid, f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                       f'<MzIdentML xmlns="http://psidev.info/psi/pi/mzIdentML/1.1">\n<SequenceCollection>\n'
+                       f'<DBSequence accession="sp|P00000|STUB" id="DBSeq_1"/>\n{sequences}</SequenceCollection>\n'
+                       f'<DataCollection><Inputs><SearchDatabase location="{fasta}" id="SearchDB_1"/>'
+                       f'<SpectraData location="{mzml}" id="SID_1"/></Inputs>\n'
+                       f'<AnalysisData><SpectrumIdentificationList id="SI_LIST_1">\n{results}'
+                       f'</SpectrumIdentificationList></AnalysisData></DataCollection>\n</MzIdentML>\n')
+
+
+def runtandem(args):
+    work('tandem')
+    output_directory = Path(option(args, '-o'))
+    database = option(args, '-db')
+    files = args[args.index('-v') + 2:]
+    for ms_file in files:
+        scans = [int(x) for x in re.findall(r'scan=(\d+)', Path(ms_file).read_text())]
+        txml = output_directory / (Path(ms_file).stem + '.t.xml')
+        write_atomic(txml, f'<bioml database="{database}">\n' +
+                     ''.join(f'<group id="{scan}" note="scan={scan}"/>\n' for scan in scans) + '</bioml>\n')
+
+
+def idconvert(args):
+    work('idconvert')
+    mzid = Path(args[0])
+    output = Path(option(args, '-o')) / (mzid.stem.replace('-msgf_plus', '') + option(args, '-e'))
+    write_pepxml(output, str(output.with_suffix('')), scans_in(mzid), 'MS-GF+', 'MS-GF:SpecEValue', 'msgf')
+
+
+def msconvert(args):
+    work('msconvert')
+    for ms_file in map(Path, args[args.index('--mgf') + 1:]):
+        output = Path(option(args, '-o')) / ms_file.with_suffix('.mgf').name
+        write_atomic(output, ''.join(f'BEGIN IONS\nTITLE={ms_file.stem}.{scan}.{scan}.2 scan={scan}\nEND IONS\n'
+                                     for scan in scans_in(ms_file)))
+
+
+def tandem2xml(args):
+    work('tandem2xml')
+    txml, pepxml = args
+    write_pepxml(pepxml, str(Path(pepxml).with_suffix('')), scans_in(txml), 'X! Tandem', 'expect', 'tandem')
+
+
+def interactparser(args):
+    work('interactparser')
+    output, pepxml = args[0], args[1]
+    write_atomic(output, Path(pepxml).read_text())
+
+
+def peptideprophetparser(args):
+    work('peptideprophetparser')
+    pepxml = Path(args[0])
+    text = pepxml.read_text().replace('</search_hit>', '<analysis_result analysis="peptideprophet">'
+                                                       '<peptideprophet_result probability="0.9"/>'
+                                                       '</analysis_result></search_hit>')
+    write_atomic(pepxml, text)
+
+
+def interprophetparser(args):
+    work('interprophetparser')
+    files = [x for x in args if '=' not in x]
+    inputs, output = files[:-1], files[-1]
+    header, queries = None, []
+    for pepxml in inputs:
+        text = Path(pepxml).read_text()
+        first = text.find('<spectrum_query')
+        if header is None:
+            header = text[:first if first != -1 else text.find('</msms_run_summary')]
+        queries += re.findall(r'<spectrum_query.*?</spectrum_query>\n', text, flags=re.DOTALL)
+    text = ''.join(queries).replace('<peptideprophet_result probability="0.9"/>',
+                                    '<peptideprophet_result probability="0.9"/></analysis_result>'
+                                    '<analysis_result analysis="interprophet">'
+                                    '<interprophet_result probability="0.95"/>')
+    write_atomic(output, header + text + '</msms_run_summary>\n</msms_pipeline_analysis>\n')
+
+
+CONTAINER_TOOLS = {
+    'idconvert': idconvert,
+    'msconvert': msconvert,
+    'Tandem2XML': tandem2xml,
+    'InteractParser': interactparser,
+    'PeptideProphetParser': peptideprophetparser,
+    'InterProphetParser': interprophetparser,
+    'wineserver': lambda args: None,
+    'true': lambda args: None,
+}
+
+
+def singularity(args):
+    if args[0] == '--version':
+        print('singularity version 3.8.0 (stub)')
+        return
+    if args[0] == 'instance':
+        time.sleep(CONFIG.get('container_start', 0.0))
+        return
+    # exec [options] image tool args, or exec instance://name tool args
+    args = args[1:]
+    if not args[0].startswith('instance://'):
+        time.sleep(CONFIG.get('container_start', 0.0))
+        while args[0].startswith('-'):
+            args = args[2:] if args[0] in ('-B', '--bind') else args[1:]
+    tool, *tool_args = args[1:]
+    if tool == 'wine':
+        tool, *tool_args = tool_args
+    CONTAINER_TOOLS[tool](tool_args)
+
+
+TOOLS = {
+    'mono': mono,
+    'comet': comet,
+    'java': java,
+    'runtandem': runtandem,
+    'tandem': lambda args: work('tandem'),
+    'singularity': singularity,
+}
+
+
+if __name__ == '__main__':
+    TOOLS[sys.argv[1]](sys.argv[2:])
@@ -1,11 +1,29 @@
-from pathlib import Path
+from importlib import import_module
 
 __version__ = '0.2.1'
 
-TOOL_DIR = Path('~/.proteotools_software').expanduser()
-COMET = TOOL_DIR / 'comet' / 'comet.linux.exe'
-MSGF = TOOL_DIR / 'msgfplus' / 'MSGFPlus.jar'
-TANDEM = TOOL_DIR / 'tandem' / 'bin' / 'static_link_ubuntu' / 'tandem.exe'
-TPP = TOOL_DIR / 'tpp' / 'tpp_6-0-0.sif'
-THERMORAWFILEPARSER = TOOL_DIR / 'ThermoRawFileParser' / 'ThermoRawFileParser.exe'
-PROTEOWIZARD = TOOL_DIR / 'proteowizard' / 'proteowizard'
+# The paths below and the submodules are only looked up when they are used (see proteotools.config), so importing
+# proteotools, e.g. in every worker process, costs next to nothing.
+_TOOLS = {'COMET': 'comet',
+          'MSGF': 'msgf',
+          'TANDEM': 'tandem',
+          'TPP': 'tpp',
+          'THERMORAWFILEPARSER': 'thermorawfileparser',
+          'PROTEOWIZARD': 'proteowizard'}
+
+_SUBMODULES = ['aio', 'cache', 'config', 'convert', 'database', 'execute', 'executors', 'fasta', 'fdr', 'journal',
+               'mzid', 'mzml', 'parallel', 'pepxml', 'proteowizard', 'search', 'singularity', 'software', 'tpp']
+
+
+def __getattr__(name):
+    if name == 'TOOL_DIR':
+        return import_module('proteotools.config').tool_dir()
+    if name in _TOOLS:
+        return import_module('proteotools.config').tool_path(_TOOLS[name])
+    if name in _SUBMODULES:
+        return import_module(f'proteotools.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted([*globals(), 'TOOL_DIR', *_TOOLS, *_SUBMODULES])
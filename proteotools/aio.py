@@ -0,0 +1,375 @@
+"""
+asyncio versions of the search, conversion and TPP functions, for driving many jobs from one event loop without a
+thread per job:
+
+    async def process(sample):
+        mzml_files = await aio.run_thermorawfileparser(sample.raw_files, semaphore=limit)
+        pepxml_files = await aio.comet(comet_params, fasta, mzml_files, max_parallel=4, semaphore=limit)
+        await aio.run_prophets(pepxml_files, fasta, semaphore=limit)
+
+    limit = asyncio.Semaphore(32)  # no more than 32 tools running at once, across all the samples
+    await asyncio.gather(*(process(s) for s in samples))
+
+They build the same command lines as their blocking counterparts. Every function takes:
+
+    timeout: seconds each tool call may run before it is killed and asyncio.TimeoutError is raised.
+    semaphore: an asyncio.Semaphore held while each tool runs, to cap the number of tools running at once across
+        everything sharing it.
+
+Cancelling a task kills the tools it started. Caching, database sharding and mzML chunking are only available in the
+blocking functions.
+"""
+from proteotools.software import check_for_comet, check_for_msgfplus, check_for_tandem, check_for_singularity, \
+    check_for_thermorawfileparser
+from proteotools.execute import Record, _emit, _size
+from proteotools.parallel import budget
+from proteotools.search import _comet_command, _comet_parameters_with_threads, _msgfplus_command, \
+    _idconvert_command, _runtandem_command
+from proteotools.tpp import _tool_command, _interactparser_bind, _interactparser_command, _peptideprophet_command, \
+    _iprophet_command
+from proteotools.convert import _raw_files, _metadata_file, _command as _thermorawfileparser_command
+from proteotools.mzid import mzid_to_pepxml
+from contextlib import asynccontextmanager
+from typing import Union, List, Callable, Iterable, Awaitable, Literal
+from subprocess import SubprocessError
+from os import PathLike
+from pathlib import Path
+import asyncio
+import signal
+import time
+import os
+
+
+@asynccontextmanager
+async def _limit(semaphore: asyncio.Semaphore = None):
+    if semaphore is None:
+        yield
+    else:
+        async with semaphore:
+            yield
+
+
+async def run_command(command: List[str],
+                      step: str = None,
+                      inputs: Iterable[Union[str, PathLike]] = (),
+                      outputs: Iterable[Union[str, PathLike]] = (),
+                      timeout: float = None,
+                      semaphore: asyncio.Semaphore = None) -> Record:
+    """
+    Run a command without blocking the event loop and wait for it to finish. The Record goes to the hooks in
+    proteotools.execute like any other. The event loop reaps the process, so CPU time and memory are not available
+    and are NaN.
+
+    Nothing is raised if the command fails; check returncode. If it times out or the task is cancelled, the
+    command and everything it started are killed.
+
+    :param command: The command line.
+    :param step: Name for the step in the records. Defaults to the executable.
+    :param inputs: Files the command reads, to record how much data went in.
+    :param outputs: Files the command writes.
+    :param timeout: Seconds to let it run.
+    :param semaphore: Held while the command runs.
+    """
+    command = [str(x) for x in command]
+    async with _limit(semaphore):
+        input_bytes = _size(inputs)
+        start_time = time.time()
+        start = time.perf_counter()
+        # in its own process group, so the whole tree can be killed (runtandem and singularity start children)
+        p = await asyncio.create_subprocess_exec(*command, start_new_session=True)
+        try:
+            returncode = await asyncio.wait_for(p.wait(), timeout)
+        except BaseException:
+            if p.returncode is None:
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await p.wait()
+            raise
+        wall_time = time.perf_counter() - start
+
+    record = Record(step=step or Path(command[0]).name,
+                    command=command,
+                    returncode=returncode,
+                    start_time=start_time,
+                    wall_time=wall_time,
+                    user_time=float('nan'),
+                    system_time=float('nan'),
+                    max_rss_mb=float('nan'),
+                    input_bytes=input_bytes,
+                    output_bytes=_size(outputs),
+                    block_read_bytes=0,
+                    block_write_bytes=0)
+    _emit(record)
+    return record
+
+
+async def _check(command: List[str], tool: str, **kwargs):
+    result = await run_command(command, **kwargs)
+    if result.returncode != 0:
+        raise SubprocessError(f'Something went wrong while running {tool}. Inspect the above output.')
+
+
+async def gather(function: Callable[..., Awaitable],
+                 items: Iterable,
+                 max_parallel: int = None,
+                 description: str = 'task') -> List:
+    """
+    The asyncio version of proteotools.parallel.run_parallel: await function(item) for every item, up to max_parallel
+    at once, and return the results in input order. A failing item does not stop the others. Once everything has
+    finished, a SubprocessError listing every failed item is raised.
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(max_parallel) if max_parallel else None
+
+    async def one(item):
+        async with _limit(semaphore):
+            return await function(item)
+
+    results = await asyncio.gather(*(one(item) for item in items), return_exceptions=True)
+    failures = []
+    for item, result in zip(items, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, Exception):
+            print(f'{description} failed for {item}: {result}')
+            failures.append((item, result))
+
+    if failures:
+        failed = '\n'.join(f'  {item}: {e}' for item, e in failures)
+        raise SubprocessError(f'{len(failures)} of {len(results)} {description} runs failed:\n{failed}')
+    return results
+
+
+async def run_tool(tool: str,
+                   command: Union[str, List[str]],
+                   path_to_bind: Union[str, PathLike] = '~/',
+                   inputs: List[Union[str, PathLike]] = (),
+                   outputs: List[Union[str, PathLike]] = (),
+                   timeout: float = None,
+                   semaphore: asyncio.Semaphore = None):
+    """
+    Run a TPP tool in the TPP container. See tpp.run_tool.
+    """
+    check_for_singularity()
+    result = await run_command(_tool_command(tool, command, path_to_bind), step=tool, inputs=inputs,
+                               outputs=outputs, timeout=timeout, semaphore=semaphore)
+    if result.returncode != 0:
+        raise SubprocessError(f'There was an error running {tool}. See the above output.')
+
+
+async def run_thermorawfileparser(input: Union[str, PathLike, List[Union[str, PathLike]]],
+                                  output_directory: Union[str, PathLike] = None,
+                                  format: Literal['mgf', 'mzml', 'indexed_mzml', 'parquet'] = 'indexed_mzml',
+                                  metadata_output_file: Union[str, PathLike] = None,
+                                  gzip_output: bool = False,
+                                  no_peak_picking: bool = False,
+                                  no_zlib_compression: bool = False,
+                                  clobber: bool = False,
+                                  max_parallel: int = 1,
+                                  timeout: float = None,
+                                  semaphore: asyncio.Semaphore = None) -> List[str]:
+    """
+    Convert raw files with ThermoRawFileParser. See convert.run_thermorawfileparser.
+    """
+    check_for_thermorawfileparser()
+    raw_files = _raw_files(input)
+
+    async def convert(raw_file):
+        command, mzml = _thermorawfileparser_command(raw_file, output_directory, format,
+                                                     _metadata_file(metadata_output_file, raw_file, len(raw_files)),
+                                                     gzip_output, no_peak_picking, no_zlib_compression)
+        if clobber or not mzml.exists():
+            await _check(command, 'ThermoRawFileParser', step='ThermoRawFileParser', inputs=[raw_file],
+                         outputs=[mzml], timeout=timeout, semaphore=semaphore)
+        return str(mzml)
+
+    return await gather(convert, raw_files, max_parallel=max_parallel, description='ThermoRawFileParser')
+
+
+async def comet(parameter_file,
+                fasta,
+                mzml_files,
+                max_parallel: int = 1,
+                threads: int = None,
+                timeout: float = None,
+                semaphore: asyncio.Semaphore = None) -> List[str]:
+    """
+    Search mzML files with Comet. See search.comet.
+
+    :return: The pepXML files, in the same order as mzml_files.
+    """
+    check_for_comet()
+
+    if isinstance(mzml_files, str):
+        mzml_files = [mzml_files]
+
+    if max_parallel > 1 or threads is not None:
+        max_parallel, threads = budget(max_parallel, threads)
+        run_parameters = _comet_parameters_with_threads(parameter_file, threads)
+    else:
+        run_parameters = parameter_file
+
+    async def search(mzml):
+        command, name = _comet_command(mzml, run_parameters, fasta)
+        await _check(command, 'Comet', step='Comet', inputs=[mzml, fasta], outputs=[f'{name}.pep.xml'],
+                     timeout=timeout, semaphore=semaphore)
+        Path(f'{name}.pep.xml').rename(name.parent / f'{name}.pepXML')
+        return str(name.parent / f'{name}.pepXML')
+
+    try:
+        return await gather(search, mzml_files, max_parallel=max_parallel, description='Comet')
+    finally:
+        if run_parameters != parameter_file:
+            os.remove(run_parameters)
+
+
+async def msgfplus(parameter_file,
+                   fasta,
+                   mzml_files,
+                   decoy_prefix: str = 'rev_',
+                   convert_to_pepxml: bool = True,
+                   memory: str = '6000M',
+                   max_parallel: int = 1,
+                   threads: int = None,
+                   timeout: float = None,
+                   semaphore: asyncio.Semaphore = None,
+                   pepxml_converter: str = 'native') -> List[str]:
+    """
+    Search mzML files with MS-GF+. See search.msgfplus. The conversion of one file to pepXML runs while the next
+    files are being searched; the native converter runs in the event loop's default executor.
+
+    :return: The pepXML files, in the same order as mzml_files (empty if convert_to_pepxml is False).
+    """
+    check_for_msgfplus()
+
+    if pepxml_converter not in ('native', 'idconvert'):
+        raise ValueError(f"pepxml_converter must be 'native' or 'idconvert', not {pepxml_converter!r}.")
+
+    if isinstance(mzml_files, str):
+        mzml_files = [mzml_files]
+
+    if max_parallel > 1 or threads is not None:
+        max_parallel, threads = budget(max_parallel, threads, memory=memory)
+
+    # converting is cheap next to a search, so it doesn't take one of the max_parallel search slots
+    searches = asyncio.Semaphore(max_parallel)
+
+    async def search(mzml):
+        command, mzid = _msgfplus_command(mzml, parameter_file, fasta, decoy_prefix, memory, threads)
+        async with searches:
+            await _check(command, 'MS-GF+', step='MS-GF+', inputs=[mzml, fasta], outputs=[mzid],
+                         timeout=timeout, semaphore=semaphore)
+        if not convert_to_pepxml:
+            return None
+        if pepxml_converter == 'native':
+            return await asyncio.get_running_loop().run_in_executor(None, mzid_to_pepxml, mzid)
+        command, pepxml = _idconvert_command(mzid)
+        await _check(command, 'idconvert', step='idconvert', inputs=[mzid], outputs=[pepxml], timeout=timeout,
+                     semaphore=semaphore)
+        return str(pepxml)
+
+    pepxml_results = await gather(search, mzml_files, description='MS-GF+')
+    return [x for x in pepxml_results if x is not None]
+
+
+async def msconvert_to_mgf(ms_files,
+                           overwrite_existing_mgf: bool = False,
+                           max_parallel: int = None,
+                           timeout: float = None,
+                           semaphore: asyncio.Semaphore = None) -> List[str]:
+    """
+    Convert MS files to MGF using msconvert from the TPP image. See search.msconvert_to_mgf.
+    """
+    if isinstance(ms_files, str):
+        ms_files = [ms_files]
+
+    async def convert(ms_file):
+        mgf = Path(ms_file).with_suffix('.mgf')
+        if Path(ms_file).suffix.lower() != '.mgf' and (overwrite_existing_mgf or not mgf.exists()):
+            await run_tool('msconvert', f'-o {Path(ms_file).parent} --mgf {ms_file}', Path(ms_file).parent,
+                           inputs=[ms_file], outputs=[mgf], timeout=timeout, semaphore=semaphore)
+        return str(mgf)
+
+    return await gather(convert, ms_files, max_parallel=max_parallel, description='msconvert')
+
+
+async def tandem(parameter_file,
+                 fasta,
+                 ms_files,
+                 convert_to_mgf: bool = True,
+                 overwrite_existing_mgf: bool = False,
+                 timeout: float = None,
+                 semaphore: asyncio.Semaphore = None) -> List[str]:
+    """
+    Search MS files with X! Tandem. See search.tandem. The Tandem2XML conversions run at the same time.
+
+    :return: The pepXML files, in the same order as ms_files.
+    """
+    check_for_tandem()
+
+    if isinstance(ms_files, str):
+        ms_files = [ms_files]
+
+    output_dir = Path(ms_files[0]).expanduser().parent
+    if convert_to_mgf and Path(ms_files[0]).suffix not in ['.mgf', '.MGF']:
+        ms_files = await msconvert_to_mgf(ms_files, overwrite_existing_mgf=overwrite_existing_mgf, timeout=timeout,
+                                          semaphore=semaphore)
+
+    txml_files = [output_dir / (Path(x).stem + '.t.xml') for x in ms_files]
+    pepxml_results = [str(x).replace('.t.xml', '-tandem.pepXML') for x in txml_files]
+
+    await _check(_runtandem_command(parameter_file, fasta, output_dir, ms_files), 'X! Tandem', step='X! Tandem',
+                 inputs=[*ms_files, fasta], outputs=txml_files, timeout=timeout, semaphore=semaphore)
+
+    async def tandem2xml(i):
+        await run_tool('Tandem2XML', f'{txml_files[i]} {pepxml_results[i]}', path_to_bind=Path(ms_files[i]).parent,
+                       inputs=[txml_files[i]], outputs=[pepxml_results[i]], timeout=timeout, semaphore=semaphore)
+
+    await gather(tandem2xml, range(len(ms_files)), description='Tandem2XML')
+    return pepxml_results
+
+
+async def run_prophets(pepxml_files: List[Union[str, PathLike]],
+                       fasta: Union[str, PathLike],
+                       decoy_tag: str = 'rev_',
+                       enzyme: str = 'nonspecific',
+                       peptide_prophet_flags: List[str] = ('ZERO', 'NONPARAM', 'DECOYPROBS'),
+                       iprophet_flags: List[str] = None,
+                       iprophet_out_filename: str = 'interact-iproph.pep.xml',
+                       threads: int = 12,
+                       iprophet_minprob: float = 0,
+                       mzml_directory: Union[str, PathLike] = None,
+                       skip_existing_interact_pepxmls: bool = True,
+                       max_peptide_rank: int = 1,
+                       timeout: float = None,
+                       semaphore: asyncio.Semaphore = None) -> Path:
+    """
+    InteractParser, PeptideProphetParser and InterProphetParser. See tpp.run_prophets.
+
+    :return: The iProphet output file.
+    """
+    if mzml_directory is None:
+        mzml_directory = Path(pepxml_files[0]).parent
+
+    if skip_existing_interact_pepxmls:
+        pepxml_files = [x for x in pepxml_files if not Path(x).name.startswith('interact-')]
+
+    async def interact_and_prophet(pepxml):
+        directory, bind_point = _interactparser_bind([pepxml], fasta, mzml_directory)
+        command, output = _interactparser_command(pepxml, fasta, enzyme, directory, max_peptide_rank)
+        await run_tool('InteractParser', command, path_to_bind=bind_point, inputs=[pepxml], outputs=[output],
+                       timeout=timeout, semaphore=semaphore)
+        await run_tool('PeptideProphetParser', _peptideprophet_command(output, decoy_tag, peptide_prophet_flags),
+                       path_to_bind=output.parent, inputs=[output], timeout=timeout, semaphore=semaphore)
+        return output
+
+    interact_files = await gather(interact_and_prophet, pepxml_files, max_parallel=threads,
+                                  description='InteractParser/PeptideProphet')
+
+    command, bind_point, output_file = _iprophet_command(interact_files, decoy_tag, threads, iprophet_minprob,
+                                                         iprophet_out_filename, iprophet_flags)
+    await run_tool('InterProphetParser', command, path_to_bind=bind_point, inputs=interact_files,
+                   outputs=[output_file], timeout=timeout, semaphore=semaphore)
+    return output_file
@@ -0,0 +1,256 @@
+from proteotools import config
+from pathlib import Path
+from os import PathLike
+from typing import Callable, Dict, List, Union, Iterable
+from contextlib import contextmanager
+import threading
+import hashlib
+import fcntl
+import json
+import shutil
+import time
+import os
+
+MAX_CACHE_SIZE = 100 * 1024 ** 3  # bytes
+
+_lock = threading.Lock()
+
+# path -> [path, size, modification time, SHA-256] of the files hashed with file_hash(..., write=False)
+_in_memory: Dict[str, list] = {}
+
+
+def _objects() -> Path:
+    return config.cache_dir() / 'objects'
+
+
+def _hashes() -> Path:
+    return config.cache_dir() / 'hashes'
+
+
+@contextmanager
+def _locked_manifest():
+    """
+    Open the manifest for reading and writing, holding a lock so concurrent threads and processes don't clobber
+    each other's changes.
+    """
+    cache_dir = config.cache_dir()
+    manifest_file = cache_dir / 'manifest.json'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with _lock, open(cache_dir / 'manifest.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if manifest_file.exists():
+                manifest = json.loads(manifest_file.read_text())
+            else:
+                manifest = {'entries': {}}
+            manifest.pop('hashes', None)  # file hashes used to be kept here, see file_hash
+            before = json.dumps(manifest)
+            yield manifest
+            after = json.dumps(manifest)
+            if after != before:
+                tmp = manifest_file.with_suffix(f'.tmp{os.getpid()}')
+                tmp.write_text(after)
+                os.replace(tmp, manifest_file)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _sha256(path: Union[str, PathLike]) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_hash_record(record: Path):
+    try:
+        return json.loads(record.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def file_hash(path: Union[str, PathLike], write: bool = True) -> str:
+    """
+    SHA-256 of a file. Hashes are remembered along with the file size and modification time, so unchanged files are
+    only read once. Each file has its own small record in the cache directory, replaced atomically, so this neither
+    takes the manifest lock nor rewrites the manifest.
+
+    :param path: The file.
+    :param write: Record the hash in the cache directory. If False, nothing is written and the hash is only
+        remembered in memory, for callers that don't use the cache and may have a read-only tool directory.
+    """
+    path = Path(path).expanduser().resolve()
+    stat = path.stat()
+    fingerprint = [stat.st_size, stat.st_mtime_ns]
+    record = _hashes() / hashlib.sha256(str(path).encode()).hexdigest()
+
+    for known in (_in_memory.get(str(path)), _read_hash_record(record)):
+        if known is not None and known[0] == str(path) and known[1:3] == fingerprint:
+            return known[3]
+
+    sha = _sha256(path)
+    if not write:
+        _in_memory[str(path)] = [str(path)] + fingerprint + [sha]
+        return sha
+    record.parent.mkdir(parents=True, exist_ok=True)
+    tmp = record.with_name(f'{record.name}.tmp{os.getpid()}.{threading.get_ident()}')
+    tmp.write_text(json.dumps([str(path)] + fingerprint + [sha]))
+    os.replace(tmp, record)
+    return sha
+
+
+def cache_key(tool: str,
+              inputs: Iterable[Union[str, PathLike]],
+              outputs: Iterable[Union[str, PathLike]],
+              arguments: Iterable = ()) -> str:
+    """
+    Key for one tool run: a hash of the tool name, the contents of the input files (which should include the tool
+    executable itself, so that a new version gives a new key), where the outputs go (tools like to write their own
+    paths into their output) and any other arguments that change the output.
+    """
+    description = {'tool': tool,
+                   'inputs': [file_hash(x) for x in inputs],
+                   'outputs': [str(Path(x).expanduser().resolve()) for x in outputs],
+                   'arguments': [str(x) for x in arguments]}
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def _store(path: Path, sha: str):
+    objects = _objects()
+    objects.mkdir(parents=True, exist_ok=True)
+    obj = objects / sha
+    if obj.exists():
+        return
+    tmp = objects / f'{sha}.tmp{os.getpid()}.{threading.get_ident()}'
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copy2(path, tmp)
+    os.replace(tmp, obj)
+
+
+def _restore(path: Path, sha: str) -> bool:
+    if path.exists() and file_hash(path) == sha:
+        return True
+    obj = _objects() / sha
+    if not obj.exists() or _sha256(obj) != sha:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.proteotools-tmp')
+    shutil.copy2(obj, tmp)
+    os.replace(tmp, path)
+    print(f'Restored {path} from the cache')
+    return True
+
+
+def cached(tool: str,
+           inputs: List[Union[str, PathLike]],
+           outputs: List[Union[str, PathLike]],
+           run: Callable[[], None],
+           arguments: Iterable = (),
+           max_size: int = MAX_CACHE_SIZE) -> bool:
+    """
+    Run a tool unless the cache already has its outputs for exactly these inputs and arguments.
+
+    On a hit, the outputs are left alone if they are already in place and unchanged, or restored from the cache if
+    they were deleted or modified. On a miss, run() is called and the outputs it wrote are added to the cache.
+
+    :param tool: Name of the step, e.g. 'Comet'.
+    :param inputs: Every file the output depends on, including the tool executable or image.
+    :param outputs: The files run() writes.
+    :param run: Does the actual work.
+    :param arguments: Anything else that changes the output (options, flags, etc.).
+    :param max_size: Once the cache holds more than this many bytes, the least recently used results are evicted.
+    :return: True if the result came from the cache.
+    """
+    key = cache_key(tool, inputs, outputs, arguments)
+    outputs = [Path(x).expanduser().resolve() for x in outputs]
+
+    with _locked_manifest() as manifest:
+        entry = manifest['entries'].get(key)
+
+    if entry is not None:
+        if all(_restore(path, sha) for path, sha in zip(outputs, entry['hashes'])):
+            with _locked_manifest() as manifest:
+                if key in manifest['entries']:
+                    manifest['entries'][key]['last_used'] = time.time()
+            print(f'{tool}: using cached result for {", ".join(x.name for x in outputs)}')
+            return True
+
+    run()
+
+    hashes = []
+    for path in outputs:
+        sha = file_hash(path)
+        _store(path, sha)
+        hashes.append(sha)
+
+    with _locked_manifest() as manifest:
+        manifest['entries'][key] = {'tool': tool,
+                                    'outputs': [str(x) for x in outputs],
+                                    'hashes': hashes,
+                                    'sizes': [x.stat().st_size for x in outputs],
+                                    'last_used': time.time()}
+        _evict(manifest, max_size)
+
+    return False
+
+
+def _evict(manifest: dict, max_size: int):
+    """
+    Drop the least recently used entries until the stored objects fit in max_size bytes.
+    """
+    sizes = {}
+    for entry in manifest['entries'].values():
+        sizes.update(zip(entry['hashes'], entry['sizes']))
+    total = sum(sizes.values())
+
+    objects = _objects()
+    for key, entry in sorted(manifest['entries'].items(), key=lambda x: x[1]['last_used']):
+        if total <= max_size:
+            break
+        del manifest['entries'][key]
+        still_used = {sha for e in manifest['entries'].values() for sha in e['hashes']}
+        for sha in set(entry['hashes']) - still_used:
+            (objects / sha).unlink(missing_ok=True)
+            total -= sizes.get(sha, 0)
+
+
+def _prune_hashes():
+    """
+    Forget the hashes of files that were deleted or changed since they were hashed.
+    """
+    if not _hashes().exists():
+        return
+    for record in _hashes().iterdir():
+        if '.tmp' in record.name:
+            continue  # being written by file_hash
+        known = _read_hash_record(record)
+        try:
+            stat = os.stat(known[0])
+            stale = [stat.st_size, stat.st_mtime_ns] != known[1:3]
+        except (OSError, TypeError, IndexError):
+            stale = True
+        if stale:
+            record.unlink(missing_ok=True)
+
+
+def evict(max_size: int = MAX_CACHE_SIZE):
+    """
+    Shrink the cache to at most max_size bytes, removing the least recently used results first, and forget the
+    hashes of files that no longer exist.
+    """
+    with _locked_manifest() as manifest:
+        _evict(manifest, max_size)
+    _prune_hashes()
+
+
+def clear():
+    """
+    Remove everything from the cache.
+    """
+    with _locked_manifest() as manifest:
+        manifest['entries'] = {}
+        shutil.rmtree(_objects(), ignore_errors=True)
+        shutil.rmtree(_hashes(), ignore_errors=True)
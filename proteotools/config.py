@@ -0,0 +1,106 @@
+"""
+Where proteotools keeps its tools and data. Everything is looked up when it is used rather than when proteotools is
+imported, so it can be changed at any time, and importing proteotools never touches the filesystem.
+
+Each setting comes from, in this order:
+
+1. an environment variable, PROTEOTOOLS_<SETTING> (e.g. PROTEOTOOLS_TOOL_DIR, PROTEOTOOLS_COMET)
+2. the [proteotools] section of the config file, ~/.proteotools.ini or whatever PROTEOTOOLS_CONFIG points to
+3. the default, under ~/.proteotools_software
+
+For example, to use a shared read-only installation and keep the cache and databases in your home directory:
+
+    [proteotools]
+    tool_dir = /shared/software/proteotools
+    cache_dir = ~/.proteotools_cache
+    database_dir = ~/.proteotools_databases
+    comet = /shared/software/comet/comet.linux.exe
+
+Tool paths that are relative are taken to be inside tool_dir.
+"""
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import threading
+import os
+
+DEFAULT_TOOL_DIR = '~/.proteotools_software'
+DEFAULT_CONFIG_FILE = '~/.proteotools.ini'
+
+# setting -> default location inside the tool directory
+TOOLS = {'comet': 'comet/comet.linux.exe',
+         'msgf': 'msgfplus/MSGFPlus.jar',
+         'tandem': 'tandem/bin/static_link_ubuntu/tandem.exe',
+         'tpp': 'tpp/tpp_6-0-0.sif',
+         'thermorawfileparser': 'ThermoRawFileParser/ThermoRawFileParser.exe',
+         'proteowizard': 'proteowizard/proteowizard'}
+
+_lock = threading.Lock()
+_parsed: Tuple[Optional[tuple], Dict[str, str]] = (None, {})
+
+
+def config_file() -> Path:
+    return Path(os.environ.get('PROTEOTOOLS_CONFIG', DEFAULT_CONFIG_FILE)).expanduser()
+
+
+def _file_settings() -> Dict[str, str]:
+    """
+    The settings in the config file. It is only parsed again when it changes.
+    """
+    global _parsed
+    path = config_file()
+    try:
+        stat = path.stat()
+    except OSError:
+        return {}
+    version = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if _parsed[0] != version:
+            from configparser import ConfigParser
+            parser = ConfigParser()
+            parser.read(path)
+            _parsed = (version, dict(parser['proteotools']) if parser.has_section('proteotools') else {})
+        return _parsed[1]
+
+
+def setting(name: str) -> Optional[str]:
+    """
+    The value of a setting (e.g. 'tool_dir' or 'comet'), or None if it isn't set.
+    """
+    value = os.environ.get(f'PROTEOTOOLS_{name.upper()}')
+    if value:
+        return value
+    return _file_settings().get(name.lower()) or None
+
+
+def tool_dir() -> Path:
+    """
+    The directory the tools are installed in.
+    """
+    return Path(setting('tool_dir') or DEFAULT_TOOL_DIR).expanduser()
+
+
+def cache_dir() -> Path:
+    return Path(setting('cache_dir')).expanduser() if setting('cache_dir') else tool_dir() / 'cache'
+
+
+def database_dir() -> Path:
+    return Path(setting('database_dir')).expanduser() if setting('database_dir') else tool_dir() / 'databases'
+
+
+def default_tool_path(tool: str) -> Path:
+    """
+    Where download_all installs a tool, whatever its setting says.
+    """
+    return tool_dir() / TOOLS[tool]
+
+
+def tool_path(tool: str) -> Path:
+    """
+    The path of a tool: one of 'comet', 'msgf', 'tandem', 'tpp', 'thermorawfileparser' or 'proteowizard'.
+    """
+    if tool not in TOOLS:
+        raise ValueError(f'Unknown tool {tool}. Choose from {", ".join(TOOLS)}.')
+    path = setting(tool)
+    if path is None:
+        return default_tool_path(tool)
+    return tool_dir() / Path(path).expanduser()  # an absolute path stays as it is
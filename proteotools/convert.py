@@ -1,9 +1,101 @@
-from proteotools import THERMORAWFILEPARSER
+from proteotools import config
 from proteotools.software import check_for_thermorawfileparser
-from typing import List, Union, Literal
+from proteotools.journal import Journal, run_step
+from proteotools.parallel import run_parallel
+from proteotools.execute import run_command
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Union, Literal, Iterator
 from os import PathLike
 from pathlib import Path
-from subprocess import Popen, SubprocessError
+from subprocess import SubprocessError
+
+possible_formats = ['mgf', 'mzml', 'indexed_mzml', 'parquet']
+_extensions = {'mgf': '.mgf', 'mzml': '.mzML', 'indexed_mzml': '.mzML', 'parquet': '.parquet'}
+
+
+def _raw_files(input: Union[str, PathLike, List[Union[str, PathLike]]]) -> List[Path]:
+    if isinstance(input, (str, PathLike)):
+        input = [input]
+
+    raw_files = []
+    for i in input:
+        i = Path(i)
+        if i.is_dir():
+            raw_files += sorted(i.glob('*.raw'))
+        else:
+            raw_files.append(i)
+    return raw_files
+
+
+def _metadata_file(metadata_output_file: Union[str, PathLike, None], raw_file: Path, n_raw_files: int):
+    """
+    Where the metadata of raw_file goes. With more than one raw file each gets its own file, named after the raw file
+    (metadata.json -> metadata-sample1.json), as the conversions may run at the same time.
+    """
+    if metadata_output_file is None or n_raw_files <= 1:
+        return metadata_output_file
+    path = Path(metadata_output_file)
+    return path.with_name(f'{path.stem}-{Path(raw_file).stem}{path.suffix}')
+
+
+def _command(raw_file: Path,
+             output_directory: Union[str, PathLike],
+             format: str,
+             metadata_output_file: Union[str, PathLike],
+             gzip_output: bool,
+             no_peak_picking: bool,
+             no_zlib_compression: bool):
+    """
+    The ThermoRawFileParser command line for raw_file and the file it will write, e.g. sample.mzML, sample.mgf or,
+    gzipped, sample.mzML.gz.
+    """
+    if output_directory is None:
+        out_dir = raw_file.parent
+    else:
+        out_dir = Path(output_directory)
+    extension = _extensions[format] + ('.gz' if gzip_output else '')
+    output = out_dir / raw_file.with_suffix(extension).name
+    command = f'mono {config.tool_path("thermorawfileparser")} -i {raw_file} -o {out_dir} ' \
+              f'-f {possible_formats.index(format)}'
+    if metadata_output_file is not None:
+        command += f' -c {metadata_output_file}'
+    if gzip_output is True:
+        command += ' -g'
+    if no_peak_picking is True:
+        command += ' -p'
+    if no_zlib_compression is True:
+        command += ' -z'
+    return command.split(), output
+
+
+def _convert(raw_file: Path,
+             output_directory: Union[str, PathLike] = None,
+             format: Literal['mgf', 'mzml', 'indexed_mzml', 'parquet'] = 'indexed_mzml',
+             metadata_output_file: Union[str, PathLike] = None,
+             gzip_output: bool = False,
+             no_peak_picking: bool = False,
+             no_zlib_compression: bool = False,
+             clobber: bool = False,
+             use_cache: bool = False,
+             journal: Journal = None) -> str:
+    command, output = _command(raw_file, output_directory, format, metadata_output_file, gzip_output,
+                               no_peak_picking, no_zlib_compression)
+    # with a journal, an existing file is only trusted if the journal says it was finished
+    if not clobber and journal is None:
+        if output.exists():
+            return str(output)
+
+    def run():
+        result = run_command(command, step='ThermoRawFileParser', inputs=[raw_file], outputs=[output])
+        if result.returncode != 0:
+            raise SubprocessError('Something went wrong while running ThermoRawFileParser. '
+                                  'Inspect the above output.')
+
+    run_step('ThermoRawFileParser', inputs=[raw_file, config.tool_path('thermorawfileparser')], outputs=[output],
+             run=run, arguments=[format, gzip_output, no_peak_picking, no_zlib_compression], use_cache=use_cache,
+             journal=journal)
+
+    return str(output)
 
 
 def run_thermorawfileparser(input: Union[str, PathLike, List[Union[str, PathLike]]],
@@ -13,48 +105,78 @@ def run_thermorawfileparser(input: Union[str, PathLike, List[Union[str, PathLike
                             gzip_output: bool = False,
                             no_peak_picking: bool = False,
                             no_zlib_compression: bool = False,
-                            clobber: bool = False) -> List[str]:
+                            clobber: bool = False,
+                            use_cache: bool = False,
+                            max_parallel: int = 1,
+                            journal: Journal = None) -> List[str]:
+    """
+    Convert raw files with ThermoRawFileParser.
+
+    :param input: A raw file, a directory of raw files, or a list of either.
+    :param metadata_output_file: Also write the metadata of the raw file here. With several raw files, each gets
+        its own file with the raw file name added, e.g. metadata-sample1.json.
+    :param max_parallel: How many ThermoRawFileParser processes to run at once.
+    :param journal: Skip files the journal says were already converted (see proteotools.journal).
+    :return: The converted files, in input order.
+    """
     check_for_thermorawfileparser()
-    mzml_files: List[str] = []
-    possible_formats = ['mgf', 'mzml', 'indexed_mzml', 'parquet']
+    raw_files = _raw_files(input)
 
-    if isinstance(input, (str, PathLike)):
-        input = Path(input)
+    return run_parallel(lambda raw_file: _convert(raw_file, output_directory, format,
+                                                  _metadata_file(metadata_output_file, raw_file, len(raw_files)),
+                                                  gzip_output, no_peak_picking, no_zlib_compression, clobber,
+                                                  use_cache, journal),
+                        raw_files,
+                        max_parallel=max_parallel,
+                        description='ThermoRawFileParser')
 
-    if isinstance(input, Path):
-        input = [input]
 
-    for i in input:
-        if i.is_dir():
-            file_list = i.glob('*.raw')
-        else:
-            file_list = [i]
-
-        for raw_file in file_list:
-            if not clobber:
-                if raw_file.with_suffix('.mzML').exists():
-                    mzml_files.append(str(raw_file.with_suffix('.mzML')))
-                    continue
-            if output_directory is None:
-                out_dir = raw_file.parent
-            else:
-                out_dir = output_directory
-            command = f'mono {THERMORAWFILEPARSER} -i {raw_file} -o {out_dir} -f {possible_formats.index(format)}'
-            if metadata_output_file is not None:
-                command += f' -c {metadata_output_file}'
-            if gzip_output is True:
-                command += ' -g'
-            if no_peak_picking is True:
-                command += ' -p'
-            if no_zlib_compression is True:
-                command += ' -z'
-
-            p = Popen(command.split())
-            _ = p.communicate()
-            if p.returncode != 0:
-                raise SubprocessError('Something went wrong while running ThermoRawFileParser. '
-                                      'Inspect the above output.')
-
-            mzml_files.append(str(raw_file.with_suffix('.mzML')))
-
-    return mzml_files
+def iter_thermorawfileparser(input: Union[str, PathLike, List[Union[str, PathLike]]],
+                             output_directory: Union[str, PathLike] = None,
+                             format: Literal['mgf', 'mzml', 'indexed_mzml', 'parquet'] = 'indexed_mzml',
+                             metadata_output_file: Union[str, PathLike] = None,
+                             gzip_output: bool = False,
+                             no_peak_picking: bool = False,
+                             no_zlib_compression: bool = False,
+                             clobber: bool = False,
+                             use_cache: bool = False,
+                             max_parallel: int = 1,
+                             journal: Journal = None) -> Iterator[str]:
+    """
+    Like run_thermorawfileparser, but yields each converted file as soon as it is written instead of waiting for all
+    of them. Files come out in the order they finish. If any conversions fail, a SubprocessError is raised after
+    every other file has been yielded.
+
+    The generator can be passed straight to search.comet() or search.msgfplus(), which start searching each file as
+    soon as it arrives:
+
+        mzml_files = convert.iter_thermorawfileparser(raw_directory, max_parallel=8)
+        search.comet(parameter_file, fasta, mzml_files, max_parallel=8)
+
+    :param input: A raw file, a directory of raw files, or a list of either.
+    :param metadata_output_file: Also write the metadata of the raw file here. With several raw files, each gets
+        its own file with the raw file name added, e.g. metadata-sample1.json.
+    :param max_parallel: How many ThermoRawFileParser processes to run at once.
+    :param journal: Skip files the journal says were already converted (see proteotools.journal).
+    """
+    check_for_thermorawfileparser()
+    failures = []
+    raw_files = _raw_files(input)
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_parallel))) as executor:
+        futures = {executor.submit(_convert, raw_file, output_directory, format,
+                                   _metadata_file(metadata_output_file, raw_file, len(raw_files)), gzip_output,
+                                   no_peak_picking, no_zlib_compression, clobber, use_cache, journal): raw_file
+                   for raw_file in raw_files}
+        for future in as_completed(futures):
+            try:
+                mzml = future.result()
+            except Exception as e:
+                print(f'ThermoRawFileParser failed for {futures[future]}: {e}')
+                failures.append((futures[future], e))
+                continue
+            yield mzml
+
+    if failures:
+        failed = '\n'.join(f'  {raw_file}: {e}' for raw_file, e in failures)
+        raise SubprocessError(f'{len(failures)} ThermoRawFileParser runs failed:\n{failed}')
@@ -0,0 +1,121 @@
+from proteotools import config
+from proteotools.software import check_for_msgfplus
+from proteotools.cache import file_hash
+from proteotools.execute import run_command
+from proteotools.fasta import write_target_decoy
+from contextlib import contextmanager
+from subprocess import SubprocessError
+from pathlib import Path
+from os import PathLike
+from typing import Union, Dict
+import threading
+import fcntl
+import json
+import os
+import re
+
+MSGF_INDEX_SUFFIXES = ['.canno', '.cseq', '.csarr', '.cnlcp']
+
+# lock file -> a lock for the threads of this process, which flock alone doesn't keep apart on every filesystem
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(directory: Path):
+    """
+    Hold a lock on one prepared database (or one FASTA file), so that concurrent threads and processes (also on other
+    nodes, if the filesystem supports flock) build it only once and never see it half built.
+    """
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    lock_path = str(directory.with_name(directory.name + '.lock').resolve())
+    with _locks_lock:
+        lock = _locks.setdefault(lock_path, threading.Lock())
+    with lock, open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_manifest(manifest: Path, built: dict):
+    tmp = manifest.with_name(f'.{manifest.name}.tmp{os.getpid()}')
+    tmp.write_text(json.dumps(built))
+    os.replace(tmp, manifest)
+
+
+def _msgfplus_index(fasta: Path, memory: str):
+    command = ['java', f'-Xmx{memory}', '-cp', config.tool_path('msgf'), 'edu.ucsd.msjava.msdbsearch.BuildSA',
+               '-d', fasta, '-tda', '0']
+    result = run_command(command, step='BuildSA', inputs=[fasta],
+                         outputs=[fasta.with_suffix(x) for x in MSGF_INDEX_SUFFIXES])
+    if result.returncode != 0:
+        raise SubprocessError('Something went wrong while building the MS-GF+ index. Inspect the above output.')
+
+
+def build_msgfplus_index(fasta: Union[str, PathLike], memory: str = '6000M'):
+    """
+    Build the MS-GF+ suffix array index next to a FASTA file (with -tda 0, so decoys must be in it), unless it is
+    already there. Concurrent calls for the same file wait for one build instead of each writing the same index files.
+
+    :param fasta: The FASTA file.
+    :param memory: JVM heap for building the index.
+    """
+    fasta = Path(fasta)
+    index = [fasta.with_suffix(x) for x in MSGF_INDEX_SUFFIXES]
+    with _locked(fasta):
+        if all(x.exists() and x.stat().st_mtime >= fasta.stat().st_mtime for x in index):
+            return
+        for x in index:
+            x.unlink(missing_ok=True)
+        _msgfplus_index(fasta, memory)
+
+
+def prepare_database(fasta: Union[str, PathLike],
+                     decoy_prefix: str = 'rev_',
+                     msgfplus_index: bool = True,
+                     memory: str = '6000M') -> str:
+    """
+    Make a target-decoy version of a FASTA file and, optionally, the MS-GF+ suffix array index for it, once. The
+    results are kept in ~/.proteotools_software/databases (see proteotools.config) under the hash of the FASTA file,
+    so every later call with the same FASTA contents (from any process) returns the same file right away, and MS-GF+
+    finds its index next to it instead of building it again for each search.
+
+    Pass the returned file as the database to comet, msgfplus and tandem. MS-GF+ is always run with -tda 0, so the
+    decoys have to be in the database, and run_prophets expects them to start with decoy_prefix.
+
+    :param fasta: The FASTA file, with or without decoys (existing decoys starting with decoy_prefix are replaced).
+    :param decoy_prefix: Prefix for the decoy proteins.
+    :param msgfplus_index: Also build the MS-GF+ index. It is rebuilt if the MS-GF+ jar changes.
+    :param memory: JVM heap for building the index.
+    :return: The target-decoy FASTA file.
+    """
+    fasta = Path(fasta).expanduser()
+    prefix = re.sub(r'[^A-Za-z0-9_.-]', '_', decoy_prefix)
+    directory = config.database_dir() / f'{file_hash(fasta, write=False)[:24]}-{prefix}'
+    target_decoy = directory / f'{fasta.stem}-target-decoy.fasta'
+    manifest = directory / 'database.json'
+
+    with _locked(directory):
+        built = json.loads(manifest.read_text()) if manifest.exists() else {}
+        if built.get('target_decoy') != target_decoy.name or not target_decoy.exists():
+            print(f'Writing target-decoy database for {fasta} to {target_decoy}')
+            directory.mkdir(parents=True, exist_ok=True)
+            write_target_decoy(fasta, target_decoy, decoy_prefix=decoy_prefix)
+            built = {'source': str(fasta.resolve()), 'decoy_prefix': decoy_prefix, 'target_decoy': target_decoy.name}
+            _write_manifest(manifest, built)
+
+        if msgfplus_index:
+            check_for_msgfplus()
+            msgf = file_hash(config.tool_path('msgf'), write=False)
+            index = [target_decoy.with_suffix(x) for x in MSGF_INDEX_SUFFIXES]
+            if built.get('msgfplus_index') != msgf or not all(x.exists() for x in index):
+                print(f'Building the MS-GF+ index for {target_decoy}')
+                for x in index:
+                    x.unlink(missing_ok=True)  # left over from a build that was interrupted, or an older MS-GF+
+                _msgfplus_index(target_decoy, memory)
+                built['msgfplus_index'] = msgf
+                _write_manifest(manifest, built)
+
+    return str(target_decoy)
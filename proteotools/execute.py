@@ -0,0 +1,175 @@
+from typing import Union, List, Callable, NamedTuple, Dict, Iterable
+from subprocess import Popen
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+import threading
+import json
+import math
+import time
+import os
+
+# functions called with the Record of every command run through run_command
+_hooks: List[Callable[['Record'], None]] = []
+_lock = threading.Lock()
+
+
+class Record(NamedTuple):
+    step: str
+    command: List[str]
+    returncode: int
+    start_time: float  # seconds since the epoch
+    wall_time: float  # seconds
+    user_time: float  # CPU seconds, summed over the process and the children it waited for
+    system_time: float
+    max_rss_mb: float  # peak resident memory of the largest process in the tree
+    input_bytes: int  # size of the input files given to run_command
+    output_bytes: int  # size of the output files given to run_command, after the command finished
+    block_read_bytes: int  # what the filesystem actually read from and wrote to disk
+    block_write_bytes: int
+
+    @property
+    def cpu_time(self) -> float:
+        return self.user_time + self.system_time
+
+
+def _size(paths: Iterable[Union[str, PathLike]]) -> int:
+    total = 0
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            total += sum(x.stat().st_size for x in path.rglob('*') if x.is_file())
+        elif path.exists():
+            total += path.stat().st_size
+    return total
+
+
+def _emit(record: Record):
+    with _lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        hook(record)
+
+
+def add_hook(hook: Callable[[Record], None]):
+    """
+    Call hook with the Record of every command run from now on. Hooks are called from whichever thread ran the
+    command, so they should be thread safe.
+    """
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[Record], None]):
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+@contextmanager
+def log_to(log_file: Union[str, PathLike]):
+    """
+    Append a JSON line for every command run inside the with block to log_file:
+
+        with execute.log_to('run.jsonl'):
+            search.run_all_with_defaults(...)
+
+    :param log_file: The file to append to.
+    """
+    log_file = Path(log_file)
+    file_lock = threading.Lock()
+
+    def write(record: Record):
+        line = json.dumps(record._asdict()) + '\n'
+        with file_lock, open(log_file, 'a') as f:
+            f.write(line)
+
+    add_hook(write)
+    try:
+        yield log_file
+    finally:
+        remove_hook(write)
+
+
+def run_command(command: List[str],
+                step: str = None,
+                inputs: Iterable[Union[str, PathLike]] = (),
+                outputs: Iterable[Union[str, PathLike]] = (),
+                **popen_kwargs) -> Record:
+    """
+    Run a command, wait for it to finish and measure what it used. The measurements come from wait4, so they cover
+    the process and every descendant it waited for (e.g. the tool running inside a Singularity container).
+
+    Nothing is raised if the command fails; check returncode.
+
+    :param command: The command line.
+    :param step: Name for the step in the records, e.g. 'Comet'. Defaults to the executable.
+    :param inputs: Files (or directories) the command reads, to record how much data went in.
+    :param outputs: Files (or directories) the command writes.
+    :param popen_kwargs: Passed on to Popen. Don't use stdout=PIPE or stderr=PIPE: nothing reads them.
+    :return: The Record, which is also passed to every hook.
+    """
+    command = [str(x) for x in command]
+    input_bytes = _size(inputs)
+
+    start_time = time.time()
+    start = time.perf_counter()
+    p = Popen(command, **popen_kwargs)
+    try:
+        _, status, usage = os.wait4(p.pid, 0)
+    except BaseException:
+        p.kill()
+        p.wait()
+        raise
+    wall_time = time.perf_counter() - start
+    # wait4 reaped the process, so tell Popen what happened to it
+    p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+    record = Record(step=step or Path(command[0]).name,
+                    command=command,
+                    returncode=p.returncode,
+                    start_time=start_time,
+                    wall_time=wall_time,
+                    user_time=usage.ru_utime,
+                    system_time=usage.ru_stime,
+                    max_rss_mb=usage.ru_maxrss / 1024,  # ru_maxrss is in kilobytes on Linux
+                    input_bytes=input_bytes,
+                    output_bytes=_size(outputs),
+                    block_read_bytes=usage.ru_inblock * 512,
+                    block_write_bytes=usage.ru_oublock * 512)
+
+    _emit(record)
+    return record
+
+
+def read_log(log_file: Union[str, PathLike]) -> List[Record]:
+    """
+    Read the Records written by log_to.
+    """
+    with open(log_file) as f:
+        return [Record(**json.loads(line)) for line in f if line.strip()]
+
+
+def summarize(records: Union[str, PathLike, List[Record]]) -> Dict[str, Dict[str, float]]:
+    """
+    Totals for each step: how many times it ran, wall and CPU time, the peak memory of any one run and the bytes
+    read and written. Sorted by total wall time, longest first, so the step that dominates a run is at the top.
+
+    :param records: A list of Records or a log file written by log_to.
+    """
+    if isinstance(records, (str, PathLike)):
+        records = read_log(records)
+
+    steps = {}
+    for r in records:
+        s = steps.setdefault(r.step, {'runs': 0, 'failed': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'max_rss_mb': 0.0,
+                                      'input_bytes': 0, 'output_bytes': 0})
+        s['runs'] += 1
+        s['failed'] += r.returncode != 0
+        s['wall_time'] += r.wall_time
+        if not math.isnan(r.cpu_time):  # NaN for commands run by proteotools.aio
+            s['cpu_time'] += r.cpu_time
+            s['max_rss_mb'] = max(s['max_rss_mb'], r.max_rss_mb)
+        s['input_bytes'] += r.input_bytes
+        s['output_bytes'] += r.output_bytes
+    return dict(sorted(steps.items(), key=lambda x: -x[1]['wall_time']))
@@ -0,0 +1,350 @@
+"""
+Executors that run the tool calls of comet, msgfplus, tandem and run_prophets somewhere other than this process:
+
+    LocalExecutor: worker processes on this machine.
+    CommandExecutor: one job per tool call, submitted with a shell command (srun, sbatch --wait, qsub -sync y, ...).
+    WorkQueueExecutor: workers on any machine that can reach this one connect over TCP and take tool calls from a
+        queue.
+
+They are all concurrent.futures.Executors, passed as executor=...:
+
+    executor = CommandExecutor('srun -N1 -c 8 --mem=16G {command}', work_directory='/shared/scratch/jobs')
+    search.comet(parameter_file, fasta, mzml_files, threads=8, executor=executor)
+
+Only the tool calls go to the executor. Caching, journals and merging results stay in this process. Files are passed
+by path, so the data, the FASTA file, the parameter files and ~/.proteotools_software have to be on a filesystem the
+workers share. The measurements of the tools (proteotools.execute) come back with the results and are passed to the
+hooks here.
+
+Workers for CommandExecutor and WorkQueueExecutor are started with this module:
+
+    python -m proteotools.executors worker HOST:PORT
+    python -m proteotools.executors run TASK_FILE
+"""
+from proteotools.execute import Record, add_hook, remove_hook, _emit
+from proteotools.parallel import available_cores
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+from subprocess import SubprocessError
+from argparse import ArgumentParser
+from collections import deque
+from os import PathLike
+from pathlib import Path
+from typing import Callable, List, Tuple, Union
+import multiprocessing
+import subprocess
+import threading
+import tempfile
+import secrets
+import pickle
+import shlex
+import uuid
+import sys
+import os
+
+
+def _run_task(pid: int, function: Callable, args: tuple) -> Tuple[object, List[Record]]:
+    """
+    Call function(*args) and return what it returned along with the Records of the tools it ran, unless this is the
+    process that submitted it (e.g. a ThreadPoolExecutor), where the hooks already saw them.
+    """
+    if os.getpid() == pid:
+        return function(*args), []
+    records = []
+    hook = records.append
+    add_hook(hook)
+    try:
+        return function(*args), records
+    finally:
+        remove_hook(hook)
+
+
+def run_on(executor: Executor, function: Callable, *args):
+    """
+    Call function(*args) on executor and wait for it, or just call it if executor is None. The function has to be a
+    module level function and the arguments picklable, for executors that run it in another process.
+    """
+    if executor is None:
+        return function(*args)
+    result, records = executor.submit(_run_task, os.getpid(), function, args).result()
+    for record in records:
+        _emit(record)
+    return result
+
+
+class LocalExecutor(ProcessPoolExecutor):
+    """
+    Worker processes on this machine. Workers are started with spawn rather than fork, since the process submitting
+    to them usually has threads running, so scripts using it need the usual if __name__ == '__main__': guard.
+
+    :param max_workers: How many tool calls to run at once. Defaults to the number of available cores.
+    """
+    def __init__(self, max_workers: int = None):
+        super().__init__(max_workers=max_workers or available_cores(), mp_context=multiprocessing.get_context('spawn'))
+
+
+def _load(path: Path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _dump(obj, path: Path):
+    tmp = path.with_name(f'.{path.name}.tmp{os.getpid()}')
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _outcome(function: Callable, args: tuple, kwargs: dict) -> Tuple[bool, object]:
+    try:
+        return True, function(*args, **kwargs)
+    except Exception as e:
+        return False, e
+
+
+def _picklable(outcome: Tuple[bool, object]) -> Tuple[bool, object]:
+    try:
+        pickle.dumps(outcome)
+        return outcome
+    except Exception as e:
+        return False, RuntimeError(f'The result could not be sent back: {e!r}. Result: {outcome[1]!r}')
+
+
+def run_task_file(task_file: Union[str, PathLike]):
+    """
+    Run a task written by CommandExecutor and write (True, result) or (False, exception) next to it.
+    """
+    task_file = Path(task_file)
+    function, args, kwargs = _load(task_file)
+    _dump(_picklable(_outcome(function, args, kwargs)), task_file.with_suffix('.result'))
+
+
+class CommandExecutor(Executor):
+    """
+    Runs every task as its own job, submitted with a shell command made from template. The command must wait for the
+    job to finish, e.g.
+
+        CommandExecutor('srun -N1 -c 8 --mem=16G {command}')
+        CommandExecutor('sbatch --wait -c 8 --mem=16G -o {log} --wrap={quoted_command}')
+
+    In the template, {command} is the command that runs the task, {quoted_command} is the same quoted as a single
+    shell word, {name} is a name for the job and {log} is a log file for it in work_directory.
+
+    The task is pickled into work_directory and the job writes its result there, so work_directory must be on a
+    filesystem the nodes share.
+
+    :param template: The submit command.
+    :param work_directory: Where the tasks, results and logs go. Defaults to a new directory in the current one,
+        which is removed at shutdown unless failed jobs left their logs in it.
+    :param max_jobs: How many jobs to have submitted at once.
+    :param python: The Python the jobs run the task with. Defaults to the one running now.
+    """
+    def __init__(self,
+                 template: str,
+                 work_directory: Union[str, PathLike] = None,
+                 max_jobs: int = 100,
+                 python: str = sys.executable):
+        self.template = template
+        self._own_directory = work_directory is None
+        if work_directory is None:
+            work_directory = tempfile.mkdtemp(prefix='proteotools-jobs-', dir='.')
+        self.work_directory = Path(work_directory).resolve()
+        self.work_directory.mkdir(parents=True, exist_ok=True)
+        self.python = python
+        self._jobs = ThreadPoolExecutor(max_workers=max(1, int(max_jobs)))
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return self._jobs.submit(self._run, fn, args, kwargs)
+
+    def _run(self, function: Callable, args: tuple, kwargs: dict):
+        target = args[1] if function is _run_task else function  # name the job after what run_on submitted
+        name = f'{getattr(target, "__name__", "task").lstrip("_")}-{uuid.uuid4().hex[:12]}'
+        task = self.work_directory / f'{name}.task'
+        result = task.with_suffix('.result')
+        log = task.with_suffix('.log')
+        _dump((function, args, kwargs), task)
+
+        command = shlex.join([self.python, '-m', 'proteotools.executors', 'run', str(task)])
+        try:
+            p = subprocess.run(self.template.format(command=command, quoted_command=shlex.quote(command), name=name,
+                                                    log=log),
+                               shell=True)
+            if p.returncode != 0 or not result.exists():
+                raise SubprocessError(f'The job for {name} failed (exit status {p.returncode}). Inspect the above '
+                                      f'output or {log}.')
+            ok, value = _load(result)
+        finally:
+            task.unlink(missing_ok=True)
+            result.unlink(missing_ok=True)
+        if not ok:
+            raise value
+        log.unlink(missing_ok=True)
+        return value
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._jobs.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if wait and self._own_directory:
+            try:
+                self.work_directory.rmdir()
+            except OSError:
+                pass  # the logs of failed jobs are still in there
+
+
+class WorkQueueExecutor(Executor):
+    """
+    Hands tasks out over TCP to workers, which can run on any machine that reaches this one. Each worker runs one
+    task at a time, so start one per tool call a node should run at once:
+
+        executor = WorkQueueExecutor(address=('0.0.0.0', 5000), authkey='secret')
+        # on the nodes:
+        #   PROTEOTOOLS_AUTHKEY=secret python -m proteotools.executors worker head-node:5000
+
+    Workers can come and go while tasks are running. If a worker disconnects in the middle of a task (the node was
+    preempted, for example), the task goes back to the front of the queue for another worker.
+
+    :param address: (host, port) to listen on. Port 0 picks a free one; see the address attribute.
+    :param authkey: Shared secret the workers have to know. Defaults to $PROTEOTOOLS_AUTHKEY, or a random key if that
+        isn't set, which is only good for local_workers.
+    :param local_workers: Start this many workers on this machine, e.g. for testing.
+    """
+    def __init__(self,
+                 address: Tuple[str, int] = ('localhost', 0),
+                 authkey: Union[str, bytes] = None,
+                 local_workers: int = 0):
+        if authkey is None:
+            authkey = os.environ.get('PROTEOTOOLS_AUTHKEY') or secrets.token_hex(16)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+
+        self._pending = deque()  # (future, pickled task)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._connections = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+        host = '127.0.0.1' if self.address[0] in ('0.0.0.0', '') else self.address[0]
+        env = dict(os.environ, PROTEOTOOLS_AUTHKEY=self.authkey.decode())
+        self._workers = [subprocess.Popen([sys.executable, '-m', 'proteotools.executors', 'worker',
+                                           f'{host}:{self.address[1]}'], env=env)
+                         for _ in range(local_workers)]
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        task = pickle.dumps((fn, args, kwargs))
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('cannot schedule new tasks after shutdown')
+            self._pending.append((future, task))
+            self._condition.notify()
+        return future
+
+    def _next(self):
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            return self._pending.popleft() if self._pending else None
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                return  # the listener was closed
+            except Exception as e:  # e.g. a worker with the wrong authkey
+                print(f'WorkQueueExecutor: rejected a worker: {e}')
+                continue
+            thread = threading.Thread(target=self._serve, args=(connection,), daemon=True)
+            with self._condition:
+                self._connections.append(thread)
+            thread.start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                item = self._next()
+                if item is None:
+                    try:
+                        connection.send_bytes(pickle.dumps(None))
+                    except OSError:
+                        pass
+                    return
+                future, task = item
+                if not future.running() and not future.set_running_or_notify_cancel():
+                    continue  # cancelled while it was waiting
+                try:
+                    connection.send_bytes(task)
+                    ok, value = connection.recv()
+                except (EOFError, OSError):
+                    with self._condition:
+                        self._pending.appendleft(item)
+                        self._condition.notify()
+                    return
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._condition:
+            if cancel_futures:
+                while self._pending:
+                    future, _ = self._pending.popleft()
+                    if future.cancel():
+                        continue
+                    # a task that went back in the queue after its worker left
+                    future.set_exception(RuntimeError('cancelled at shutdown'))
+            self._closed = True
+            self._condition.notify_all()
+            connections = list(self._connections)
+        if wait:
+            for thread in connections:
+                thread.join()
+            for p in self._workers:
+                p.wait()
+        self._listener.close()
+
+
+def worker(address: Tuple[str, int], authkey: Union[str, bytes]):
+    """
+    Connect to a WorkQueueExecutor and run tasks from it until it shuts down.
+    """
+    authkey = authkey.encode() if isinstance(authkey, str) else authkey
+    with Client(address, authkey=authkey) as connection:
+        while True:
+            try:
+                data = connection.recv_bytes()
+            except EOFError:
+                return
+            try:
+                task = pickle.loads(data)
+            except Exception as e:  # e.g. a function this worker can't import
+                connection.send(_picklable((False, e)))
+                continue
+            if task is None:
+                return
+            connection.send(_picklable(_outcome(*task)))
+
+
+def main():
+    parser = ArgumentParser(description='Run proteotools tasks for CommandExecutor and WorkQueueExecutor.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    work = commands.add_parser('worker', help='Take tasks from a WorkQueueExecutor.')
+    work.add_argument('address', help='HOST:PORT of the executor.')
+    work.add_argument('--authkey', default=os.environ.get('PROTEOTOOLS_AUTHKEY'),
+                      help='The executor\'s authkey. Defaults to $PROTEOTOOLS_AUTHKEY.')
+    run = commands.add_parser('run', help='Run one task written by CommandExecutor.')
+    run.add_argument('task_file')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_task_file(args.task_file)
+    else:
+        if not args.authkey:
+            parser.error('an authkey is needed, from --authkey or $PROTEOTOOLS_AUTHKEY')
+        host, port = args.address.rsplit(':', 1)
+        worker((host, int(port)), args.authkey)
+
+
+if __name__ == '__main__':
+    main()
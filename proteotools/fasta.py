@@ -0,0 +1,111 @@
+from proteotools import config
+from typing import Union, List, Iterator, Tuple
+from os import PathLike
+from pathlib import Path
+import threading
+import tempfile
+import zlib
+import os
+
+
+def read_fasta(fasta: Union[str, PathLike]) -> Iterator[Tuple[str, str]]:
+    """
+    Iterate over the entries of a FASTA file as (header line without the '>', sequence).
+    """
+    header = None
+    sequence = []
+    with open(fasta) as f:
+        for line in f:
+            line = line.rstrip('\n\r')
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(sequence)
+                header = line[1:]
+                sequence = []
+            elif line:
+                sequence.append(line.strip())
+    if header is not None:
+        yield header, ''.join(sequence)
+
+
+def _protein_id(header: str, decoy_prefix: str) -> str:
+    name = header.split()[0] if header.strip() else header
+    if decoy_prefix and name.startswith(decoy_prefix):
+        name = name[len(decoy_prefix):]
+    return name
+
+
+def _write_entry(f, header: str, sequence: str):
+    f.write(f'>{header}\n')
+    for i in range(0, len(sequence), 60):
+        f.write(sequence[i:i + 60] + '\n')
+
+
+def write_target_decoy(fasta: Union[str, PathLike],
+                       output: Union[str, PathLike],
+                       decoy_prefix: str = 'rev_') -> str:
+    """
+    Write a target-decoy database: every target protein, each followed by its reversed sequence as a decoy, with
+    decoy_prefix in front of the header (the prefix PeptideProphet and iProphet are told about with DECOY=). Decoys
+    already in the FASTA file are dropped and made again, so running this on its own output changes nothing.
+
+    :param fasta: The FASTA file.
+    :param output: The target-decoy FASTA file to write.
+    :param decoy_prefix: Prefix for the decoy proteins.
+    :return: The target-decoy FASTA file.
+    """
+    output = Path(output)
+    tmp = output.with_name(f'.{output.name}.tmp{os.getpid()}')
+    with open(tmp, 'w') as f:
+        for header, sequence in read_fasta(fasta):
+            if header.startswith(decoy_prefix):
+                continue
+            _write_entry(f, header, sequence)
+            _write_entry(f, decoy_prefix + header, sequence[::-1])
+    os.replace(tmp, output)
+    return str(output)
+
+
+def split_fasta(fasta: Union[str, PathLike],
+                n_shards: int,
+                output_directory: Union[str, PathLike] = None,
+                decoy_prefix: str = 'rev_') -> List[str]:
+    """
+    Split a FASTA file into n_shards smaller ones. Proteins are assigned by a hash of their name, with decoy_prefix
+    removed, so a protein and its decoy always end up in the same shard and each shard keeps the target/decoy
+    balance of the whole database.
+
+    Shards in output_directory are only rewritten if they are missing or older than the FASTA file.
+
+    :param fasta: The FASTA file.
+    :param n_shards: How many pieces to make.
+    :param output_directory: Where to put the shards. Defaults to a new directory for this call in the database
+        directory (see proteotools.config), so the FASTA file can be in a read-only place and concurrent calls don't
+        share files. Remove it when the shards aren't needed anymore.
+    :param decoy_prefix: Prefix of decoy proteins.
+    :return: The shard files.
+    """
+    fasta = Path(fasta)
+    if output_directory is None:
+        config.database_dir().mkdir(parents=True, exist_ok=True)
+        output_directory = tempfile.mkdtemp(prefix=f'{fasta.stem}-{n_shards}shards-', dir=config.database_dir())
+    output_directory = Path(output_directory)
+    shards = [output_directory / f'{fasta.stem}.shard{i + 1}of{n_shards}{fasta.suffix}' for i in range(n_shards)]
+
+    if all(x.exists() and x.stat().st_mtime >= fasta.stat().st_mtime for x in shards):
+        return [str(x) for x in shards]
+
+    output_directory.mkdir(parents=True, exist_ok=True)
+    tmp = [x.with_name(f'.{x.name}.tmp{os.getpid()}.{threading.get_ident()}') for x in shards]
+    files = [open(x, 'w') for x in tmp]
+    try:
+        for header, sequence in read_fasta(fasta):
+            shard = zlib.crc32(_protein_id(header, decoy_prefix).encode()) % n_shards
+            _write_entry(files[shard], header, sequence)
+    finally:
+        for f in files:
+            f.close()
+    for t, s in zip(tmp, shards):
+        os.replace(t, s)
+
+    return [str(x) for x in shards]
@@ -0,0 +1,147 @@
+from proteotools.pepxml import read_pepxml
+from typing import Dict, Union, List, Literal
+from os import PathLike
+import numpy as np
+
+
+def is_decoy(proteins: np.ndarray,
+             decoy_tag: str = 'rev_',
+             alternative_proteins: np.ndarray = None) -> np.ndarray:
+    """
+    Flag decoy hits. As in the TPP, a hit is only a decoy if every protein it maps to is a decoy.
+
+    :param proteins: The protein column of a PSM table.
+    :param decoy_tag: Prefix of decoy protein names, the same one given to run_iprophet/run_prophets.
+    :param alternative_proteins: The alternative_proteins column (';'-separated), if there is one.
+    :return: Boolean array, True for decoys.
+    """
+    decoy = np.char.startswith(np.asarray(proteins, dtype=str), decoy_tag)
+    if alternative_proteins is not None:
+        alternative_proteins = np.asarray(alternative_proteins, dtype=object)
+        has_alternatives = np.flatnonzero(decoy & (alternative_proteins != ''))
+        for i in has_alternatives:
+            decoy[i] = all(p.startswith(decoy_tag) for p in alternative_proteins[i].split(';'))
+    return decoy
+
+
+def qvalues(scores: np.ndarray,
+            decoy: np.ndarray,
+            higher_is_better: bool = True) -> np.ndarray:
+    """
+    Target-decoy q-values. At each score threshold the FDR is (number of decoys) / (number of targets) at or above it,
+    and the q-value of an item is the lowest FDR of any threshold that would still accept it. Items with equal scores
+    get the same q-value. Runs in O(n log n), with one sort and cumulative counts.
+
+    :param scores: One score per item. NaN scores get a q-value of 1.
+    :param decoy: True for decoy items.
+    :param higher_is_better: False for scores like expectation values, where lower is better.
+    :return: q-values, in the same order as scores.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    decoy = np.asarray(decoy, dtype=bool)
+    n = len(scores)
+    if n == 0:
+        return np.array([], dtype=np.float64)
+
+    ranked = -scores if higher_is_better else scores.copy()
+    ranked[np.isnan(ranked)] = np.inf
+    order = np.argsort(ranked)
+    ranked = ranked[order]
+    decoys = np.cumsum(decoy[order])
+    targets = np.arange(1, n + 1) - decoys
+
+    # ties: every item in a group of equal scores gets the counts at the end of the group
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    np.not_equal(ranked[1:], ranked[:-1], out=new_group[1:])
+    end_index = np.r_[np.flatnonzero(new_group)[1:] - 1, n - 1]
+    group_of = np.cumsum(new_group) - 1
+    decoys = decoys[end_index][group_of]
+    targets = targets[end_index][group_of]
+
+    fdr = decoys / np.maximum(targets, 1)
+    fdr[np.isinf(ranked)] = 1  # NaN scores are never accepted, so they can't lower the FDR of the items above them
+    q = np.minimum.accumulate(fdr[::-1])[::-1]
+    q = np.minimum(q, 1)
+
+    result = np.empty(n, dtype=np.float64)
+    result[order] = q
+    return result
+
+
+def _take(table: Dict[str, np.ndarray], index: np.ndarray) -> Dict[str, np.ndarray]:
+    return {column: values[index] for column, values in table.items()}
+
+
+def best_per_group(keys: np.ndarray,
+                   scores: np.ndarray,
+                   higher_is_better: bool = True) -> np.ndarray:
+    """
+    Index of the best scoring row for each distinct key.
+    """
+    ranked = -np.asarray(scores, dtype=np.float64) if higher_is_better else np.asarray(scores, dtype=np.float64)
+    ranked = np.where(np.isnan(ranked), np.inf, ranked)
+    order = np.lexsort((ranked, np.asarray(keys, dtype=str)))
+    _, first = np.unique(np.asarray(keys, dtype=str)[order], return_index=True)
+    return order[first]
+
+
+def filter_psms(table: Dict[str, np.ndarray],
+                fdr: float = 0.01,
+                level: Literal['psm', 'peptide', 'protein'] = 'psm',
+                score: str = 'iprophet_probability',
+                decoy_tag: str = 'rev_',
+                higher_is_better: bool = True,
+                peptide_column: str = 'modified_peptide',
+                keep_decoys: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Filter a PSM table (from proteotools.pepxml) to a target-decoy FDR.
+
+    At the PSM level every row is an item. At the peptide and protein levels, the best scoring PSM of each peptide or
+    protein stands for it, and the table returned has one row per accepted peptide or protein. Only rank 1 hits
+    should be in the table (read it with max_rank=1).
+
+    :param table: PSM table.
+    :param fdr: The FDR to filter to.
+    :param level: 'psm', 'peptide' or 'protein'.
+    :param score: The column to rank by. Use e.g. 'expect' with higher_is_better=False for unvalidated search results.
+    :param decoy_tag: Prefix of decoy protein names.
+    :param higher_is_better: Whether a higher score is better.
+    :param peptide_column: Column which identifies a peptide at the peptide level: 'modified_peptide' or 'peptide'.
+    :param keep_decoys: Keep decoys that pass the threshold in the output.
+    :return: The accepted rows, with 'decoy' and 'q_value' columns added, sorted from best to worst.
+    """
+    if level not in ('psm', 'peptide', 'protein'):
+        raise ValueError(f"level must be 'psm', 'peptide' or 'protein', not {level}")
+
+    table = dict(table)
+    table['decoy'] = is_decoy(table['protein'], decoy_tag, table.get('alternative_proteins'))
+
+    if level == 'peptide':
+        table = _take(table, best_per_group(table[peptide_column], table[score], higher_is_better))
+    elif level == 'protein':
+        table = _take(table, best_per_group(table['protein'], table[score], higher_is_better))
+
+    table['q_value'] = qvalues(table[score], table['decoy'], higher_is_better)
+
+    keep = table['q_value'] <= fdr
+    if not keep_decoys:
+        keep &= ~table['decoy']
+    index = np.flatnonzero(keep)
+    ranked = -table[score][index] if higher_is_better else table[score][index]
+    index = index[np.argsort(ranked, kind='mergesort')]
+    return _take(table, index)
+
+
+def filter_pepxml(pepxml: Union[str, PathLike, List[Union[str, PathLike]]],
+                  fdr: float = 0.01,
+                  level: Literal['psm', 'peptide', 'protein'] = 'psm',
+                  score: str = 'iprophet_probability',
+                  decoy_tag: str = 'rev_',
+                  higher_is_better: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Read the rank 1 hits from a pepXML file (e.g. the interact-iproph.pep.xml from run_prophets) and filter them with
+    filter_psms.
+    """
+    return filter_psms(read_pepxml(pepxml, max_rank=1), fdr=fdr, level=level, score=score, decoy_tag=decoy_tag,
+                       higher_is_better=higher_is_better)
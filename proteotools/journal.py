@@ -0,0 +1,141 @@
+from proteotools.cache import cached, file_hash
+from pathlib import Path
+from os import PathLike
+from typing import Callable, List, Union, Iterable
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+class Journal:
+    """
+    A record of the finished steps of a pipeline, so that it can pick up where it left off after being killed.
+
+    Each step that finishes is appended to the journal file as one JSON line, with checksums of its outputs. A step
+    is skipped when the journal has it for the same inputs, arguments and outputs, and every output is still there
+    with the recorded checksum. A step which was interrupted never made it into the journal, so its (possibly half
+    written) outputs are not trusted and it runs again, and so does everything downstream whose inputs changed.
+
+        journal = Journal('/data/study/proteotools.journal')
+        mzml_files = convert.run_thermorawfileparser(raw_files, journal=journal)
+        pepxml_files = search.run_all_with_defaults(..., mzml_files=mzml_files, journal=journal)
+        tpp.run_prophets(pepxml_files, fasta, journal=journal)
+
+    Run the same script again after a crash and the finished steps are skipped.
+
+    The journal hashes files with file_hash(..., write=False), so it writes nothing but the journal file (the tool
+    directory may be read-only) and threads only wait on each other to append to it.
+    """
+    def __init__(self, path: Union[str, PathLike]):
+        self.path = Path(path).expanduser().resolve()
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # the last line, if we were killed while writing it
+                    self._entries[entry['key']] = entry
+
+    @staticmethod
+    def _key(step: str, inputs, outputs, arguments) -> str:
+        description = {'step': step,
+                       'inputs': [file_hash(x, write=False) for x in inputs],
+                       'outputs': [str(Path(x).expanduser().resolve()) for x in outputs],
+                       'arguments': [str(x) for x in arguments]}
+        return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+    def is_done(self,
+                step: str,
+                inputs: Iterable[Union[str, PathLike]],
+                outputs: List[Union[str, PathLike]],
+                arguments: Iterable = ()) -> bool:
+        """
+        True if the step finished before and its outputs haven't changed since.
+        """
+        inputs = list(inputs)
+        if not all(Path(x).exists() for x in inputs):
+            return False
+        key = self._key(step, inputs, outputs, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return False
+        for path, sha in zip(entry['outputs'], entry['hashes']):
+            if not Path(path).exists() or file_hash(path, write=False) != sha:
+                return False
+        return True
+
+    def record(self,
+               step: str,
+               inputs: Iterable[Union[str, PathLike]],
+               outputs: List[Union[str, PathLike]],
+               arguments: Iterable = ()):
+        """
+        Mark the step as finished. The line is flushed to disk before returning, so a crash right afterwards doesn't
+        lose it.
+        """
+        outputs = [Path(x).expanduser().resolve() for x in outputs]
+        entry = {'key': self._key(step, inputs, outputs, arguments),
+                 'step': step,
+                 'outputs': [str(x) for x in outputs],
+                 'hashes': [file_hash(x, write=False) for x in outputs],
+                 'finished': time.time()}
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[entry['key']] = entry
+
+    def run(self,
+            step: str,
+            inputs: Iterable[Union[str, PathLike]],
+            outputs: List[Union[str, PathLike]],
+            run: Callable[[], None],
+            arguments: Iterable = ()) -> bool:
+        """
+        Run a step unless the journal says it's already done.
+
+        :param step: Name of the step, e.g. 'Comet'.
+        :param inputs: Every file the outputs depend on.
+        :param outputs: The files run() writes.
+        :param run: Does the actual work.
+        :param arguments: Anything else that changes the output (options, flags, etc.).
+        :return: True if the step was skipped.
+        """
+        inputs = list(inputs)
+        if self.is_done(step, inputs, outputs, arguments):
+            print(f'{step}: already done for {", ".join(Path(x).name for x in outputs)}, skipping')
+            return True
+        run()
+        self.record(step, inputs, outputs, arguments)
+        return False
+
+
+def run_step(step: str,
+             inputs: List[Union[str, PathLike]],
+             outputs: List[Union[str, PathLike]],
+             run: Callable[[], None],
+             arguments: Iterable = (),
+             use_cache: bool = False,
+             journal: Journal = None):
+    """
+    Run one step of a pipeline through the cache (see proteotools.cache) and/or a journal, or just run it if neither
+    is used. The journal is checked first, since it doesn't need to look at the cache at all.
+    """
+    if use_cache:
+        uncached_run = run
+
+        def run():
+            cached(step, inputs=inputs, outputs=outputs, run=uncached_run, arguments=arguments)
+
+    if journal is not None:
+        journal.run(step, inputs, outputs, run, arguments)
+    else:
+        run()
@@ -0,0 +1,276 @@
+from typing import Union, Dict, List, Tuple
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import quoteattr
+from os import PathLike
+from pathlib import Path
+from datetime import datetime
+import os
+import re
+
+PROTON = 1.007276
+H = 1.007825
+OH = 17.002740
+
+# monoisotopic residue masses, for the mod_aminoacid_mass elements
+AMINO_ACIDS = {'G': 57.021464, 'A': 71.037114, 'S': 87.032028, 'P': 97.052764, 'V': 99.068414, 'T': 101.047679,
+               'C': 103.009185, 'L': 113.084064, 'I': 113.084064, 'N': 114.042927, 'D': 115.026943, 'Q': 128.058578,
+               'K': 128.094963, 'E': 129.042593, 'M': 131.040485, 'H': 137.058912, 'F': 147.068414, 'R': 156.101111,
+               'Y': 163.06332, 'W': 186.079313, 'U': 150.95363, 'O': 237.147727}
+
+_ENZYMES = {'trypsin': ('KR', 'P', 'C'), 'trypsin/p': ('KR', '', 'C'), 'lys-c': ('K', 'P', 'C'),
+            'lysc': ('K', 'P', 'C'), 'arg-c': ('R', 'P', 'C'), 'asp-n': ('D', '', 'N'), 'glu-c': ('DE', 'P', 'C'),
+            'chymotrypsin': ('FWYL', 'P', 'C')}
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _number(value: str) -> Union[float, None]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format(value: float) -> str:
+    return f'{value:.6g}' if abs(value) < 1e-3 else f'{value:.6f}'.rstrip('0').rstrip('.')
+
+
+class _Header:
+    """
+    What goes in the pepXML header, collected from the parts of the mzIdentML file before the results.
+    """
+    def __init__(self):
+        self.database = ''
+        self.spectra = ''
+        self.enzyme = ''
+        self.modifications: List[Tuple[str, float, bool]] = []  # residues, mass delta, fixed
+        self.parameters: List[Tuple[str, str]] = []
+
+
+def _modified_peptide(sequence: str, modifications: List[Tuple[int, float]]) -> Tuple[str, List[str], str]:
+    """
+    The TPP-style modified peptide (e.g. n[43]PEPM[147]K) and the modification_info attributes and children.
+    """
+    by_position = {}
+    for location, delta in modifications:
+        by_position[location] = by_position.get(location, 0.0) + delta
+
+    attributes = ''
+    children = []
+    text = ''
+    if 0 in by_position:
+        mass = H + by_position[0]
+        attributes += f' mod_nterm_mass="{mass:.4f}"'
+        text += f'n[{round(mass)}]'
+    for i, residue in enumerate(sequence, start=1):
+        text += residue
+        if i in by_position:
+            mass = AMINO_ACIDS.get(residue, 0.0) + by_position[i]
+            children.append(f'<mod_aminoacid_mass position="{i}" mass="{mass:.4f}"/>')
+            text += f'[{round(mass)}]'
+    if len(sequence) + 1 in by_position:
+        mass = OH + by_position[len(sequence) + 1]
+        attributes += f' mod_cterm_mass="{mass:.4f}"'
+        text += f'c[{round(mass)}]'
+    return text, children, attributes
+
+
+def _write_header(f, header: _Header, output: Path, base_name: str):
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write(f'<msms_pipeline_analysis date="{datetime.now().isoformat(timespec="seconds")}" '
+            f'xmlns="http://regis-web.systemsbiology.net/pepXML" summary_xml={quoteattr(str(output))}>\n')
+    f.write(f'<msms_run_summary base_name={quoteattr(base_name)} raw_data_type="raw" raw_data=".mzML">\n')
+
+    enzyme = header.enzyme.lower()
+    if enzyme in _ENZYMES:
+        cut, no_cut, sense = _ENZYMES[enzyme]
+        f.write(f'<sample_enzyme name="{enzyme}">\n'
+                f'<specificity cut="{cut}" no_cut="{no_cut}" sense="{sense}"/>\n'
+                f'</sample_enzyme>\n')
+
+    f.write(f'<search_summary base_name={quoteattr(base_name)} search_engine="MS-GF+" '
+            f'precursor_mass_type="monoisotopic" fragment_mass_type="monoisotopic" search_id="1">\n')
+    f.write(f'<search_database local_path={quoteattr(header.database)} type="AA"/>\n')
+    for residues, delta, fixed in header.modifications:
+        for residue in residues:
+            if residue == '.':
+                continue
+            mass = AMINO_ACIDS.get(residue, 0.0) + delta
+            f.write(f'<aminoacid_modification aminoacid="{residue}" massdiff="{delta:.4f}" mass="{mass:.4f}" '
+                    f'variable="{"N" if fixed else "Y"}"/>\n')
+    for name, value in header.parameters:
+        f.write(f'<parameter name={quoteattr(name)} value={quoteattr(value)}/>\n')
+    f.write('</search_summary>\n')
+
+
+def mzid_to_pepxml(mzid: Union[str, PathLike],
+                   output: Union[str, PathLike] = None) -> str:
+    """
+    Convert an mzIdentML file from MS-GF+ to pepXML, the same way idconvert does but without starting the TPP
+    container, and with constant memory in the number of spectra (only the peptides and proteins are kept in
+    memory). Each spectrum and charge becomes a spectrum_query, and every MS-GF+ score becomes a search_score with its
+    mzIdentML name (MS-GF:SpecEValue, MS-GF:EValue, MS-GF:RawScore, ...).
+
+    :param mzid: The mzIdentML file.
+    :param output: The pepXML file. Defaults to the mzid file with a .pepXML extension.
+    :return: The pepXML file.
+    """
+    mzid = Path(mzid)
+    output = Path(output) if output is not None else mzid.with_suffix('.pepXML')
+
+    header = _Header()
+    proteins: Dict[str, str] = {}  # DBSequence id -> accession
+    peptides: Dict[str, Tuple[str, tuple]] = {}  # Peptide id -> (sequence, ((location, mass delta), ...))
+    evidence: Dict[str, Tuple[str, str, str]] = {}  # PeptideEvidence id -> (protein, previous aa, next aa)
+
+    tmp = output.with_name(f'.{output.name}.tmp{os.getpid()}')
+    f = open(tmp, 'w')
+    try:
+        started = False
+        index = 0
+        container = None  # the element whose children are removed as they are read
+        peptide_mods = []
+        protocol_enzyme = False
+
+        for event, elem in iterparse(str(mzid), events=('start', 'end')):
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag in ('SequenceCollection', 'SpectrumIdentificationList'):
+                    container = elem
+                elif tag == 'Enzymes':
+                    protocol_enzyme = True
+                continue
+
+            if tag == 'DBSequence':
+                proteins[elem.get('id')] = elem.get('accession', elem.get('id'))
+            elif tag == 'Modification' and container is not None and _local(container.tag) == 'SequenceCollection':
+                peptide_mods.append((int(elem.get('location', 0)), float(elem.get('monoisotopicMassDelta', 0))))
+            elif tag == 'Peptide':
+                sequence = next((x.text for x in elem if _local(x.tag) == 'PeptideSequence'), '') or ''
+                peptides[elem.get('id')] = (sequence, tuple(peptide_mods))
+                peptide_mods = []
+            elif tag == 'PeptideEvidence':
+                evidence[elem.get('id')] = (proteins.get(elem.get('dBSequence_ref'), elem.get('dBSequence_ref')),
+                                            elem.get('pre', '-'), elem.get('post', '-'))
+            elif tag == 'SearchModification':
+                header.modifications.append((elem.get('residues', ''), float(elem.get('massDelta', 0)),
+                                             elem.get('fixedMod') == 'true'))
+            elif tag == 'cvParam' and protocol_enzyme:
+                header.enzyme = header.enzyme or elem.get('name', '')
+            elif tag == 'Enzymes':
+                protocol_enzyme = False
+            elif tag == 'AdditionalSearchParams':
+                header.parameters += [(x.get('name', ''), x.get('value', '')) for x in elem
+                                      if _local(x.tag) in ('userParam', 'cvParam') and x.get('value') is not None]
+            elif tag == 'SearchDatabase':
+                header.database = re.sub(r'^file:/+', '/', elem.get('location', ''))
+            elif tag == 'SpectraData':
+                header.spectra = re.sub(r'^file:/+', '/', elem.get('location', ''))
+            elif tag == 'SpectrumIdentificationResult':
+                base_name = str(Path(header.spectra).with_suffix('')) if header.spectra else str(output.with_suffix(''))
+                if not started:
+                    _write_header(f, header, output, base_name)
+                    started = True
+                index = _write_result(f, elem, peptides, evidence, Path(base_name).name, index)
+
+            if tag in ('DBSequence', 'Peptide', 'PeptideEvidence', 'SpectrumIdentificationResult'):
+                elem.clear()
+                if container is not None:
+                    del container[:]
+
+        if not started:
+            _write_header(f, header, output, str(Path(header.spectra).with_suffix('')) if header.spectra
+                          else str(output.with_suffix('')))
+        f.write('</msms_run_summary>\n</msms_pipeline_analysis>\n')
+    except BaseException:
+        f.close()
+        os.remove(tmp)
+        raise
+    f.close()
+    os.replace(tmp, output)
+    return str(output)
+
+
+def _write_result(f, result, peptides, evidence, name: str, index: int) -> int:
+    """
+    Write the spectrum_query elements for one SpectrumIdentificationResult (one for each charge it has hits for).
+    """
+    scan = None
+    retention_time = None
+    items = []
+    for child in result:
+        tag = _local(child.tag)
+        if tag == 'SpectrumIdentificationItem':
+            items.append(child)
+        elif tag == 'cvParam':
+            if child.get('name') == 'scan number(s)':
+                scan = int(float(child.get('value')))
+            elif child.get('name') == 'scan start time':
+                retention_time = float(child.get('value'))
+                if child.get('unitName', 'second') == 'minute':
+                    retention_time *= 60
+    if scan is None:
+        match = re.search(r'scan=(\d+)', result.get('spectrumID', '')) or \
+            re.search(r'index=(\d+)', result.get('spectrumID', ''))
+        scan = int(match.group(1)) if match else index + 1
+
+    by_charge = {}
+    for item in items:
+        by_charge.setdefault(int(item.get('chargeState')), []).append(item)
+
+    for charge, charge_items in by_charge.items():
+        charge_items.sort(key=lambda x: int(x.get('rank', 1)))
+        index += 1
+        precursor = float(charge_items[0].get('experimentalMassToCharge')) * charge - charge * PROTON
+        rt = f' retention_time_sec="{retention_time:.4f}"' if retention_time is not None else ''
+        f.write(f'<spectrum_query spectrum="{name}.{scan:05d}.{scan:05d}.{charge}" start_scan="{scan}" '
+                f'end_scan="{scan}" precursor_neutral_mass="{precursor:.6f}" assumed_charge="{charge}" '
+                f'index="{index}"{rt}>\n<search_result>\n')
+        for rank, item in enumerate(charge_items, start=1):
+            _write_hit(f, item, rank, charge, precursor, peptides, evidence)
+        f.write('</search_result>\n</spectrum_query>\n')
+    return index
+
+
+def _write_hit(f, item, rank: int, charge: int, precursor: float, peptides, evidence):
+    sequence, modifications = peptides.get(item.get('peptide_ref'), ('', ()))
+    hit_evidence = []
+    scores = []
+    matched_ions = None
+    for child in item:
+        tag = _local(child.tag)
+        if tag == 'PeptideEvidenceRef':
+            found = evidence.get(child.get('peptideEvidence_ref'))
+            if found is not None and found[0] not in [x[0] for x in hit_evidence]:
+                hit_evidence.append(found)
+        elif tag in ('cvParam', 'userParam'):
+            value = _number(child.get('value'))
+            if value is None:
+                continue
+            if child.get('name') == 'NumMatchedMainIons':
+                matched_ions = int(value)
+            scores.append((child.get('name'), value))
+    if not hit_evidence:
+        hit_evidence = [('', '-', '-')]
+
+    calculated = float(item.get('calculatedMassToCharge')) * charge - charge * PROTON
+    protein, prev_aa, next_aa = hit_evidence[0]
+    ions = f' num_matched_ions="{matched_ions}"' if matched_ions is not None else ''
+    f.write(f'<search_hit hit_rank="{rank}" peptide="{sequence}" peptide_prev_aa="{prev_aa}" '
+            f'peptide_next_aa="{next_aa}" protein={quoteattr(protein)} num_tot_proteins="{len(hit_evidence)}"'
+            f'{ions} calc_neutral_pep_mass="{calculated:.6f}" massdiff="{precursor - calculated:.6f}" '
+            f'is_rejected="0">\n')
+    for other, other_prev, other_next in hit_evidence[1:]:
+        f.write(f'<alternative_protein protein={quoteattr(other)} peptide_prev_aa="{other_prev}" '
+                f'peptide_next_aa="{other_next}"/>\n')
+    if modifications:
+        modified, children, attributes = _modified_peptide(sequence, list(modifications))
+        f.write(f'<modification_info modified_peptide="{modified}"{attributes}>\n')
+        for x in children:
+            f.write(x + '\n')
+        f.write('</modification_info>\n')
+    for name, value in scores:
+        f.write(f'<search_score name={quoteattr(name)} value="{_format(value)}"/>\n')
+    f.write('</search_hit>\n')
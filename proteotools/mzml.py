@@ -0,0 +1,337 @@
+from typing import Union, List, Tuple, Dict, Iterator, Iterable, NamedTuple
+from os import PathLike
+from pathlib import Path
+import numpy as np
+import binascii
+import tempfile
+import shutil
+import mmap
+import zlib
+import re
+import os
+
+_INDEX_LIST_OFFSET = re.compile(rb'<indexListOffset>\s*(\d+)\s*</indexListOffset>')
+_INDEX = re.compile(rb'<index\s+name="(\w+)"\s*>(.*?)</index>', re.DOTALL)
+_OFFSET = re.compile(rb'<offset\s+idRef="([^"]*)"[^>]*>\s*(\d+)\s*</offset>')
+
+
+def read_index(mzml: Union[str, PathLike], name: str = 'spectrum') -> Tuple[List[str], List[int]]:
+    """
+    Read the offset index at the end of an indexed mzML file (the default output of run_thermorawfileparser) without
+    parsing the rest of the file.
+
+    :param mzml: An indexed mzML file.
+    :param name: Which index to read: 'spectrum' or 'chromatogram'.
+    :return: (native IDs, byte offsets of the <spectrum> elements), in file order.
+    """
+    with open(mzml, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        match = _INDEX_LIST_OFFSET.search(f.read())
+        if match is None:
+            raise ValueError(f'{mzml} does not have an offset index. Convert it with '
+                             f'format="indexed_mzml" (the default) and without gzip.')
+        f.seek(int(match.group(1)))
+        index_list = f.read()
+
+    for index in _INDEX.finditer(index_list):
+        if index.group(1).decode() == name:
+            entries = _OFFSET.findall(index.group(2))
+            return [x.decode() for x, _ in entries], [int(x) for _, x in entries]
+    return [], []
+
+
+def _spectrum_list_end(f, last_offset: int) -> int:
+    f.seek(last_offset)
+    position = last_offset
+    carry = b''
+    while True:
+        block = f.read(1024 * 1024)
+        if not block:
+            raise ValueError('Could not find the end of the spectrum list.')
+        i = (carry + block).find(b'</spectrumList>')
+        if i != -1:
+            return position - len(carry) + i
+        carry = block[-32:]
+        position += len(block)
+
+
+def _copy_range(src, dst, start: int, end: int):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src.read(min(remaining, 16 * 1024 * 1024))
+        if not block:
+            break
+        dst.write(block)
+        remaining -= len(block)
+
+
+def split_mzml(mzml: Union[str, PathLike],
+               n_chunks: int,
+               output_directory: Union[str, PathLike] = None) -> List[str]:
+    """
+    Split an indexed mzML file into n_chunks files, each with a consecutive range of the spectra. The spectra are
+    copied byte for byte using the offset index, so nothing is decoded or reparsed and every spectrum keeps its
+    original native ID (and therefore its scan number). The chunks are plain (not indexed) mzML files.
+
+    :param mzml: An indexed mzML file.
+    :param n_chunks: How many files to split it into.
+    :param output_directory: Where to put the chunks. Defaults to a new directory next to the mzML file, different
+        for every call, so that two searches splitting the same file at the same time don't share chunks.
+    :return: The chunk files, in spectrum order.
+    """
+    mzml = Path(mzml)
+    _, offsets = read_index(mzml)
+    if not offsets:
+        raise ValueError(f'{mzml} has no spectra in its index.')
+    n_chunks = max(1, min(n_chunks, len(offsets)))
+
+    if output_directory is None:
+        output_directory = tempfile.mkdtemp(dir=mzml.parent, prefix=f'{mzml.stem}-chunks-')
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    bounds = [len(offsets) * i // n_chunks for i in range(n_chunks + 1)]
+    chunks = []
+    with open(mzml, 'rb') as f:
+        header = f.read(offsets[0])
+        end = _spectrum_list_end(f, offsets[-1])
+
+        # the chunks are plain mzML, so drop the indexedmzML wrapper if there is one
+        header = re.sub(rb'<indexedmzML[^>]*>\s*', b'', header, count=1)
+        footer = b'\n    </spectrumList>\n  </run>\n</mzML>\n'
+
+        for i in range(n_chunks):
+            start = offsets[bounds[i]]
+            stop = offsets[bounds[i + 1]] if bounds[i + 1] < len(offsets) else end
+            count = bounds[i + 1] - bounds[i]
+            chunk_header = re.sub(rb'(<spectrumList\s[^>]*count=")\d+(")', rb'\g<1>%d\g<2>' % count, header,
+                                  count=1)
+            chunk = output_directory / f'{mzml.stem}.chunk{i + 1}of{n_chunks}.mzML'
+            tmp = chunk.with_name(f'.{chunk.name}.tmp{os.getpid()}')
+            with open(tmp, 'wb') as out:
+                out.write(chunk_header)
+                _copy_range(f, out, start, stop)
+                out.write(footer)
+            os.replace(tmp, chunk)
+            chunks.append(str(chunk))
+
+    return chunks
+
+
+def remove_chunks(chunks: List[Union[str, PathLike]]):
+    """
+    Delete the directory made by split_mzml for these chunks, along with anything else written in it.
+    """
+    directories = {Path(x).parent for x in chunks}
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+_SPECTRUM_TAG = re.compile(rb'<spectrum\b([^>]*)>')
+_ATTRIBUTE = re.compile(rb'([\w:]+)="([^"]*)"')
+_CV_PARAM = re.compile(rb'<cvParam\b([^>]*)>')
+_ARRAY_LIST = re.compile(rb'<binaryDataArrayList\b')
+_ARRAY = re.compile(rb'<binaryDataArray\b[^>]*>(.*?)<binary>(.*?)</binary>', re.DOTALL)
+_SCAN = re.compile(r'scan=(\d+)')
+
+_DTYPES = {b'MS:1000521': np.dtype('<f4'), b'MS:1000523': np.dtype('<f8'),
+           b'MS:1000519': np.dtype('<i4'), b'MS:1000522': np.dtype('<i8')}
+_ZLIB = b'MS:1000574'
+_NO_COMPRESSION = b'MS:1000576'
+_ARRAYS = {b'MS:1000514': 'mz', b'MS:1000515': 'intensity'}
+
+
+class Spectrum(NamedTuple):
+    index: int  # position in the file
+    id: str  # native ID
+    scan: int
+    ms_level: int
+    retention_time: float  # seconds
+    precursor_mz: float  # NaN for MS1 spectra
+    charge: int  # 0 if unknown
+    mz: np.ndarray
+    intensity: np.ndarray
+
+
+class SpectrumBatch(NamedTuple):
+    """
+    Several spectra with their peaks packed into two flat arrays. The peaks of spectrum i are
+    mz[offsets[i]:offsets[i + 1]] (see peaks()).
+    """
+    indices: np.ndarray
+    ids: List[str]
+    scans: np.ndarray
+    ms_levels: np.ndarray
+    retention_times: np.ndarray
+    precursor_mz: np.ndarray
+    charges: np.ndarray
+    offsets: np.ndarray
+    mz: np.ndarray  # float64
+    intensity: np.ndarray  # float32
+
+    def peaks(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.mz[self.offsets[i]:self.offsets[i + 1]], self.intensity[self.offsets[i]:self.offsets[i + 1]]
+
+
+def _attributes(tag: bytes) -> Dict[bytes, bytes]:
+    return dict(_ATTRIBUTE.findall(tag))
+
+
+class IndexedMzML:
+    """
+    Random access to the spectra of an indexed mzML file (the default output of run_thermorawfileparser). The file is
+    memory mapped and spectra are found through the offset index, so opening a file only reads its index, and
+    reading a spectrum only touches the bytes of that spectrum, however large the file is. Peak arrays are decoded
+    with numpy straight from the mapped base64 text.
+
+        with IndexedMzML('run001.mzML') as mzml:
+            spectrum = mzml.scan(1234)
+            for batch in mzml.batches(1000):
+                tic = np.add.reduceat(batch.intensity, batch.offsets[:-1])
+            sample = mzml.batches(100, indices=range(0, len(mzml), 50))
+
+    Spectra with numpress or other compressions than zlib are not supported.
+
+    :param mzml: An indexed (and not gzipped) mzML file.
+    """
+    def __init__(self, mzml: Union[str, PathLike]):
+        self.path = Path(mzml)
+        self.ids, offsets = read_index(self.path)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self._scans = {}
+        for i, native_id in enumerate(self.ids):
+            match = _SCAN.search(native_id)
+            self._scans[int(match.group(1)) if match else i + 1] = i
+        self._positions = {x: i for i, x in enumerate(self.ids)}
+
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Spectrum]:
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i: int) -> Spectrum:
+        if i < 0:
+            i += len(self)
+        return self._read(i)
+
+    def scan(self, scan: int) -> Spectrum:
+        """
+        The spectrum with this scan number (scan=... in its native ID, or its position counting from 1 if the IDs
+        don't have one).
+        """
+        return self._read(self._scans[scan])
+
+    def get(self, native_id: str) -> Spectrum:
+        return self._read(self._positions[native_id])
+
+    def _read(self, i: int) -> Spectrum:
+        start = int(self.offsets[i])
+        end = self._map.find(b'</spectrum>', start)
+        if end == -1:
+            raise ValueError(f'Spectrum {self.ids[i]} in {self.path} does not end.')
+        tag = _attributes(_SPECTRUM_TAG.match(self._map, start).group(1))
+        arrays_start = _ARRAY_LIST.search(self._map, start, end)
+        arrays_start = arrays_start.start() if arrays_start else end
+
+        ms_level, retention_time, precursor_mz, charge = 0, float('nan'), float('nan'), 0
+        for match in _CV_PARAM.finditer(self._map, start, arrays_start):
+            cv = _attributes(match.group(1))
+            accession = cv.get(b'accession')
+            if accession == b'MS:1000511':
+                ms_level = int(cv[b'value'])
+            elif accession == b'MS:1000016':
+                retention_time = float(cv[b'value'])
+                if cv.get(b'unitAccession') == b'UO:0000031' or cv.get(b'unitName') == b'minute':
+                    retention_time *= 60
+            elif accession == b'MS:1000744' and precursor_mz != precursor_mz:
+                precursor_mz = float(cv[b'value'])
+            elif accession == b'MS:1000041' and charge == 0:
+                charge = int(cv[b'value'])
+
+        arrays = {}
+        for match in _ARRAY.finditer(self._map, arrays_start, end):
+            params = [_attributes(x) for x in _CV_PARAM.findall(match.group(1))]
+            accessions = {x.get(b'accession') for x in params}
+            name = next((_ARRAYS[x] for x in accessions if x in _ARRAYS), None)
+            if name is None:
+                continue
+            dtype = next((_DTYPES[x] for x in accessions if x in _DTYPES), None)
+            if dtype is None:
+                raise ValueError(f'Unknown data type for the {name} array of {self.ids[i]} in {self.path}.')
+            data = binascii.a2b_base64(self._view[match.start(2):match.end(2)])
+            if _ZLIB in accessions:
+                data = zlib.decompress(data)
+            elif _NO_COMPRESSION not in accessions:
+                raise ValueError(f'The {name} array of {self.ids[i]} in {self.path} uses a compression other than '
+                                 f'zlib, which is not supported.')
+            arrays[name] = np.frombuffer(data, dtype=dtype)
+
+        empty = np.empty(0)
+        native_id = self.ids[i]
+        scan = _SCAN.search(native_id)
+        return Spectrum(index=int(tag.get(b'index', i)),
+                        id=native_id,
+                        scan=int(scan.group(1)) if scan else i + 1,
+                        ms_level=ms_level,
+                        retention_time=retention_time,
+                        precursor_mz=precursor_mz,
+                        charge=charge,
+                        mz=arrays.get('mz', empty),
+                        intensity=arrays.get('intensity', empty))
+
+    def batches(self, batch_size: int = 1000, indices: Iterable[int] = None) -> Iterator[SpectrumBatch]:
+        """
+        Read the spectra batch_size at a time, each batch with its peaks in one pair of flat arrays, e.g. for
+        vectorized QC metrics or to hand to another process.
+
+        :param batch_size: Spectra per batch.
+        :param indices: Positions of the spectra to read (e.g. every 50th, to sample a big file). Defaults to all.
+        """
+        indices = range(len(self)) if indices is None else indices
+        batch = []
+        for i in indices:
+            batch.append(self._read(i))
+            if len(batch) == batch_size:
+                yield self._pack(batch)
+                batch = []
+        if batch:
+            yield self._pack(batch)
+
+    @staticmethod
+    def _pack(spectra: List[Spectrum]) -> SpectrumBatch:
+        offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+        np.cumsum([len(x.mz) for x in spectra], out=offsets[1:])
+        mz = np.empty(offsets[-1], dtype=np.float64)
+        intensity = np.empty(offsets[-1], dtype=np.float32)
+        for n, spectrum in enumerate(spectra):
+            mz[offsets[n]:offsets[n + 1]] = spectrum.mz
+            intensity[offsets[n]:offsets[n + 1]] = spectrum.intensity
+        return SpectrumBatch(indices=np.array([x.index for x in spectra], dtype=np.int64),
+                             ids=[x.id for x in spectra],
+                             scans=np.array([x.scan for x in spectra], dtype=np.int64),
+                             ms_levels=np.array([x.ms_level for x in spectra], dtype=np.int8),
+                             retention_times=np.array([x.retention_time for x in spectra]),
+                             precursor_mz=np.array([x.precursor_mz for x in spectra]),
+                             charges=np.array([x.charge for x in spectra], dtype=np.int8),
+                             offsets=offsets,
+                             mz=mz,
+                             intensity=intensity)
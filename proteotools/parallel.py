@@ -0,0 +1,219 @@
+from concurrent.futures import ThreadPoolExecutor, Executor, Future, wait, FIRST_COMPLETED
+from subprocess import SubprocessError
+from typing import Callable, Iterable, Iterator, List, Tuple, Dict, Any
+from queue import Queue
+import threading
+import os
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_mb() -> int:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+def memory_to_mb(memory: str) -> int:
+    """
+    Convert a Java-style memory string (e.g. '6000M', '8G') to megabytes.
+    """
+    units = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    memory = str(memory).strip().upper()
+    if memory[-1] in units:
+        return int(float(memory[:-1]) * units[memory[-1]])
+    return int(memory) // (1024 * 1024)
+
+
+def budget(max_parallel: int,
+           threads: int = None,
+           memory: str = None) -> Tuple[int, int]:
+    """
+    Work out how many processes to run at once and how many threads each of them gets.
+
+    :param max_parallel: The requested number of concurrent processes.
+    :param threads: Threads per process. If None, the available cores are split evenly between the processes.
+    :param memory: Memory each process needs (e.g. the JVM heap). If given, max_parallel is reduced until all the
+        processes fit in the available memory.
+    :return: (number of concurrent processes, threads per process)
+    """
+    max_parallel = max(1, int(max_parallel))
+    if memory is not None:
+        fits = max(1, available_memory_mb() // max(1, memory_to_mb(memory)))
+        if fits < max_parallel:
+            print(f'Only enough memory for {fits} processes with {memory} each. Reducing max_parallel '
+                  f'from {max_parallel} to {fits}.')
+            max_parallel = fits
+    if threads is None:
+        threads = max(1, available_cores() // max_parallel)
+    return max_parallel, threads
+
+
+def run_parallel(function: Callable,
+                 items: Iterable,
+                 max_parallel: int = 1,
+                 executor: Executor = None,
+                 description: str = 'task') -> List:
+    """
+    Call function on every item, running up to max_parallel calls at once. Items can be any iterable, including a
+    generator that is still producing them; each one is submitted as soon as it arrives.
+
+    Results are returned in the same order as items. A failing item does not stop the others. Once everything has
+    finished, a SubprocessError listing every failed item is raised.
+
+    :param function: Called as function(item).
+    :param items: The things to process.
+    :param max_parallel: Maximum number of concurrent calls. Ignored if an executor is given.
+    :param executor: An existing concurrent.futures.Executor to submit the calls to.
+    :param description: What a call is, used in error messages.
+    :return: The return values of function, in input order.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, int(max_parallel)))
+
+    try:
+        return gather([(item, executor.submit(function, item)) for item in items], description=description)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def gather(submitted: Iterable[Tuple[Any, Future]],
+           description: str = 'task') -> List:
+    """
+    Wait for futures that were already submitted. A failing future does not stop the others. Once everything has
+    finished, a SubprocessError listing every failed item is raised.
+
+    :param submitted: Pairs of (item, the future running it). The item is only used in error messages.
+    :param description: What a call is, used in error messages.
+    :return: The results of the futures, in the same order.
+    """
+    results = []
+    failures = []
+    for item, future in submitted:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f'{description} failed for {item}: {e}')
+            failures.append((item, e))
+            results.append(None)
+
+    if failures:
+        failed = '\n'.join(f'  {item}: {e}' for item, e in failures)
+        raise SubprocessError(f'{len(failures)} of {len(results)} {description} runs failed:\n{failed}')
+
+    return results
+
+
+def fan_out(items: Iterable, n: int) -> List[Iterator]:
+    """
+    Give n consumers each their own iterator over the same items, e.g. to hand a generator that is still producing
+    files to several search engines. Unlike itertools.tee, the iterators can be used from different threads, and a
+    slow consumer doesn't hold up the others: the items are read on a separate thread and queued for each consumer.
+
+    If reading the items raises an exception, every iterator raises it once it has given out the items before it.
+
+    :param items: The things to hand out. Only read once.
+    :param n: Number of consumers.
+    :return: n iterators over all of the items.
+    """
+    end = object()
+    queues = [Queue() for _ in range(n)]
+
+    def read():
+        try:
+            for item in items:
+                for queue in queues:
+                    queue.put((item, None))
+        except Exception as e:
+            for queue in queues:
+                queue.put((end, e))
+        else:
+            for queue in queues:
+                queue.put((end, None))
+
+    def consume(queue):
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+
+    threading.Thread(target=read, daemon=True).start()
+    return [consume(queue) for queue in queues]
+
+
+def run_graph(tasks: Dict[str, Tuple[Callable, Iterable[str]]],
+              max_parallel: int = None) -> Dict[str, Any]:
+    """
+    Run a set of tasks that depend on each other. Each task starts as soon as everything it depends on has finished,
+    so independent chains run side by side and the total time is roughly that of the longest chain.
+
+    If a task fails, the tasks that depend on it are skipped but everything else still runs. Once nothing is left to
+    run, a SubprocessError listing the failed and skipped tasks is raised.
+
+    :param tasks: Maps a task name to (function, names of the tasks it depends on). Functions are called with no
+        arguments.
+    :param max_parallel: Maximum number of tasks running at once. Defaults to the number of tasks.
+    :return: Maps each task name to the return value of its function.
+    """
+    dependencies = {name: set(deps) for name, (_, deps) in tasks.items()}
+    for name, deps in dependencies.items():
+        unknown = deps - set(tasks)
+        if unknown:
+            raise ValueError(f'Task {name} depends on unknown task(s): {", ".join(sorted(unknown))}')
+
+    results = {}
+    failures = {}
+    skipped = []
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_parallel or max(1, len(tasks))) as executor:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for name in list(pending):
+                    deps = dependencies[name]
+                    if deps & (set(failures) | set(skipped)):
+                        skipped.append(name)
+                        del pending[name]
+                        changed = True
+                    elif deps <= set(results):
+                        function, _ = pending.pop(name)
+                        running[executor.submit(function)] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f'Circular dependencies between tasks: {", ".join(sorted(pending))}')
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f'{name} failed: {e}')
+                    failures[name] = e
+
+    if failures or skipped:
+        message = '\n'.join([f'  {name}: {e}' for name, e in failures.items()] +
+                            [f'  {name}: skipped because a task it depends on failed' for name in skipped])
+        raise SubprocessError(f'{len(failures)} task(s) failed:\n{message}')
+
+    return results
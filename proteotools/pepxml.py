@@ -0,0 +1,339 @@
+from typing import Union, Dict, Iterator, List
+from xml.etree.ElementTree import iterparse, tostring, register_namespace
+from xml.sax.saxutils import quoteattr
+from os import PathLike
+from pathlib import Path
+import numpy as np
+import os
+import re
+
+PEPXML_NS = 'http://regis-web.systemsbiology.net/pepXML'
+
+# columns every table has, and their types. search engine scores are added as float columns named after the score
+STRING_COLUMNS = ['spectrum', 'base_name', 'peptide', 'modified_peptide', 'protein', 'alternative_proteins',
+                  'prev_aa', 'next_aa']
+INT_COLUMNS = ['start_scan', 'end_scan', 'assumed_charge', 'hit_rank', 'num_tot_proteins']
+FLOAT_COLUMNS = ['precursor_neutral_mass', 'retention_time_sec', 'calc_neutral_pep_mass', 'massdiff',
+                 'peptideprophet_probability', 'iprophet_probability']
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _new_chunk() -> Dict[str, list]:
+    return {column: [] for column in STRING_COLUMNS + INT_COLUMNS + FLOAT_COLUMNS}
+
+
+def _to_arrays(chunk: Dict[str, list], scores: Dict[str, list]) -> Dict[str, np.ndarray]:
+    table = {}
+    for column in STRING_COLUMNS:
+        table[column] = np.array(chunk[column], dtype=object)
+    for column in INT_COLUMNS:
+        table[column] = np.array(chunk[column], dtype=np.int64)
+    for column in FLOAT_COLUMNS:
+        table[column] = np.array(chunk[column], dtype=np.float64)
+    for name, values in scores.items():
+        table[name] = np.array(values, dtype=np.float64)
+    return table
+
+
+def iter_pepxml(pepxml: Union[str, PathLike],
+                chunk_size: int = 100000,
+                max_rank: int = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Read a pepXML file as a series of column tables of at most chunk_size PSMs (one row per search hit). The file is
+    streamed and each spectrum_query is discarded once read, so memory use depends on chunk_size and not on the size
+    of the file.
+
+    Each table is a dict of equal-length NumPy arrays: the columns in STRING_COLUMNS (object arrays), INT_COLUMNS
+    (missing values are -1) and FLOAT_COLUMNS (missing values are NaN), plus one float column per search engine score
+    (e.g. 'expect', 'xcorr', 'SpecEValue'). PeptideProphet and iProphet probabilities are NaN when the file has not
+    been through them.
+
+    :param pepxml: The pepXML file.
+    :param chunk_size: Maximum number of PSMs per table.
+    :param max_rank: Only keep hits with at most this rank.
+    """
+    chunk = _new_chunk()
+    scores: Dict[str, list] = {}
+    n_rows = 0
+    base_name = ''
+    run_summary = None
+
+    local_names = {}  # namespaced tag -> tag without the namespace
+
+    def local(tag):
+        name = local_names.get(tag)
+        if name is None:
+            name = local_names[tag] = _local(tag)
+        return name
+
+    for event, elem in iterparse(str(pepxml), events=('start', 'end')):
+        if event == 'start':
+            if elem.tag.endswith('msms_run_summary'):
+                base_name = elem.get('base_name', '')
+                run_summary = elem
+            continue
+
+        if not elem.tag.endswith('spectrum_query'):
+            continue
+
+        query = elem.attrib
+        search_hits = [hit for result in elem for hit in result if local(hit.tag) == 'search_hit']
+        for search_hit in search_hits:
+            rank = _int(search_hit.get('hit_rank'))
+            if max_rank is not None and rank > max_rank:
+                continue
+
+            modified_peptide = ''
+            alternative_proteins = []
+            hit_scores = {}
+            peptideprophet = np.nan
+            iprophet = np.nan
+            for child in search_hit:
+                child_tag = local(child.tag)
+                if child_tag == 'search_score':
+                    hit_scores[child.get('name')] = _float(child.get('value'))
+                elif child_tag == 'alternative_protein':
+                    alternative_proteins.append(child.get('protein', ''))
+                elif child_tag == 'modification_info':
+                    modified_peptide = child.get('modified_peptide', '')
+                elif child_tag == 'analysis_result':
+                    for result in child:
+                        result_tag = local(result.tag)
+                        if result_tag == 'peptideprophet_result':
+                            peptideprophet = _float(result.get('probability'))
+                        elif result_tag == 'interprophet_result':
+                            iprophet = _float(result.get('probability'))
+
+            chunk['spectrum'].append(query.get('spectrum', ''))
+            chunk['base_name'].append(base_name)
+            chunk['peptide'].append(search_hit.get('peptide', ''))
+            chunk['modified_peptide'].append(modified_peptide or search_hit.get('peptide', ''))
+            chunk['protein'].append(search_hit.get('protein', ''))
+            chunk['alternative_proteins'].append(';'.join(alternative_proteins))
+            chunk['prev_aa'].append(search_hit.get('peptide_prev_aa', ''))
+            chunk['next_aa'].append(search_hit.get('peptide_next_aa', ''))
+            chunk['start_scan'].append(_int(query.get('start_scan')))
+            chunk['end_scan'].append(_int(query.get('end_scan')))
+            chunk['assumed_charge'].append(_int(query.get('assumed_charge')))
+            chunk['hit_rank'].append(rank)
+            chunk['num_tot_proteins'].append(_int(search_hit.get('num_tot_proteins')))
+            chunk['precursor_neutral_mass'].append(_float(query.get('precursor_neutral_mass')))
+            chunk['retention_time_sec'].append(_float(query.get('retention_time_sec')))
+            chunk['calc_neutral_pep_mass'].append(_float(search_hit.get('calc_neutral_pep_mass')))
+            chunk['massdiff'].append(_float(search_hit.get('massdiff')))
+            chunk['peptideprophet_probability'].append(peptideprophet)
+            chunk['iprophet_probability'].append(iprophet)
+
+            for name in hit_scores.keys() - scores.keys():
+                scores[name] = [np.nan] * n_rows
+            for name, values in scores.items():
+                values.append(hit_scores.get(name, np.nan))
+            n_rows += 1
+
+        # drop the spectrum_query we just read (and anything before it) so the tree doesn't grow
+        elem.clear()
+        if run_summary is not None:
+            del run_summary[:]
+
+        if n_rows >= chunk_size:
+            yield _to_arrays(chunk, scores)
+            chunk = _new_chunk()
+            scores = {}
+            n_rows = 0
+
+    if n_rows > 0:
+        yield _to_arrays(chunk, scores)
+
+
+def concatenate(tables: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Join tables from iter_pepxml (or from several files) into one. Score columns missing from some of the tables
+    are filled with NaN.
+    """
+    columns = []
+    for table in tables:
+        columns += [c for c in table if c not in columns]
+
+    result = {}
+    for column in columns:
+        parts = []
+        for table in tables:
+            if column in table:
+                parts.append(table[column])
+            else:
+                n = len(next(iter(table.values()))) if table else 0
+                parts.append(np.full(n, np.nan))
+        result[column] = np.concatenate(parts) if parts else np.array([])
+    return result
+
+
+def read_pepxml(pepxml: Union[str, PathLike, List[Union[str, PathLike]]],
+                max_rank: int = None) -> Dict[str, np.ndarray]:
+    """
+    Read one or more pepXML files into a single column table. See iter_pepxml for the columns.
+
+    :param pepxml: A pepXML file or a list of them.
+    :param max_rank: Only keep hits with at most this rank.
+    """
+    if isinstance(pepxml, (str, PathLike)):
+        pepxml = [pepxml]
+    tables = [table for f in pepxml for table in iter_pepxml(f, max_rank=max_rank)]
+    if not tables:
+        return _to_arrays(_new_chunk(), {})
+    return concatenate(tables)
+
+
+def to_dataframe(table: Dict[str, np.ndarray]):
+    """
+    Convert a table from read_pepxml or iter_pepxml to a pandas DataFrame. Requires pandas.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError('pandas is required for to_dataframe. Install it with "pip install pandas".')
+    return pd.DataFrame(table)
+
+
+def to_arrow(table: Dict[str, np.ndarray]):
+    """
+    Convert a table from read_pepxml or iter_pepxml to a pyarrow Table. Requires pyarrow.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('pyarrow is required for to_arrow. Install it with "pip install pyarrow".')
+    return pa.table({name: (values.tolist() if values.dtype == object else values) for name, values in table.items()})
+
+
+def _header_and_footer(pepxml: Union[str, PathLike]):
+    """
+    The text of a pepXML file before its first spectrum_query and after its last one.
+    """
+    header = []
+    with open(pepxml) as f:
+        for line in f:
+            for marker in ('<spectrum_query', '</msms_run_summary'):
+                i = line.find(marker)
+                if i != -1:
+                    header.append(line[:i])
+                    break
+            else:
+                header.append(line)
+                continue
+            break
+
+    with open(pepxml, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 65536))
+        tail = f.read()
+    # cut before decoding: the seek can land inside a multi-byte character, but never inside a '<'
+    footer = tail[tail.rfind(b'</msms_run_summary'):].decode()
+    return ''.join(header), footer
+
+
+def _set_attribute(text: str, tags, attribute: str, value: str) -> str:
+    """
+    Set an attribute of every one of the tags in a piece of XML text.
+    """
+    pattern = rf'(<(?:{"|".join(tags)})\s[^>]*?\b{attribute}=)("[^"]*"|\'[^\']*\')'
+    return re.sub(pattern, lambda match: match.group(1) + quoteattr(str(value)), text)
+
+
+def _best_score(spectrum_query, score: str) -> float:
+    for search_result in spectrum_query:
+        for search_hit in search_result:
+            if _local(search_hit.tag) != 'search_hit' or search_hit.get('hit_rank') != '1':
+                continue
+            for child in search_hit:
+                if _local(child.tag) == 'search_score' and child.get('name') == score:
+                    return _float(child.get('value'))
+    return np.nan
+
+
+def merge_pepxml(pepxml_files: List[Union[str, PathLike]],
+                 output: Union[str, PathLike],
+                 score: str = 'expect',
+                 higher_is_better: bool = False,
+                 replace: Dict[str, str] = None,
+                 base_name: str = None,
+                 database: str = None) -> str:
+    """
+    Merge pepXML files from searches of the same spectra (e.g. against different pieces of a database), or of
+    different spectra from the same run, into one file. For each spectrum and charge, the spectrum_query whose rank 1
+    hit has the best score is kept, along with its other hits. The header and footer come from the first file.
+
+    :param pepxml_files: The files to merge. They should all come from the same search engine.
+    :param output: The merged file.
+    :param score: The search_score to compare rank 1 hits by, e.g. 'expect' (Comet, X! Tandem) or 'MS-GF:SpecEValue'.
+    :param higher_is_better: Whether a higher score is better.
+    :param replace: Text to replace in the output, e.g. the directory of the files being merged with the directory
+        the merged file is going to, so base_name attributes point to the right place.
+    :param base_name: The base_name of the run in the output, whatever it is in the files being merged (which could
+        have been searched somewhere else, e.g. when they come from the cache).
+    :param database: The search_database local_path in the output, whatever it is in the files being merged.
+    :return: The output file.
+    """
+    register_namespace('', PEPXML_NS)
+    best = {}
+
+    for pepxml in pepxml_files:
+        run_summary = None
+        for event, elem in iterparse(str(pepxml), events=('start', 'end')):
+            if event == 'start':
+                if elem.tag.endswith('msms_run_summary'):
+                    run_summary = elem
+                continue
+            if not elem.tag.endswith('spectrum_query'):
+                continue
+
+            key = (int(elem.get('start_scan', -1)), int(elem.get('end_scan', -1)), elem.get('assumed_charge'))
+            value = _best_score(elem, score)
+            if np.isnan(value):
+                value = -np.inf if higher_is_better else np.inf
+            if key not in best or (value > best[key][0] if higher_is_better else value < best[key][0]):
+                best[key] = (value, elem)
+            if run_summary is not None:
+                del run_summary[:]
+
+    header, footer = _header_and_footer(pepxml_files[0])
+    if base_name is not None:
+        header = _set_attribute(header, ('msms_run_summary', 'search_summary'), 'base_name', base_name)
+    if database is not None:
+        header = _set_attribute(header, ('search_database',), 'local_path', database)
+    replace = replace or {}
+
+    def replaced(text):
+        for old, new in replace.items():
+            text = text.replace(old, new)
+        return text
+
+    output = Path(output)
+    tmp = output.with_name(f'.{output.name}.tmp{os.getpid()}')
+    with open(tmp, 'w') as f:
+        f.write(replaced(header))
+        for index, key in enumerate(sorted(best), start=1):
+            elem = best[key][1]
+            elem.set('index', str(index))
+            elem.tail = '\n'
+            f.write(replaced(tostring(elem, encoding='unicode')))
+        f.write(replaced(footer))
+    os.replace(tmp, output)
+
+    return str(output)
@@ -1,7 +1,10 @@
-from proteotools import PROTEOWIZARD
+from proteotools import config
 from proteotools.software import check_for_singularity
+from proteotools import singularity
+from contextlib import contextmanager
 from typing import Union, List, Literal
 from subprocess import Popen, SubprocessError
+from proteotools.execute import run_command
 from os import PathLike
 from pathlib import Path
 
@@ -9,7 +12,7 @@ from pathlib import Path
 def tool_help(tool: str):
     check_for_singularity()
 
-    singularity_command = f'singularity exec --writable-tmpfs {PROTEOWIZARD} wine {tool}'.split()
+    singularity_command = f'singularity exec --writable-tmpfs {config.tool_path("proteowizard")} wine {tool}'.split()
 
     p = Popen(singularity_command)
     _ = p.communicate()
@@ -18,30 +21,57 @@ def tool_help(tool: str):
 def run_tool(tool: str,
              command: Union[str, List[str]],
              path_to_bind: Union[str, PathLike] = '~/',
-             disable_tmpfs: bool = False):
+             disable_tmpfs: bool = False,
+             inputs: List[Union[str, PathLike]] = (),
+             outputs: List[Union[str, PathLike]] = ()):
+    """
+    Run a ProteoWizard tool in the ProteoWizard container.
 
+    :param tool: The tool, e.g. 'msconvert'.
+    :param command: Its arguments.
+    :param path_to_bind: Comma-separated directories the tool needs access to.
+    :param disable_tmpfs: Run without --writable-tmpfs.
+    :param inputs: Files the tool reads, only used to record how much data it handled. See
+        proteotools.execute.
+    :param outputs: Files the tool writes.
+    """
     check_for_singularity()
 
     if isinstance(command, list):
         command = ' '.join(command)
 
-    if not disable_tmpfs:
-        singularity_command = f'singularity exec --writable-tmpfs -B {path_to_bind} {PROTEOWIZARD} wine {tool} ' \
-                              f'{command}'.split()
-    else:
-        singularity_command = f'singularity exec -B {path_to_bind} {PROTEOWIZARD} wine {tool} {command}'.split()
+    options = [] if disable_tmpfs else ['--writable-tmpfs']
+    singularity_command = [*singularity.exec_command(config.tool_path('proteowizard'), path_to_bind, options=options),
+                           'wine', tool, *command.split()]
 
-    p = Popen(singularity_command)
-    _ = p.communicate()
+    result = run_command(singularity_command, step=tool, inputs=inputs, outputs=outputs)
 
-    if p.returncode != 0:
+    if result.returncode != 0:
         raise SubprocessError(f'There was an error running {tool}. See the above output.')
 
 
+@contextmanager
+def instance(binds: Union[str, PathLike, List[Union[str, PathLike]]],
+             disable_tmpfs: bool = False):
+    """
+    Start one ProteoWizard container with a persistent wineserver and run all the ProteoWizard tools in it until the
+    with block ends, so neither the container nor wine has to start up for every call.
+
+    :param binds: Directories the tools will need. Calls needing anything else get their own container.
+    :param disable_tmpfs: Start the instance without --writable-tmpfs.
+    """
+    check_for_singularity()
+    options = [] if disable_tmpfs else ['--writable-tmpfs']
+    with singularity.instance(config.tool_path('proteowizard'), binds, options=options) as name:
+        run_command(['singularity', 'exec', f'instance://{name}', 'wineserver', '-p'], step='wineserver')
+        yield name
+
+
 def run_idconvert(input_file,
                   output_directory,
                   output_extension,
                   format: Literal['pepXML', 'mzIdentML', 'text'] = 'pepXML',
                   disable_tmpfs: bool = False):
     command = f'{input_file} -o {output_directory} -e {output_extension} --{format}'.split()
-    run_tool('idconvert', command, path_to_bind=Path(input_file).parent, disable_tmpfs=disable_tmpfs)
+    run_tool('idconvert', command, path_to_bind=Path(input_file).parent, disable_tmpfs=disable_tmpfs,
+             inputs=[input_file])
@@ -1,120 +1,706 @@
-from proteotools import COMET, TANDEM, MSGF, TPP
+from proteotools import config
 from pathlib import Path
-from subprocess import Popen, SubprocessError
+from subprocess import SubprocessError
 from proteotools.software import check_for_tandem, check_for_comet, check_for_msgfplus
-import proteotools.tpp as tpp
-from typing import List
+from proteotools.journal import Journal, run_step
+from proteotools.executors import run_on
+from proteotools.parallel import run_parallel, gather, fan_out, run_graph, budget, available_cores
+from proteotools.execute import run_command
+from concurrent.futures import Executor, ThreadPoolExecutor, Future
+from proteotools import singularity
+from proteotools.fasta import split_fasta
+from proteotools.database import build_msgfplus_index
+from typing import List, Callable
+from itertools import chain
+import tempfile
+import shutil
+import os
+import re
 
+# proteotools.tpp, pepxml, mzml and mzid (and with them numpy) are imported in the functions that need them, so that
+# worker processes running a single search (see proteotools.executors) start quickly.
 
-def comet(parameter_file, fasta, mzml_files) -> List[str]:
+
+def _comet_parameters_with_threads(parameter_file, threads: int, directory=None) -> str:
+    """
+    Comet only reads num_threads from the parameter file, so write a temporary copy with it set (in directory, if the
+    search runs somewhere that can't see this machine's temporary directory).
+    """
+    text = Path(parameter_file).read_text()
+    text, n = re.subn(r'^num_threads\s*=.*$', f'num_threads = {threads}', text, flags=re.MULTILINE)
+    if n == 0:
+        text += f'\nnum_threads = {threads}\n'
+    fd, path = tempfile.mkstemp(prefix=Path(parameter_file).stem + '-', suffix='.params', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return path
+
+
+def _search_shards(engine: str,
+                   search_shard: Callable,
+                   mzml_files,
+                   fasta,
+                   fasta_shards: int,
+                   output_name: Callable,
+                   score: str,
+                   max_parallel: int,
+                   executor: Executor,
+                   prepare_shard: Callable = None) -> List[str]:
+    """
+    Search every mzML file against every shard of the database, then merge the results for each mzML file, keeping
+    the best scoring rank 1 hit for each spectrum.
+
+    :param search_shard: Called as search_shard(mzml, shard_fasta, shard_directory). Returns the pepXML file.
+    :param output_name: Called as output_name(mzml). Returns the name of the merged pepXML file.
+    :param prepare_shard: Called once with each shard FASTA file before any search starts, e.g. to build an index
+        that all the searches of that shard then share.
+    """
+    from proteotools.pepxml import merge_pepxml
+
+    mzml_files = list(mzml_files)
+    shards = split_fasta(fasta, fasta_shards)
+    # with an executor, everything is handed over at once and the executor decides how many run
+    parallel = max_parallel if executor is None else len(mzml_files) * len(shards)
+
+    def shard_directory(mzml, i):
+        return Path(mzml).parent / f'{Path(mzml).stem}-{engine}-shards' / f'shard{i + 1}'
+
+    def search(task):
+        mzml, i = task
+        shard_directory(mzml, i).mkdir(parents=True, exist_ok=True)
+        return search_shard(mzml, shards[i], shard_directory(mzml, i))
+
+    try:
+        if prepare_shard is not None:
+            run_parallel(prepare_shard, shards, max_parallel=min(parallel, len(shards)),
+                         description=f'{engine} (preparing database shards)')
+
+        tasks = [(mzml, i) for mzml in mzml_files for i in range(len(shards))]
+        shard_results = run_parallel(search, tasks, max_parallel=parallel, description=f'{engine} (sharded database)')
+
+        merged = []
+        for n, mzml in enumerate(mzml_files):
+            results = shard_results[n * len(shards):(n + 1) * len(shards)]
+            replace = {str(shard_directory(mzml, i)): str(Path(mzml).parent) for i in range(len(shards))}
+            replace.update({str(shard): str(fasta) for shard in shards})
+            # a search restored from the cache has the base_name and shard of the run that put it there
+            merged.append(merge_pepxml(results, output_name(mzml), score=score, replace=replace,
+                                       base_name=str(Path(mzml).parent / Path(mzml).stem), database=str(fasta)))
+            shutil.rmtree(shard_directory(mzml, 0).parent)
+    finally:
+        shutil.rmtree(Path(shards[0]).parent, ignore_errors=True)
+    return merged
+
+
+def _search_chunks(search: Callable,
+                   mzml_files,
+                   mzml_chunks: int,
+                   suffix: str) -> List[str]:
+    """
+    Split each mzML file into chunks of consecutive spectra, search all the chunks together, and stitch the results
+    for each file back into one pepXML file, with the original file name in base_name and spectrum names.
+
+    :param search: Called with the list of all the chunk files. Returns their pepXML files in the same order.
+    :param suffix: Ending of the stitched pepXML files, e.g. '-comet.pepXML'.
+    """
+    from proteotools.pepxml import merge_pepxml
+    from proteotools.mzml import split_mzml, remove_chunks
+
+    mzml_files = list(mzml_files)
+    chunks = [split_mzml(mzml, mzml_chunks) for mzml in mzml_files]
+    try:
+        results = search([chunk for file_chunks in chunks for chunk in file_chunks])
+        stitched = []
+        for mzml, file_chunks in zip(mzml_files, chunks):
+            pepxmls, results = results[:len(file_chunks)], results[len(file_chunks):]
+            replace = {str(Path(file_chunks[0]).parent): str(Path(mzml).parent)}
+            replace.update({Path(chunk).stem: Path(mzml).stem for chunk in file_chunks})
+            stitched.append(merge_pepxml(pepxmls, str(mzml).replace('.mzML', suffix), replace=replace,
+                                         base_name=str(Path(mzml).parent / Path(mzml).stem)))
+    finally:
+        remove_chunks([chunk for file_chunks in chunks for chunk in file_chunks])
+    return stitched
+
+
+def _comet_command(mzml, parameter_file, fasta, output_directory=None):
+    name = Path(mzml).stem
+    name = Path(output_directory or Path(mzml).parent) / (name + '-comet')
+    command = f'{config.tool_path("comet")} -D{fasta} -P{parameter_file} -N{name} {mzml}'.split()
+    return command, name
+
+
+def _run_comet(mzml, parameter_file, fasta, output_directory=None) -> str:
+    command, name = _comet_command(mzml, parameter_file, fasta, output_directory)
+    result = run_command(command, step='Comet', inputs=[mzml, fasta], outputs=[f'{name}.pep.xml'])
+
+    if result.returncode != 0:
+        raise SubprocessError('Something went wrong while running Comet. Inspect the above output.')
+
+    Path(f'{name}.pep.xml').rename(name.parent / f'{name}.pepXML')
+    return str(name.parent / f'{name}.pepXML')
+
+
+def comet(parameter_file, fasta, mzml_files, max_parallel: int = 1, threads: int = None,
+          executor: Executor = None, use_cache: bool = False, fasta_shards: int = 1,
+          mzml_chunks: int = 1, journal: Journal = None) -> List[str]:
+    """
+    :param parameter_file: Comet parameter file.
+    :param fasta: The database to search.
+    :param mzml_files: One or more mzML files.
+    :param max_parallel: How many Comet processes to run at once.
+    :param threads: num_threads for each Comet process. If None and max_parallel > 1, the available cores are split
+        between the processes. If None and max_parallel is 1, the value in the parameter file is used.
+    :param executor: A concurrent.futures.Executor to run the searches on, e.g. one from proteotools.executors to
+        run them on other nodes. Every file is handed to it at once, and max_parallel and the checks of the cores
+        on this machine don't apply.
+    :param use_cache: Skip files which were already searched with the same database, parameters and Comet version.
+    :param fasta_shards: Split the database into this many pieces and search them in parallel, then keep the best
+        rank 1 hit for each spectrum. Expectation values are computed per piece, so they are not identical to those
+        from searching the whole database.
+    :param mzml_chunks: Split each (indexed) mzML file into this many pieces by spectrum and search them in parallel,
+        then stitch the results back together. Useful for a few very large files.
+    :param journal: Skip files the journal says were already searched (see proteotools.journal).
+    :return: The pepXML files, in the same order as mzml_files.
+    """
     check_for_comet()
-    pepxml_results = []
 
     if isinstance(mzml_files, str):
         mzml_files = [mzml_files]
 
-    for mzml in mzml_files:
-        name = Path(mzml).stem
-        name = Path(mzml).parent / (name + '-comet')
-        command = f'{COMET} -D{fasta} -P{parameter_file} -N{name} {mzml}'.split()
-        p = Popen(command)
-        _ = p.communicate()
+    if mzml_chunks > 1:
+        return _search_chunks(lambda chunks: comet(parameter_file, fasta, chunks, max_parallel=max_parallel,
+                                                   threads=threads, executor=executor, use_cache=use_cache,
+                                                   fasta_shards=fasta_shards, journal=journal),
+                              mzml_files, mzml_chunks, '-comet.pepXML')
 
-        if p.returncode != 0:
-            raise SubprocessError('Something went wrong while running Comet. Inspect the above output.')
+    if executor is not None:
+        mzml_files = list(mzml_files)
+        max_parallel = len(mzml_files)
+        run_parameters = parameter_file if threads is None else \
+            _comet_parameters_with_threads(parameter_file, threads, directory=Path(mzml_files[0]).parent)
+    elif max_parallel > 1 or threads is not None:
+        max_parallel, threads = budget(max_parallel, threads)
+        run_parameters = _comet_parameters_with_threads(parameter_file, threads)
+    else:
+        run_parameters = parameter_file
 
-        Path(f'{name}.pep.xml').rename(name.parent / f'{name}.pepXML')
-        pepxml_results.append(str(mzml).replace('.mzML', '-comet.pepXML'))
+    def search(mzml, database=fasta, output_directory=None):
+        if not use_cache and journal is None:
+            return run_on(executor, _run_comet, mzml, run_parameters, database, output_directory)
+        pepxml = str(Path(output_directory or Path(mzml).parent) / (Path(mzml).stem + '-comet.pepXML'))
+        run_step('Comet', inputs=[mzml, database, parameter_file, config.tool_path('comet')], outputs=[pepxml],
+                 run=lambda: run_on(executor, _run_comet, mzml, run_parameters, database, output_directory),
+                 use_cache=use_cache, journal=journal)
+        return pepxml
+
+    try:
+        if fasta_shards > 1:
+            pepxml_results = _search_shards('comet', search, mzml_files, fasta, fasta_shards,
+                                            output_name=lambda mzml: str(mzml).replace('.mzML', '-comet.pepXML'),
+                                            score='expect',
+                                            max_parallel=max_parallel,
+                                            executor=executor)
+        else:
+            pepxml_results = run_parallel(search,
+                                          mzml_files,
+                                          max_parallel=max_parallel,
+                                          description='Comet')
+    finally:
+        if run_parameters != parameter_file:
+            os.remove(run_parameters)
 
     return pepxml_results
 
 
+def _msgfplus_command(mzml, parameter_file, fasta, decoy_prefix, memory, threads, output_directory=None):
+    name = Path(mzml).stem
+    mzid = Path(output_directory or Path(mzml).parent) / (name + '-msgf_plus.mzid')
+    command = f'java -Xmx{memory} -jar {config.tool_path("msgf")} -conf {parameter_file} -decoy {decoy_prefix} ' \
+              f'-tda 0 -d {fasta} -o {mzid} -s {mzml}'
+    if threads is not None:
+        command += f' -thread {threads}'
+    return command.split(), mzid
+
+
+def _idconvert_command(mzid):
+    mzid = Path(mzid)
+    command = [*singularity.exec_command(config.tool_path('tpp'), mzid.parent),
+               *f'idconvert {mzid} --pepXML -o {mzid.parent} -e -msgf_plus.pepXML'.split()]
+    return command, mzid.parent / (mzid.name[:-len('-msgf_plus.mzid')] + '-msgf_plus.pepXML')
+
+
+def _run_msgfplus(mzml, parameter_file, fasta, decoy_prefix, memory, threads, output_directory=None) -> Path:
+    command, mzid = _msgfplus_command(mzml, parameter_file, fasta, decoy_prefix, memory, threads, output_directory)
+    result = run_command(command, step='MS-GF+', inputs=[mzml, fasta], outputs=[mzid])
+
+    if result.returncode != 0:
+        raise SubprocessError('Something went wrong while running MS-GF+. Inspect the above output.')
+    return mzid
+
+
+def _mzid_to_pepxml(mzid, pepxml_converter: str) -> str:
+    if pepxml_converter == 'native':
+        from proteotools.mzid import mzid_to_pepxml
+        return mzid_to_pepxml(mzid)
+
+    command, pepxml = _idconvert_command(mzid)
+    result = run_command(command, step='idconvert', inputs=[mzid], outputs=[pepxml])
+    if result.returncode != 0:
+        raise SubprocessError('Something went wrong while running idconvert. Inspect the above output.')
+    return str(pepxml)
+
+
 def msgfplus(parameter_file, fasta, mzml_files, decoy_prefix: str = 'rev_', convert_to_pepxml: bool = True,
-             memory: str = '6000M') -> List[str]:
+             memory: str = '6000M', max_parallel: int = 1, threads: int = None,
+             executor: Executor = None, use_cache: bool = False, fasta_shards: int = 1,
+             mzml_chunks: int = 1, pepxml_converter: str = 'native', journal: Journal = None) -> List[str]:
+    """
+    :param parameter_file: MS-GF+ configuration file.
+    :param fasta: The database to search.
+    :param mzml_files: One or more mzML files.
+    :param decoy_prefix: Prefix of decoy proteins in the database.
+    :param convert_to_pepxml: Convert the mzid output to pepXML.
+    :param memory: JVM heap for each MS-GF+ process. If max_parallel processes with this much memory do not fit in
+        the available RAM, fewer are run at once.
+    :param max_parallel: How many MS-GF+ processes to run at once.
+    :param threads: Value of -thread for each MS-GF+ process. If None and max_parallel > 1, the available cores are
+        split between the processes. If None and max_parallel is 1, MS-GF+ decides.
+    :param executor: A concurrent.futures.Executor to run the searches on, e.g. one from proteotools.executors to
+        run them on other nodes. Every file is handed to it at once, and max_parallel and the checks of the cores and
+        memory on this machine don't apply. The pepXML conversions still run here.
+    :param use_cache: Skip files which were already searched with the same database, parameters and MS-GF+ version.
+    :param fasta_shards: Split the database into this many pieces and search them in parallel, then keep the best
+        rank 1 hit for each spectrum. Each piece needs a much smaller index and heap. Requires convert_to_pepxml.
+        E-values are computed per piece, so they are not identical to those from searching the whole database.
+    :param mzml_chunks: Split each (indexed) mzML file into this many pieces by spectrum and search them in parallel,
+        then stitch the results back together. Each piece needs a smaller heap. Requires convert_to_pepxml.
+    :param pepxml_converter: 'native' converts the mzid files with proteotools.mzid in this process, each one while
+        the next files are being searched. 'idconvert' runs idconvert from the TPP container after each search.
+    :param journal: Skip files the journal says were already searched (see proteotools.journal).
+    :return: The pepXML files, in the same order as mzml_files (empty if convert_to_pepxml is False).
+    """
     check_for_msgfplus()
-    pepxml_results = []
+
+    if pepxml_converter not in ('native', 'idconvert'):
+        raise ValueError(f"pepxml_converter must be 'native' or 'idconvert', not {pepxml_converter!r}.")
+
+    if (fasta_shards > 1 or mzml_chunks > 1) and not convert_to_pepxml:
+        raise ValueError('Searching a sharded database or chunked mzML files requires convert_to_pepxml=True, '
+                         'since the results are merged as pepXML.')
 
     if isinstance(mzml_files, str):
         mzml_files = [mzml_files]
 
-    for mzml in mzml_files:
-        name = Path(mzml).stem
-        mzid = Path(mzml).parent / (name + '-msgf_plus.mzid')
-        command = f'java -Xmx{memory} -jar {MSGF} -conf {parameter_file} -decoy {decoy_prefix} -tda 0 ' \
-                  f'-d {fasta} -o {mzid} -s {mzml}'.split()
-        p = Popen(command)
-        _ = p.communicate()
+    if mzml_chunks > 1:
+        return _search_chunks(lambda chunks: msgfplus(parameter_file, fasta, chunks, decoy_prefix=decoy_prefix,
+                                                      memory=memory, max_parallel=max_parallel, threads=threads,
+                                                      executor=executor, use_cache=use_cache,
+                                                      fasta_shards=fasta_shards, pepxml_converter=pepxml_converter,
+                                                      journal=journal),
+                              mzml_files, mzml_chunks, '-msgf_plus.pepXML')
+
+    if executor is not None:
+        mzml_files = list(mzml_files)
+        max_parallel = len(mzml_files)
+    elif max_parallel > 1 or threads is not None:
+        max_parallel, threads = budget(max_parallel, threads, memory=memory)
 
-        if p.returncode != 0:
-            raise SubprocessError('Something went wrong while running MS-GF+. Inspect the above output.')
+    # the native conversions run on their own threads, so a worker can start its next search right away. Not with
+    # the cache, a journal or shards, which need each pepXML file as soon as its search is done.
+    conversions = None
+    overlap = not use_cache and journal is None and fasta_shards == 1
+    if convert_to_pepxml and pepxml_converter == 'native' and overlap:
+        conversions = ThreadPoolExecutor(max_workers=max(1, min(max_parallel, available_cores())))
+    converting = {}  # conversion future -> mzid file
 
+    def run(mzml, database, output_directory):
+        mzid = run_on(executor, _run_msgfplus, mzml, parameter_file, database, decoy_prefix, memory, threads,
+                      output_directory)
+        if not convert_to_pepxml:
+            return None
+        if conversions is not None:
+            future = conversions.submit(_mzid_to_pepxml, mzid, pepxml_converter)
+            converting[future] = mzid
+            return future
+        return _mzid_to_pepxml(mzid, pepxml_converter)
+
+    def search(mzml, database=fasta, output_directory=None):
+        if not use_cache and journal is None:
+            return run(mzml, database, output_directory)
+        directory = Path(output_directory or Path(mzml).parent)
+        outputs = [directory / (Path(mzml).stem + '-msgf_plus.mzid')]
+        inputs = [mzml, database, parameter_file, config.tool_path('msgf')]
+        arguments = [decoy_prefix]
         if convert_to_pepxml:
-            command = f'singularity exec -B {Path(mzid).parent} {TPP} idconvert {mzid} --pepXML ' \
-                      f'-o {Path(mzid).parent} -e -msgf_plus.pepXML'.split()
-            p = Popen(command)
-            _ = p.communicate()
-            if p.returncode != 0:
-                raise SubprocessError('Something went wrong while running idconvert. Inspect the above output.')
-            pepxml_results.append(str(mzml).replace('.mzML', '-msgf_plus.pepXML'))
-    return pepxml_results
+            outputs.append(str(directory / (Path(mzml).stem + '-msgf_plus.pepXML')))
+            arguments.append(pepxml_converter)
+            if pepxml_converter == 'idconvert':
+                inputs.append(config.tool_path('tpp'))
+        run_step('MS-GF+', inputs=inputs, outputs=outputs, arguments=arguments,
+                 run=lambda: run(mzml, database, output_directory), use_cache=use_cache, journal=journal)
+        return outputs[1] if convert_to_pepxml else None
+
+    if fasta_shards > 1:
+        # MS-GF+ builds a missing index itself, so without this every search of a shard would build it at once
+        return _search_shards('msgf_plus', search, mzml_files, fasta, fasta_shards,
+                              output_name=lambda mzml: str(mzml).replace('.mzML', '-msgf_plus.pepXML'),
+                              score='MS-GF:SpecEValue',
+                              max_parallel=max_parallel,
+                              executor=executor,
+                              prepare_shard=lambda shard: run_on(executor, build_msgfplus_index, shard, memory))
+
+    try:
+        pepxml_results = run_parallel(search,
+                                      mzml_files,
+                                      max_parallel=max_parallel,
+                                      description='MS-GF+')
+        # wait for all the conversions, so every one that failed is reported and not just the first
+        gather([(mzid, future) for future, mzid in converting.items()], description='mzid to pepXML conversion')
+        pepxml_results = [x.result() if isinstance(x, Future) else x for x in pepxml_results]
+    finally:
+        if conversions is not None:
+            conversions.shutdown()
+    return [x for x in pepxml_results if x is not None]
+
+
+def _batches(items: List, n: int) -> List[List]:
+    """
+    Split items into at most n lists of consecutive items, as evenly as possible.
+    """
+    n = max(1, min(n, len(items)))
+    bounds = [len(items) * i // n for i in range(n + 1)]
+    return [items[bounds[i]:bounds[i + 1]] for i in range(n)]
+
+
+def msconvert_to_mgf(ms_files, overwrite_existing_mgf: bool = False, max_parallel: int = 1,
+                     journal: Journal = None) -> List[str]:
+    """
+    Convert MS files to MGF using msconvert from the TPP image. msconvert takes all the files in a directory in one
+    call, so only one container is started per directory (or max_parallel of them, each with a share of the files).
+
+    :param ms_files: One or more MS files, in a list or any other iterable.
+    :param overwrite_existing_mgf: If False, files that already have an MGF version next to them are not converted.
+    :param max_parallel: How many msconvert processes to run at once for the files in each directory.
+    :param journal: Skip files the journal says were already converted (see proteotools.journal). An existing MGF
+        file is only used if the journal has it, since it could be left over from an interrupted conversion.
+    :return: The MGF files, in the same order as ms_files.
+    """
+    if isinstance(ms_files, str):
+        ms_files = [ms_files]
+    ms_files = list(ms_files)  # the files are grouped by directory, so a generator has to be read to the end
+
+    to_convert = {}  # directory -> files to convert there
+    for ms_file in ms_files:
+        if Path(ms_file).suffix.lower() == '.mgf':
+            continue
+        if (not overwrite_existing_mgf) and journal is None and Path(ms_file).with_suffix('.mgf').exists():
+            print(f'MGF version of {ms_file} found. Using: {Path(ms_file).with_suffix(".mgf")}')
+            continue
+        print(f'Converting {ms_file} to MGF format')
+        to_convert.setdefault(Path(ms_file).parent, []).append(str(ms_file))
+
+    import proteotools.tpp as tpp
+
+    def convert(batch):
+        directory = Path(batch[0]).parent
+        mgf_files = [Path(x).with_suffix('.mgf') for x in batch]
+        run_step('msconvert', inputs=batch, outputs=mgf_files, journal=journal,
+                 run=lambda: tpp.run_tool('msconvert', f'-o {directory} --mgf {" ".join(batch)}', directory,
+                                          inputs=batch, outputs=mgf_files))
+
+    batches = [batch for files in to_convert.values() for batch in _batches(files, max_parallel)]
+    run_parallel(convert, batches, max_parallel=max_parallel, description='msconvert')
+    return [str(Path(x).with_suffix('.mgf')) for x in ms_files]
+
+
+def _runtandem_command(parameter_file, database, directory, ms_files) -> List[str]:
+    # we don't convert the tandem xml files to pepxml here. the output doesn't seem to be compatible with TPP tools
+    return f'runtandem -i {parameter_file} -db {database} --noconvert --overwrite -o {directory} ' \
+           f'--tandem.exe {config.tool_path("tandem")} -v 3 {" ".join(str(x) for x in ms_files)}'.split()
+
+
+def _tandem_parameters_with_threads(parameter_file, threads: int, directory=None) -> str:
+    """
+    Write a temporary copy of an X! Tandem parameter file with "spectrum, threads" set (in directory, if given).
+    """
+    text = Path(parameter_file).read_text()
+    note = f'<note type="input" label="spectrum, threads">{threads}</note>'
+    text, n = re.subn(r'<note[^>]*label="spectrum, threads"[^>]*>[^<]*</note>', note, text)
+    if n == 0:
+        text = text.replace('</bioml>', f'\t{note}\n</bioml>')
+    fd, path = tempfile.mkstemp(prefix=Path(parameter_file).stem + '-', suffix='.xml', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return path
+
+
+def _run_tandem(parameter_file, database, directory, batch, txml_files, pepxml_files, tandem2xml_parallel: int):
+    """
+    Search a batch of MS files with one X! Tandem process, then convert the results to pepXML with Tandem2XML.
+    """
+    command = _runtandem_command(parameter_file, database, directory, batch)
+    result = run_command(command, step='X! Tandem', inputs=[*batch, database], outputs=txml_files)
+    if result.returncode != 0:
+        raise SubprocessError('Something went wrong while running X! Tandem. Inspect the above output.')
+
+    import proteotools.tpp as tpp
+    run_parallel(lambda i: tpp.run_tool('Tandem2XML',
+                                        f'{txml_files[i]} {pepxml_files[i]}',
+                                        path_to_bind=Path(batch[i]).parent,
+                                        inputs=[txml_files[i]],
+                                        outputs=[pepxml_files[i]]),
+                 range(len(batch)),
+                 max_parallel=tandem2xml_parallel,
+                 description='Tandem2XML')
 
 
 def tandem(parameter_file,
            fasta,
            ms_files,
            convert_to_mgf: bool = True,
-           overwrite_existing_mgf: bool = False) -> List[str]:
+           overwrite_existing_mgf: bool = False,
+           use_cache: bool = False,
+           fasta_shards: int = 1,
+           max_parallel: int = 1,
+           threads: int = None,
+           journal: Journal = None,
+           executor: Executor = None) -> List[str]:
+    """
+    :param parameter_file: X! Tandem input parameter file.
+    :param fasta: The database to search.
+    :param ms_files: One or more MS files. A generator that is still producing them (e.g.
+        convert.iter_thermorawfileparser) works too: each file is converted and searched on its own as soon as it
+        arrives.
+    :param convert_to_mgf: Convert the files to MGF first (with msconvert) if they aren't already.
+    :param overwrite_existing_mgf: Convert even if an MGF file is already there.
+    :param use_cache: Skip searches which were already run with the same inputs (see proteotools.cache).
+    :param fasta_shards: Split the database into this many pieces, search each one and merge the results.
+    :param max_parallel: Split the files between this many X! Tandem processes, run at the same time.
+    :param threads: Threads for each X! Tandem process ("spectrum, threads"). If max_parallel or threads is given
+        and threads is not, the available cores are split between the processes. Otherwise the thread count in
+        parameter_file is used.
+    :param journal: Skip batches of files the journal says were already searched (see proteotools.journal).
+    :param executor: A concurrent.futures.Executor to run the X! Tandem processes on, e.g. one from
+        proteotools.executors to run them on other nodes. All max_parallel batches (or, for a generator, up to
+        max_parallel files) are handed to it at once, and the checks of the cores on this machine don't apply. The MGF
+        conversion still runs here.
+    :return: The pepXML files, in the same order as ms_files.
+    """
     check_for_tandem()
-    output_dir = Path(ms_files[0]).expanduser().parent
 
     if isinstance(ms_files, str):
         ms_files = [ms_files]
 
-    ms_file_ext = Path(ms_files[0]).suffix
+    # files still being produced (e.g. by convert.iter_thermorawfileparser) are searched one at a time as they
+    # arrive, instead of being split into max_parallel batches once they are all there
+    streaming = not isinstance(ms_files, (list, tuple))
+    if streaming:
+        ms_files = iter(ms_files)
+        first = next(ms_files, None)
+        if first is None:
+            return []
+        ms_files = chain([first], ms_files)
+    else:
+        first = ms_files[0]
 
-    if convert_to_mgf and ms_file_ext not in ['.mfg', '.MGF']:
-        for ms_file in ms_files:
-            if (not overwrite_existing_mgf) and Path(ms_file).with_suffix('.mgf').exists():
-                print(f'MGF version of {ms_file} found. Using: {Path(ms_file).with_suffix(".mgf")}')
-                continue
-            print(f'Converting {ms_file} to MGF format')
-            tpp.run_tool('msconvert', f'-o {Path(ms_file).parent} --mgf {ms_file}', Path(ms_file).parent)
-        ms_files = [str(Path(x).with_suffix('.mgf')) for x in ms_files]
+    output_dir = Path(first).expanduser().parent
+    ms_file_ext = Path(first).suffix
 
-    # we don't convert the tandem xml files to pepxml here. the output doesn't seem to be compatible with TPP tools
-    command = f'runtandem -i {parameter_file} -db {fasta} --noconvert --overwrite -o {output_dir} --tandem.exe {TANDEM} -v 3 ' \
-              f'{" ".join(ms_files)}'.split()
-    p = Popen(command)
-    _ = p.communicate()
-    if p.returncode != 0:
-        raise SubprocessError('Something went wrong while running X! Tandem. Inspect the above output.')
-    pepxml_results = []
+    if executor is not None:
+        max_parallel = max(1, int(max_parallel))
+        run_parameters = parameter_file if threads is None else \
+            _tandem_parameters_with_threads(parameter_file, threads, directory=output_dir)
+    elif max_parallel > 1 or threads is not None:
+        max_parallel, threads = budget(max_parallel, threads)
+        run_parameters = _tandem_parameters_with_threads(parameter_file, threads)
+    else:
+        run_parameters = parameter_file
+    # msconvert and Tandem2XML are single threaded and don't run at the same time as the search, so they can use all
+    # the cores it was given
+    cores = max_parallel * threads if threads is not None else available_cores()
 
-    # convert to pepXML using Tandem2XML
-    for ms_file in ms_files:
-        txml = Path(ms_file).with_suffix('.t.xml')  # get the name of the tandem XML file
-        t_pepxml = str(txml).replace('.t.xml', '-tandem.pepXML')  # this is the name for the pepXML file we will create
-        bind_point = Path(ms_file).parent
-        tpp.run_tool('Tandem2XML',
-                     f'{txml} {t_pepxml}',
-                     path_to_bind=bind_point)
-        pepxml_results.append(t_pepxml)
-    return pepxml_results
+    if convert_to_mgf and ms_file_ext not in ['.mgf', '.MGF']:
+        if streaming:
+            ms_files = (msconvert_to_mgf([x], overwrite_existing_mgf=overwrite_existing_mgf, journal=journal)[0]
+                        for x in ms_files)
+        else:
+            ms_files = msconvert_to_mgf(ms_files, overwrite_existing_mgf=overwrite_existing_mgf, max_parallel=cores,
+                                        journal=journal)
+
+    def search_batch(batch, database, directory) -> List[str]:
+        txml_files = [Path(directory) / (Path(x).stem + '.t.xml') for x in batch]  # the tandem XML files
+        pepxml_results = [str(x).replace('.t.xml', '-tandem.pepXML') for x in txml_files]  # the pepXML files we create
+
+        # the Tandem2XML conversions run on the cores the search was using
+        def run():
+            run_on(executor, _run_tandem, run_parameters, database, directory, batch, txml_files, pepxml_results,
+                   max(1, cores // max_parallel))
+
+        run_step('X! Tandem',
+                 inputs=[*batch, database, parameter_file, config.tool_path('tandem'), config.tool_path('tpp')],
+                 outputs=pepxml_results, run=run, use_cache=use_cache, journal=journal)
+        return pepxml_results
+
+    batches = ([x] for x in ms_files) if streaming else _batches(ms_files, max_parallel)
+    shards, shard_dirs, shard_fastas = [fasta], [output_dir], None
+    try:
+        if fasta_shards > 1:
+            shards = split_fasta(fasta, fasta_shards)
+            shard_fastas = Path(shards[0]).parent
+            shard_dirs = [output_dir / 'tandem-shards' / f'shard{i + 1}' for i in range(len(shards))]
+            for directory in shard_dirs:
+                directory.mkdir(parents=True, exist_ok=True)
+
+        # every batch of every shard in one pool, so there are never more than max_parallel X! Tandem processes
+        tasks = []
+
+        def each_task():
+            for batch in batches:
+                for i in range(len(shards)):
+                    tasks.append((i, batch))
+                    yield i, batch
+
+        if executor is None:
+            parallel = max_parallel
+        else:
+            parallel = max_parallel * len(shards) if streaming else len(shards) * len(batches)
+        results = run_parallel(lambda task: search_batch(task[1], shards[task[0]], shard_dirs[task[0]]),
+                               each_task(),
+                               max_parallel=parallel,
+                               description='X! Tandem' if fasta_shards <= 1 else 'X! Tandem (sharded database)')
+        shard_results = [[pepxml for (i, _), batch_results in zip(tasks, results) if i == shard
+                          for pepxml in batch_results]
+                         for shard in range(len(shards))]
+        if fasta_shards <= 1:
+            return shard_results[0]
+        ms_files = [ms_file for i, batch in tasks if i == 0 for ms_file in batch]
+
+        from proteotools.pepxml import merge_pepxml
+
+        replace = {str(directory): str(output_dir) for directory in shard_dirs}
+        replace.update({str(shard): str(fasta) for shard in shards})
+        pepxml_results = [merge_pepxml([results[n] for results in shard_results],
+                                       output_dir / (Path(ms_file).stem + '-tandem.pepXML'),
+                                       score='expect',
+                                       replace=replace,
+                                       base_name=str(output_dir / Path(ms_file).stem),
+                                       database=str(fasta))
+                          for n, ms_file in enumerate(ms_files)]
+        shutil.rmtree(output_dir / 'tandem-shards')
+        return pepxml_results
+    finally:
+        if run_parameters != parameter_file:
+            os.remove(run_parameters)
+        if shard_fastas is not None:
+            shutil.rmtree(shard_fastas, ignore_errors=True)
 
 
 def run_all_with_defaults(comet_parameters,
                           msgfplus_parameters,
                           tandem_parameters,
                           fasta,
-                          mzml_files) -> List[str]:
-    pepxml_files = comet(parameter_file=comet_parameters,
-                         fasta=fasta,
-                         mzml_files=mzml_files)
-    pepxml_files += msgfplus(parameter_file=msgfplus_parameters,
-                             fasta=fasta,
-                             mzml_files=mzml_files)
-    pepxml_files += tandem(parameter_file=tandem_parameters,
-                           fasta=fasta,
-                           ms_files=mzml_files)
-
-    return pepxml_files
+                          mzml_files,
+                          threads: int = None,
+                          max_parallel: int = None,
+                          concurrent: bool = True,
+                          use_cache: bool = False,
+                          journal: Journal = None,
+                          executor: Executor = None) -> List[str]:
+    """
+    Search the mzML files with Comet, MS-GF+ and X! Tandem.
+
+    By default the engines run at the same time: Comet, MS-GF+ and the MGF conversion for X! Tandem start together,
+    and X! Tandem starts as soon as its MGF files are ready.
+
+    threads and max_parallel are totals for the whole search. When running concurrently, each engine gets a third of
+    both: e.g. threads=48 and max_parallel=6 runs two processes per engine with 8 threads each. When running one
+    engine after the other, each engine gets all of them: 6 processes with 8 threads each.
+
+    :param comet_parameters: Comet parameter file.
+    :param msgfplus_parameters: MS-GF+ configuration file.
+    :param tandem_parameters: X! Tandem parameter file.
+    :param fasta: The database to search.
+    :param mzml_files: One or more mzML files. A generator that is still producing them (e.g.
+        convert.iter_thermorawfileparser) works too: each engine starts on each file as soon as it arrives.
+    :param threads: Total number of cores to use, split between the search processes. Defaults to all available
+        cores (or, for a single search process at a time, to the thread settings in the parameter files).
+    :param max_parallel: Total number of search processes to run at once, at least one per engine. Defaults to one
+        per engine.
+    :param concurrent: Run the engines at the same time. If False, they run one after the other.
+    :param use_cache: Skip searches which were already run with the same inputs (see proteotools.cache).
+    :param journal: Skip the searches (and MGF conversions) the journal says were already done, e.g. when running
+        again after the job was killed (see proteotools.journal).
+    :param executor: A concurrent.futures.Executor to run the searches on, e.g. one from proteotools.executors to run
+        them on other nodes. Every search is handed to it at once, and threads is the number of threads each search
+        process gets.
+    :return: The pepXML files: all Comet results, then MS-GF+, then X! Tandem.
+    """
+    if isinstance(mzml_files, str):
+        mzml_files = [mzml_files]
+    if isinstance(mzml_files, (list, tuple)):
+        comet_files = msgfplus_files = tandem_files = mzml_files
+    else:
+        # every engine gets each file from the generator, as soon as it is there
+        comet_files, msgfplus_files, tandem_files = fan_out(mzml_files, 3)
+
+    engines = 3 if concurrent else 1
+    engine_parallel = max(1, (max_parallel or engines) // engines)
+    local_threads = max(1, (threads or available_cores()) // engines)
+    if executor is not None:
+        # on an executor, each search process has a node (or its share of one) to itself
+        engine_threads = threads
+    elif threads is None and not concurrent and engine_parallel == 1:
+        engine_threads = None
+    else:
+        engine_threads = max(1, local_threads // engine_parallel)
+
+    def run_comet():
+        return comet(parameter_file=comet_parameters,
+                     fasta=fasta,
+                     mzml_files=comet_files,
+                     max_parallel=engine_parallel,
+                     threads=engine_threads,
+                     use_cache=use_cache,
+                     journal=journal,
+                     executor=executor)
+
+    def run_msgfplus():
+        return msgfplus(parameter_file=msgfplus_parameters,
+                        fasta=fasta,
+                        mzml_files=msgfplus_files,
+                        max_parallel=engine_parallel,
+                        threads=engine_threads,
+                        use_cache=use_cache,
+                        journal=journal,
+                        executor=executor)
+
+    def run_tandem(ms_files, convert_to_mgf=True):
+        return tandem(parameter_file=tandem_parameters,
+                      fasta=fasta,
+                      ms_files=ms_files,
+                      convert_to_mgf=convert_to_mgf,
+                      max_parallel=engine_parallel,
+                      threads=engine_threads,
+                      use_cache=use_cache,
+                      journal=journal,
+                      executor=executor)
+
+    if not concurrent:
+        return run_comet() + run_msgfplus() + run_tandem(tandem_files)
+
+    if isinstance(tandem_files, (list, tuple)):
+        mgf_files = [str(Path(x).with_suffix('.mgf')) for x in tandem_files]
+        tandem_tasks = {
+            'msconvert': (lambda: msconvert_to_mgf(tandem_files, max_parallel=local_threads, journal=journal), []),
+            'X! Tandem': (lambda: run_tandem(mgf_files, convert_to_mgf=False), ['msconvert']),
+        }
+    else:
+        # X! Tandem converts each file to MGF as it arrives
+        tandem_tasks = {'X! Tandem': (lambda: run_tandem(tandem_files), [])}
+    results = run_graph({
+        'Comet': (run_comet, []),
+        'MS-GF+': (run_msgfplus, []),
+        **tandem_tasks,
+    })
+
+    return results['Comet'] + results['MS-GF+'] + results['X! Tandem']
@@ -0,0 +1,85 @@
+from typing import Union, List, Iterable
+from subprocess import SubprocessError
+from proteotools.execute import run_command
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+import threading
+import uuid
+
+# image -> (instance name, bound directories) for the instances started by instance()
+_instances = {}
+_lock = threading.Lock()
+
+
+def _bind_sources(binds: Union[str, PathLike, Iterable[Union[str, PathLike]]]) -> List[Path]:
+    if isinstance(binds, (str, PathLike)):
+        binds = str(binds).split(',')
+    return [Path(str(b).split(':')[0]).expanduser().resolve() for b in binds if str(b)]
+
+
+def _is_covered(path_to_bind: Union[str, PathLike], bound: List[Path]) -> bool:
+    for path in _bind_sources(path_to_bind):
+        if not any(path == b or b in path.parents for b in bound):
+            return False
+    return True
+
+
+def exec_command(image: Union[str, PathLike],
+                 path_to_bind: Union[str, PathLike],
+                 options: List[str] = ()) -> List[str]:
+    """
+    The start of a command line which runs something in image. If an instance of image was started with instance()
+    and it can see everything in path_to_bind, the command goes to that instance. Otherwise a fresh container is
+    started with singularity exec.
+
+    :param image: The SIF file or sandbox directory.
+    :param path_to_bind: Comma-separated directories the command needs access to.
+    :param options: Extra options for singularity exec (not used when going through an instance, since the
+        instance was started with its own).
+    """
+    with _lock:
+        running = _instances.get(str(image))
+    if running is not None and _is_covered(path_to_bind, running[1]):
+        return ['singularity', 'exec', f'instance://{running[0]}']
+    return ['singularity', 'exec', *options, '-B', str(path_to_bind), str(image)]
+
+
+@contextmanager
+def instance(image: Union[str, PathLike],
+             binds: Union[str, PathLike, Iterable[Union[str, PathLike]]],
+             options: List[str] = (),
+             name: str = None):
+    """
+    Start a long-lived Singularity instance of image and send every tool call for that image through it until the
+    with block ends. This saves the cost of starting a container for each call. Calls that need a directory which
+    is not under one of binds still get their own container.
+
+    :param image: The SIF file or sandbox directory.
+    :param binds: Directories to make available inside the instance.
+    :param options: Extra options for singularity instance start, e.g. ['--writable-tmpfs'].
+    :param name: Name for the instance. A unique one is made up if not given.
+    :return: The instance name.
+    """
+    if name is None:
+        name = f'proteotools-{uuid.uuid4().hex[:8]}'
+    bound = _bind_sources(binds)
+
+    with _lock:
+        if str(image) in _instances:
+            raise RuntimeError(f'An instance of {image} is already running: {_instances[str(image)][0]}')
+
+    command = ['singularity', 'instance', 'start', *options, '-B', ','.join(str(x) for x in bound), str(image), name]
+    result = run_command(command, step='singularity instance start')
+    if result.returncode != 0:
+        raise SubprocessError(f'There was an error starting a Singularity instance of {image}. '
+                              f'See the above output.')
+
+    with _lock:
+        _instances[str(image)] = (name, bound)
+    try:
+        yield name
+    finally:
+        with _lock:
+            del _instances[str(image)]
+        run_command(['singularity', 'instance', 'stop', name], step='singularity instance stop')
@@ -1,165 +1,440 @@
 from pathlib import Path
 from subprocess import Popen, PIPE
-from zipfile import ZipFile
+from contextlib import contextmanager
+from os import PathLike
+from typing import NamedTuple, Optional, Dict, Callable, List, Union
+import threading
+import hashlib
+import shutil
+import fcntl
+import json
+import time
 import os
-from proteotools import TOOL_DIR, COMET, TANDEM, MSGF, THERMORAWFILEPARSER
-
-
-def download_search_engines():
-
-    if not TOOL_DIR.exists():
-        TOOL_DIR.mkdir()
-
-    downloads = TOOL_DIR / 'downloads'
-
-    if not downloads.exists():
-        downloads.mkdir()
-
-    msgfplus = 'https://github.com/MSGFPlus/msgfplus/releases/download/v2022.01.10/MSGFPlus_v20220107.zip'
-    xtandem = 'http://ftp.thegpm.org/projects/tandem/source/tandem-linux-17-02-01-4.zip'
-    comet = 'https://github.com/UWPR/Comet/releases/download/v2021.02.0/comet.linux.exe'
-
-    for url in [msgfplus, xtandem, comet]:
-        name = Path(url).name
-
-        command = f'wget -O {downloads/name} {url}'.split()
-        p = Popen(command)
-        _ = p.communicate()
-        if p.returncode != 0:
-            raise ConnectionError(f"There was a problem downloading {url}. Check the above output.")
-
-        if 'tandem-linux' in name:
-            zipfile = ZipFile(downloads / name)
-            zipfile.extractall(path=downloads)
-            (downloads / 'tandem-linux-17-02-01-4').rename(TOOL_DIR / 'tandem')
-            _ = Popen(['chmod', '+x', TANDEM]).communicate()
-        elif 'comet.linux' in name:
-            if not (TOOL_DIR / 'comet').exists():
-                (TOOL_DIR / 'comet').mkdir()
-            (downloads / 'comet.linux.exe').rename(TOOL_DIR / 'comet' / 'comet.linux.exe')
-            _ = Popen(['chmod', '+x', COMET]).communicate()
-        elif 'MSGFPlus' in name:
-            zipfile = ZipFile(downloads / name)
-            zipfile.extractall(path=TOOL_DIR / 'msgfplus')
-
-
-def check_for_thermorawfileparser():
-    command = 'mono --version'.split()
-    p = Popen(command, stdout=PIPE)
-    _ = p.communicate()
-
+from proteotools import config
+from proteotools.parallel import run_parallel
+
+
+class Tool(NamedTuple):
+    path: str
+    version: Optional[str]
+
+
+# tool name -> Tool, filled in by the check_for_* functions the first time each tool is found at its current path
+_registry: Dict[str, Tool] = {}
+_registry_lock = threading.Lock()
+
+
+def registered_tools() -> Dict[str, Tool]:
+    """
+    The tools that have been found so far in this process, with their paths and versions.
+    """
+    with _registry_lock:
+        return dict(_registry)
+
+
+def invalidate(tool: str = None):
+    """
+    Forget what is known about a tool (or about all of them if tool is None), so the next check probes it again.
+    Call this after installing or updating something while Python is running.
+    """
+    with _registry_lock:
+        if tool is None:
+            _registry.clear()
+        else:
+            _registry.pop(tool, None)
+
+
+def _registered(tool: str, path, probe) -> Tool:
+    """
+    What probe() found for the tool, from the registry if the tool was already found at the path it resolves to now.
+    A tool that now resolves to another path (e.g. after its setting was changed) is probed again.
+    """
+    with _registry_lock:
+        if tool in _registry and _registry[tool].path == str(path):
+            return _registry[tool]
+        _registry.pop(tool, None)
+    found = probe()  # raises if the tool is missing, in which case nothing is remembered
+    with _registry_lock:
+        _registry[tool] = found
+    return found
+
+
+def _version(command) -> Optional[str]:
+    p = Popen(command, stdout=PIPE, stderr=PIPE)
+    out, _ = p.communicate()
     if p.returncode != 0:
-        raise OSError('Mono does not appear to be installed. Mono is required for running ThermoRawFileParser.')
+        return None
+    lines = out.decode(errors='replace').strip().splitlines()
+    return lines[0].strip() if lines else ''
 
-    command = f'mono {THERMORAWFILEPARSER} --version'.split()
-    p = Popen(command, stdout=PIPE)
-    _ = p.communicate()
 
-    if p.returncode != 0:
-        raise OSError('ThermoRawFileParser does not appear to be installed. It is required to convert Thermo '
-                      'raw files.')
+def check_for_mono() -> Tool:
+    def probe():
+        version = _version('mono --version'.split())
+        if version is None:
+            raise OSError('Mono does not appear to be installed. Mono is required for running ThermoRawFileParser.')
+        return Tool(shutil.which('mono'), version)
 
+    return _registered('mono', shutil.which('mono'), probe)
 
-def download_thermorawfileparser():
-    url = 'https://github.com/compomics/ThermoRawFileParser/releases/download/v1.3.4/ThermoRawFileParser.zip'
 
-    if not TOOL_DIR.exists():
-        TOOL_DIR.mkdir()
+def check_for_thermorawfileparser() -> Tool:
+    check_for_mono()
 
-    downloads = TOOL_DIR / 'downloads'
+    def probe():
+        version = _version(f'mono {config.tool_path("thermorawfileparser")} --version'.split())
+        if version is None:
+            raise OSError('ThermoRawFileParser does not appear to be installed. It is required to convert Thermo '
+                          'raw files.')
+        return Tool(str(config.tool_path('thermorawfileparser')), version)
 
-    if not downloads.exists():
-        downloads.mkdir()
+    return _registered('ThermoRawFileParser', config.tool_path('thermorawfileparser'), probe)
 
-    name = Path(url).name
 
-    command = f'wget -O {downloads / name} {url}'.split()
-    p = Popen(command)
-    _ = p.communicate()
-    if p.returncode != 0:
-        raise ConnectionError(f"There was a problem downloading {url}. Check the above output.")
+def check_for_singularity() -> Tool:
+    def probe():
+        version = _version('singularity --version'.split())
+        if version is None:
+            raise OSError('Singularity does not appear to be installed. Singularity is required for for running '
+                          'TPP tools.')
+        return Tool(shutil.which('singularity'), version)
 
-    zipfile = ZipFile(downloads / name)
-    zipfile.extractall(path=TOOL_DIR / 'ThermoRawFileParser')
+    return _registered('singularity', shutil.which('singularity'), probe)
 
 
-def check_for_singularity():
-    command = 'singularity --version'.split()
-    p = Popen(command, stdout=PIPE)
-    _ = p.communicate()
+def _check_for_file(tool: str, path: Path) -> Tool:
+    def probe():
+        if not Path(path).exists():
+            raise EnvironmentError(f'{tool} not found at {path}. If you have not, run '
+                                   f'proteotools.software.download_all(). '
+                                   f'Otherwise, check the above output for more information.')
+        return Tool(str(path), None)
 
-    if p.returncode != 0:
-        raise OSError('Singularity does not appear to be installed. Singularity is required for for running TPP tools.')
+    return _registered(tool, path, probe)
 
 
-def check_for_comet():
-    if not Path(COMET).exists():
-        raise EnvironmentError('Comet not found. If you have not, run "proteotools.software.download_search_engines(). '
-                               'Otherwise, check the above output for more information.')
+def check_for_comet() -> Tool:
+    return _check_for_file('Comet', config.tool_path('comet'))
 
 
-def check_for_tandem():
-    if not Path(TANDEM).exists():
-        raise EnvironmentError('X! Tandem not found. If you have not, run "proteotools.software.download_search_engines(). '
-                               'Otherwise, check the above output for more information.')
+def check_for_tandem() -> Tool:
+    return _check_for_file('X! Tandem', config.tool_path('tandem'))
 
 
-def check_for_msgfplus():
-    if not Path(MSGF).exists():
-        raise EnvironmentError('MS-GF+ not found. If you have not, run "proteotools.software.download_search_engines(). '
-                               'Otherwise, check the above output for more information.')
+def check_for_msgfplus() -> Tool:
+    return _check_for_file('MS-GF+', config.tool_path('msgf'))
 
 
-def get_tpp():
+class Package(NamedTuple):
+    name: str  # as in registered_tools()
+    url: str
+    file: str  # name of the download, in ~/.proteotools_software/downloads and in mirrors
+    tool: str  # the tool setting in proteotools.config
+    install: Callable[[Path, Path], None]  # called as install(download, target) to install the package
+    sha256: Optional[str] = None  # pinned checksum of the download
 
-    print('Pulling TPP image')
 
-    check_for_singularity()
+def _downloads() -> Path:
+    return config.tool_dir() / 'downloads'
 
-    if not TOOL_DIR.exists():
-        TOOL_DIR.mkdir()
 
-    if not (TOOL_DIR / 'tpp').exists():
-        (TOOL_DIR / 'tpp').mkdir()
+def _installed() -> Path:
+    return config.tool_dir() / 'installed.json'
 
-    command = f'singularity pull library://kkovalchik/tpp/tpp:6-0-0'.split()
 
-    cwd = os.getcwd()
-    os.chdir(TOOL_DIR / 'tpp')
-    p = Popen(command)
-    _ = p.communicate()
-    os.chdir(cwd)
+def _link_or_copy(source: Path, destination: Path):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp = destination.with_name(f'.{destination.name}.tmp{os.getpid()}')
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, destination)
 
-    if p.returncode != 0:
-        raise OSError('There was a problem pulling the TPP Singularity image. Please see the above output.')
 
+def _install_executable(download: Path, target: Path):
+    _link_or_copy(download, target)
+    os.chmod(target, 0o755)
 
-def get_proteowizard():
-    print('Pulling ProteoWizard image')
 
-    check_for_singularity()
+def _install_zip(subdirectory: str, top_level: str = None, executable: bool = False) -> Callable[[Path, Path], None]:
+    """
+    Unpack a zip file into a subdirectory of the tool directory, replacing whatever was there. top_level is the folder
+    inside the zip file that becomes the subdirectory, if it has one.
+    """
+    def install(download: Path, target: Path):
+        from zipfile import ZipFile
 
-    if not TOOL_DIR.exists():
-        TOOL_DIR.mkdir()
-    if not (TOOL_DIR / 'proteowizard').exists():
-        (TOOL_DIR / 'proteowizard').mkdir()
+        directory = config.tool_dir() / subdirectory
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp = directory.with_name(f'.{directory.name}.tmp{os.getpid()}')
+        shutil.rmtree(tmp, ignore_errors=True)
+        ZipFile(download).extractall(path=tmp)
+        shutil.rmtree(directory, ignore_errors=True)
+        (tmp / top_level if top_level else tmp).rename(directory)
+        shutil.rmtree(tmp, ignore_errors=True)
+        if executable:
+            os.chmod(target, 0o755)
+    return install
 
-    command = f'singularity build --sandbox proteowizard docker://chambm/pwiz-skyline-i-agree-to-the-vendor-licenses'.split()
 
-    cwd = os.getcwd()
-    os.chdir(TOOL_DIR / 'proteowizard')
-    p = Popen(command)
+def _install_sandbox(download: Path, directory: Path):
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    p = Popen(['singularity', 'build', '--force', '--sandbox', str(directory), str(download)])
     _ = p.communicate()
-    os.chdir(cwd)
-
     if p.returncode != 0:
-        raise OSError('There was a problem pulling the ProteoWizard Singularity image. Please see the above output.')
-
-
-def download_all():
-    download_search_engines()
-    get_tpp()
-    download_thermorawfileparser()
+        raise OSError(f'There was a problem building the Singularity sandbox {directory}. Please see the above '
+                      f'output.')
+
+
+# No checksums are pinned yet: none has been taken from the released archives, and a made up or unchecked value is
+# worse than none. Until they are filled in, install() verifies downloads against a mirror's SHA256SUMS file or an
+# earlier installation, and otherwise refuses to install unless it is called with allow_unpinned=True.
+PACKAGES: Dict[str, Package] = {x.name: x for x in [
+    Package('MS-GF+', 'https://github.com/MSGFPlus/msgfplus/releases/download/v2022.01.10/MSGFPlus_v20220107.zip',
+            'MSGFPlus_v20220107.zip', 'msgf', _install_zip('msgfplus')),
+    Package('X! Tandem', 'http://ftp.thegpm.org/projects/tandem/source/tandem-linux-17-02-01-4.zip',
+            'tandem-linux-17-02-01-4.zip', 'tandem',
+            _install_zip('tandem', top_level='tandem-linux-17-02-01-4', executable=True)),
+    Package('Comet', 'https://github.com/UWPR/Comet/releases/download/v2021.02.0/comet.linux.exe',
+            'comet.linux.exe', 'comet', _install_executable),
+    Package('ThermoRawFileParser',
+            'https://github.com/compomics/ThermoRawFileParser/releases/download/v1.3.4/ThermoRawFileParser.zip',
+            'ThermoRawFileParser.zip', 'thermorawfileparser', _install_zip('ThermoRawFileParser')),
+    Package('TPP', 'library://kkovalchik/tpp/tpp:6-0-0', 'tpp_6-0-0.sif', 'tpp', _link_or_copy),
+    Package('ProteoWizard', 'docker://chambm/pwiz-skyline-i-agree-to-the-vendor-licenses', 'proteowizard.sif',
+            'proteowizard', _install_sandbox),
+]}
+
+SEARCH_ENGINES = ['MS-GF+', 'X! Tandem', 'Comet']
+
+
+@contextmanager
+def _locked(name: str):
+    """
+    Hold a lock on one file in the downloads directory, so that concurrent processes (e.g. several cluster nodes
+    sharing a home directory) don't download or install the same thing at once.
+    """
+    downloads = _downloads()
+    downloads.mkdir(parents=True, exist_ok=True)
+    with open(downloads / f'{name}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def installed_tools() -> Dict[str, dict]:
+    """
+    What has been installed by download_all and friends: tool name -> the URL, file and SHA-256 checksum of the
+    download it was installed from, and when.
+    """
+    installed = _installed()
+    return json.loads(installed.read_text()) if installed.exists() else {}
+
+
+def _record_installation(package: Package, sha256: str):
+    manifest = _installed()
+    with _locked(manifest.name):
+        installed = installed_tools()
+        installed[package.name] = {'url': package.url, 'file': package.file, 'sha256': sha256,
+                                   'path': str(config.default_tool_path(package.tool)), 'installed': time.time()}
+        tmp = manifest.with_name(f'.{manifest.name}.tmp{os.getpid()}')
+        tmp.write_text(json.dumps(installed, indent=2))
+        os.replace(tmp, manifest)
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _is_url(mirror: Union[str, PathLike]) -> bool:
+    return '://' in str(mirror)
+
+
+def _mirror_sums(mirror: Union[str, PathLike]) -> str:
+    """
+    The SHA256SUMS file of a mirror directory or URL (see make_mirror), or '' if it doesn't have one.
+    """
+    if _is_url(mirror):
+        from urllib.request import urlopen
+        try:
+            with urlopen(f'{str(mirror).rstrip("/")}/SHA256SUMS') as f:
+                return f.read().decode()
+        except OSError:
+            return ''
+    sums = Path(mirror).expanduser() / 'SHA256SUMS'
+    return sums.read_text() if sums.exists() else ''
+
+
+def _expected_sha256(package: Package, mirror: Union[str, PathLike, None]) -> Optional[str]:
+    """
+    The checksum to verify the download against: the pinned one, the one in the mirror's SHA256SUMS file, or the one
+    recorded when the same URL was first installed, in that order.
+    """
+    if package.sha256 is not None:
+        return package.sha256
+    if mirror is not None:
+        for line in _mirror_sums(mirror).splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].lstrip('*') == package.file:
+                return parts[0].lower()
+    installed = installed_tools().get(package.name, {})
+    if installed.get('url') == package.url:
+        return installed.get('sha256')
+    return None
+
+
+def _fetch(package: Package, mirror: Union[str, PathLike, None], expected: Optional[str]) -> str:
+    """
+    Get the download into the downloads directory, unless a verified copy is already there. Downloads go to a .part
+    file first, which wget resumes if an earlier download was interrupted.
+
+    :return: The SHA-256 checksum of the download.
+    """
+    download = _downloads() / package.file
+    if download.exists():
+        sha = _sha256(download)
+        if expected is None or sha == expected:
+            return sha
+        download.unlink()
+
+    partial = _downloads() / f'{package.file}.part'
+    if mirror is not None and not _is_url(mirror):
+        source = Path(mirror).expanduser() / package.file
+        print(f'Copying {source}')
+        shutil.copyfile(source, partial)
+    elif mirror is None and package.url.split('://')[0] in ['library', 'docker']:
+        source = package.url
+        print(f'Pulling {source}')
+        check_for_singularity()
+        p = Popen(['singularity', 'pull', '--force', str(partial), source])
+        _ = p.communicate()
+        if p.returncode != 0:
+            raise OSError(f'There was a problem pulling {source}. Please see the above output.')
+    else:
+        source = f'{str(mirror).rstrip("/")}/{package.file}' if mirror is not None else package.url
+        p = Popen(['wget', '-c', '-O', str(partial), source])
+        _ = p.communicate()
+        if p.returncode != 0:
+            raise ConnectionError(f"There was a problem downloading {source}. Check the above output.")
+
+    sha = _sha256(partial)
+    if expected is not None and sha != expected:
+        partial.unlink()
+        raise ConnectionError(f'The SHA-256 checksum of {source} is {sha}, but {expected} was expected. The download '
+                              f'was deleted, try again.')
+    os.replace(partial, download)
+    return sha
+
+
+def install(name: str,
+            mirror: Union[str, PathLike] = None,
+            force: bool = False,
+            allow_unpinned: bool = False) -> bool:
+    """
+    Download and install one tool, unless it is already installed from the same URL.
+
+    Downloads are verified against a SHA-256 checksum: the one pinned in PACKAGES, the one in the SHA256SUMS file of
+    the mirror or, failing those, the one recorded when the tool was installed before. If there is none of these (and
+    no checksums are pinned in PACKAGES yet), nothing is installed unless allow_unpinned is True. Interrupted
+    downloads are resumed.
+
+    :param name: A key of PACKAGES, e.g. 'Comet'.
+    :param mirror: Install from here instead of the internet: a directory (e.g. one written by make_mirror) or the
+        URL of one.
+    :param force: Install even if it is already installed.
+    :param allow_unpinned: Install a download there is no checksum for, trusting it as it is. Its checksum is recorded,
+        so later installs of the same URL (and mirrors made from this installation) are verified against it.
+    :return: True if the tool was installed, False if it already was.
+    """
+    package = PACKAGES[name]
+    target = config.default_tool_path(package.tool)
+    with _locked(package.file):
+        installed = installed_tools().get(name, {})
+        if not force and installed.get('url') == package.url and target.exists():
+            print(f'{name} is already installed, skipping')
+            return False
+        expected = _expected_sha256(package, mirror)
+        if expected is None and not allow_unpinned:
+            raise ValueError(f'There is no SHA-256 checksum to verify the {name} download ({package.file}) against: '
+                             f'none is pinned, it is not in the SHA256SUMS file of a mirror and it was not installed '
+                             f'before. Install from a mirror with a SHA256SUMS file, or pass allow_unpinned=True to '
+                             f'trust the download as it is.')
+        sha = _fetch(package, mirror, expected)
+        print(f'Installing {name}')
+        package.install(_downloads() / package.file, target)
+        _record_installation(package, sha)
+    invalidate(name)
+    return True
+
+
+def install_all(names: List[str],
+                mirror: Union[str, PathLike] = None,
+                force: bool = False,
+                max_parallel: int = 4,
+                allow_unpinned: bool = False) -> List[bool]:
+    """
+    Install several tools at once. See install.
+    """
+    return run_parallel(lambda name: install(name, mirror=mirror, force=force, allow_unpinned=allow_unpinned), names,
+                        max_parallel=max_parallel, description='installation')
+
+
+def make_mirror(directory: Union[str, PathLike]) -> Path:
+    """
+    Copy the downloads of everything installed here to a directory, with a SHA256SUMS file, so that other machines
+    (e.g. cluster nodes without internet access) can install from it with mirror=directory, or from a web server
+    serving it.
+    """
+    directory = Path(directory).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    sums = []
+    for name, installed in installed_tools().items():
+        download = _downloads() / installed['file']
+        if download.exists():
+            shutil.copyfile(download, directory / installed['file'])
+            sums.append(f'{installed["sha256"]}  {installed["file"]}')
+    (directory / 'SHA256SUMS').write_text(''.join(x + '\n' for x in sums))
+    return directory
+
+
+def download_search_engines(mirror: Union[str, PathLike] = None, force: bool = False, allow_unpinned: bool = False):
+    install_all(SEARCH_ENGINES, mirror=mirror, force=force, allow_unpinned=allow_unpinned)
+
+
+def download_thermorawfileparser(mirror: Union[str, PathLike] = None, force: bool = False,
+                                 allow_unpinned: bool = False):
+    install('ThermoRawFileParser', mirror=mirror, force=force, allow_unpinned=allow_unpinned)
+
+
+def get_tpp(mirror: Union[str, PathLike] = None, force: bool = False, allow_unpinned: bool = False):
+    install('TPP', mirror=mirror, force=force, allow_unpinned=allow_unpinned)
+
+
+def get_proteowizard(mirror: Union[str, PathLike] = None, force: bool = False, allow_unpinned: bool = False):
+    install('ProteoWizard', mirror=mirror, force=force, allow_unpinned=allow_unpinned)
+
+
+def download_all(mirror: Union[str, PathLike] = None, force: bool = False, max_parallel: int = 4,
+                 allow_unpinned: bool = False):
+    """
+    Install the search engines, ThermoRawFileParser and the TPP image, all at once. Anything already installed is
+    skipped, so this is quick to run again, e.g. at the start of every cluster job.
+
+    :param mirror: Install from this directory or URL instead of the internet (see make_mirror).
+    :param force: Install everything again.
+    :param max_parallel: Maximum number of simultaneous downloads.
+    :param allow_unpinned: Install downloads there is no checksum to verify against (see install).
+    """
+    install_all(SEARCH_ENGINES + ['ThermoRawFileParser', 'TPP'], mirror=mirror, force=force, max_parallel=max_parallel,
+                allow_unpinned=allow_unpinned)
 
     check_for_thermorawfileparser()
     check_for_msgfplus()
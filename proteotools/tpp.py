@@ -1,42 +1,80 @@
-from proteotools import TPP
+from proteotools import config
 from proteotools.software import check_for_singularity
+from proteotools.journal import Journal, run_step
+from proteotools.executors import run_on
+from concurrent.futures import Executor
+from proteotools import singularity
+from proteotools.parallel import run_parallel
 from typing import Union, List
 from subprocess import Popen, SubprocessError
+from proteotools.execute import run_command
 from os import PathLike
 from pathlib import Path
+import re
+
+# what InteractParser looks for next to a pepXML base_name
+SPECTRUM_EXTENSIONS = ['.mzML', '.mzML.gz', '.mzXML', '.mgf']
 
 
 def tool_help(tool: str):
     check_for_singularity()
 
-    singularity_command = ['singularity', 'exec', str(TPP), tool]
+    singularity_command = ['singularity', 'exec', str(config.tool_path('tpp')), tool]
 
     p = Popen(singularity_command)
     _ = p.communicate()
 
 
-def run_tool(tool: str, command: Union[str, List[str]], path_to_bind: Union[str, PathLike] = '~/'):
-    check_for_singularity()
-
+def _tool_command(tool: str, command: Union[str, List[str]], path_to_bind: Union[str, PathLike]) -> List[str]:
     if isinstance(command, str):
         command = command.split()
+    return [*singularity.exec_command(config.tool_path('tpp'), path_to_bind), tool, *command]
 
-    singularity_command = ['singularity', 'exec', '-B', str(path_to_bind), str(TPP), tool, *command]
 
-    p = Popen(singularity_command)
-    _ = p.communicate()
+def run_tool(tool: str,
+             command: Union[str, List[str]],
+             path_to_bind: Union[str, PathLike] = '~/',
+             inputs: List[Union[str, PathLike]] = (),
+             outputs: List[Union[str, PathLike]] = ()):
+    """
+    Run a TPP tool in the TPP container.
+
+    :param tool: The tool, e.g. 'PeptideProphetParser'.
+    :param command: Its arguments.
+    :param path_to_bind: Comma-separated directories the tool needs access to.
+    :param inputs: Files the tool reads, only used to record how much data it handled. See
+        proteotools.execute.
+    :param outputs: Files the tool writes.
+    """
+    check_for_singularity()
 
-    if p.returncode != 0:
+    singularity_command = _tool_command(tool, command, path_to_bind)
+
+    result = run_command(singularity_command, step=tool, inputs=inputs, outputs=outputs)
+
+    if result.returncode != 0:
         raise SubprocessError(f'There was an error running {tool}. See the above output.')
 
 
-def run_interactparser(pepxml_files: List[Union[str, PathLike]],
-                       fasta: Union[str, PathLike],
-                       enzyme: str = 'nonspecific',
-                       mzml_directory: Union[str, PathLike] = None,
-                       max_peptide_rank: int = 1
-                       ) -> List[Path]:
+def instance(binds: Union[str, PathLike, List[Union[str, PathLike]]]):
+    """
+    Start one TPP container and run all the TPP tools in it until the with block ends, instead of starting a new
+    container for every call:
 
+        with tpp.instance([pepxml_dir, fasta_dir]):
+            tpp.run_prophets(pepxml_files, fasta)
+
+    :param binds: Directories the tools will need. Calls needing anything else get their own container.
+    """
+    check_for_singularity()
+    return singularity.instance(config.tool_path('tpp'), binds)
+
+
+def _interactparser_bind(pepxml_files, fasta, mzml_directory):
+    """
+    The mzML directory InteractParser should use (if it wasn't given, the pepXML directory when all the mzML files
+    are there) and the directories to bind for it.
+    """
     if mzml_directory is None:
         if all([Path(x).with_suffix('.mzML').exists() for x in pepxml_files]):
             mzml_directory = Path(pepxml_files[0]).parent
@@ -48,33 +86,89 @@ def run_interactparser(pepxml_files: List[Union[str, PathLike]],
 
     if str(Path(fasta).parent) not in bind_point:
         bind_point += f',{Path(fasta).parent}'
+    return mzml_directory, bind_point
 
-    interact_output = []
-    for pepxml in pepxml_files:
+
+def _spectrum_files(pepxml, mzml_directory) -> List[Path]:
+    """
+    The spectrum files InteractParser reads for a pepXML file: the ones named after the base_name of each
+    msms_run_summary in it, in the mzML directory (or next to the base_name if there is none).
+    """
+    files = []
+    with open(pepxml) as f:
+        for line in f:
+            match = re.search(r'<msms_run_summary[^>]* base_name="([^"]*)"', line)
+            if match is None:
+                continue
+            base_name = Path(match.group(1))
+            directory = Path(mzml_directory) if mzml_directory else base_name.parent
+            files += [x for x in (directory / (base_name.name + y) for y in SPECTRUM_EXTENSIONS) if x.exists()]
+    return files
+
+
+def _interactparser_command(pepxml, fasta, enzyme, mzml_directory, max_peptide_rank):
+    pepxml = Path(pepxml)
+    output = pepxml.parent / f'interact-{pepxml.name}'
+    command = f'{output} {pepxml} ' \
+              f'{("-a" + str(mzml_directory) + " ") if mzml_directory else ""} ' \
+              f'-D{fasta} -E{enzyme} -C -S -R{max_peptide_rank}'
+    return command, output
+
+
+def run_interactparser(pepxml_files: List[Union[str, PathLike]],
+                       fasta: Union[str, PathLike],
+                       enzyme: str = 'nonspecific',
+                       mzml_directory: Union[str, PathLike] = None,
+                       max_peptide_rank: int = 1,
+                       use_cache: bool = False,
+                       max_parallel: int = 1,
+                       journal: Journal = None
+                       ) -> List[Path]:
+
+    mzml_directory, bind_point = _interactparser_bind(pepxml_files, fasta, mzml_directory)
+
+    def interact(pepxml):
         print(f'InteractParser: {pepxml}')
-        pepxml = Path(pepxml)
-        output = pepxml.parent / f'interact-{pepxml.name}'
-        run_tool('InteractParser',
-                 f'{output} {pepxml} '
-                 f'{("-a" + str(mzml_directory) + " ") if mzml_directory else ""} '
-                 f'-D{fasta} -E{enzyme} -C -S -R{max_peptide_rank}',
-                 path_to_bind=bind_point)
-        interact_output.append(output)
+        command, output = _interactparser_command(pepxml, fasta, enzyme, mzml_directory, max_peptide_rank)
+        run_step('InteractParser',
+                 inputs=[pepxml, *_spectrum_files(pepxml, mzml_directory), fasta, config.tool_path('tpp')],
+                 outputs=[output],
+                 arguments=[mzml_directory, enzyme, max_peptide_rank],
+                 run=lambda: run_tool('InteractParser', command, path_to_bind=bind_point),
+                 use_cache=use_cache, journal=journal)
+        return output
+
+    return run_parallel(interact, pepxml_files, max_parallel=max_parallel, description='InteractParser')
 
-    return interact_output
+
+def _peptideprophet_command(pepxml, decoy_tag, additional_args) -> str:
+    decoy = f' DECOY={decoy_tag}' if decoy_tag is not None else ''
+    return f'{pepxml} {" ".join(additional_args)}{decoy}'
 
 
 def run_peptideprophet(pepxml_files: List[Union[str, PathLike]],
                        decoy_tag: str = 'rev_',
-                       additional_args: List[str] = ('ZERO', 'NONPARAM', 'DECOYPROBS')):
-    for pepxml in pepxml_files:
+                       additional_args: List[str] = ('ZERO', 'NONPARAM', 'DECOYPROBS'),
+                       max_parallel: int = 1):
+    def prophet(pepxml):
         print(f'PeptideProphet: {pepxml}')
-        pepxml = Path(pepxml)
-        bind_point = pepxml.parent
-        decoy = f' DECOY={decoy_tag}' if decoy_tag is not None else None
         run_tool('PeptideProphetParser',
-                 f'{pepxml} {" ".join(additional_args)}{decoy}',
-                 path_to_bind=bind_point)
+                 _peptideprophet_command(pepxml, decoy_tag, additional_args),
+                 path_to_bind=Path(pepxml).parent)
+
+    run_parallel(prophet, pepxml_files, max_parallel=max_parallel, description='PeptideProphet')
+
+
+def _iprophet_command(pepxml_files, decoy_tag, threads, minprob, output_filename, additional_args):
+    bind_point = Path(pepxml_files[0]).parent
+    output_file = bind_point / output_filename
+    if additional_args is not None:
+        additional_args = ' ' + ' '.join(additional_args)
+    else:
+        additional_args = ''
+    command = f'THREADS={threads} DECOY={decoy_tag} MINPROB={minprob}{additional_args} ' \
+              f'{" ".join([str(x) for x in pepxml_files])} {output_file}'
+    return command, bind_point, output_file
 
 
 def run_iprophet(pepxml_files: List[Union[str, PathLike]],
@@ -82,7 +176,9 @@ def run_iprophet(pepxml_files: List[Union[str, PathLike]],
                  threads: int = 12,
                  minprob: float = 0,
                  output_filename: str = 'interact-iproph.pep.xml',
-                 additional_args: List[str] = None):
+                 additional_args: List[str] = None,
+                 use_cache: bool = False,
+                 journal: Journal = None):
     """
 
     :param pepxml_files: Should all be in the same directory.
@@ -91,18 +187,28 @@ def run_iprophet(pepxml_files: List[Union[str, PathLike]],
     :param minprob:
     :param output_filename:
     :param additional_args:
+    :param use_cache: Skip the run if iProphet was already run on the same files with the same settings.
+    :param journal: Skip the run if the journal says it was already done (see proteotools.journal).
     :return:
     """
-    bind_point = Path(pepxml_files[0]).parent
-    output_file = bind_point / output_filename
-    if additional_args is not None:
-        additional_args = ' ' + ' '.join(additional_args)
-    else:
-        additional_args = ''
-    run_tool('InterProphetParser',
-             f'THREADS={threads} DECOY={decoy_tag} MINPROB={minprob}{additional_args} '
-             f'{" ".join([str(x) for x in pepxml_files])} {output_file}',
-             path_to_bind=bind_point)
+    command, bind_point, output_file = _iprophet_command(pepxml_files, decoy_tag, threads, minprob, output_filename,
+                                                         additional_args)
+    run_step('InterProphetParser', inputs=[*pepxml_files, config.tool_path('tpp')], outputs=[output_file],
+             arguments=[decoy_tag, minprob, additional_args],
+             run=lambda: run_tool('InterProphetParser', command, path_to_bind=bind_point),
+             use_cache=use_cache, journal=journal)
+
+
+def _interact_and_prophet(pepxml, fasta, enzyme, mzml_directory, max_peptide_rank, decoy_tag, peptide_prophet_flags):
+    output = Path(pepxml).parent / f'interact-{Path(pepxml).name}'
+    run_interactparser(pepxml_files=[pepxml],
+                       fasta=fasta,
+                       enzyme=enzyme,
+                       mzml_directory=mzml_directory,
+                       max_peptide_rank=max_peptide_rank)
+    run_peptideprophet([output],
+                       decoy_tag=decoy_tag,
+                       additional_args=peptide_prophet_flags)
 
 
 def run_prophets(pepxml_files: List[Union[str, PathLike]],
@@ -116,28 +222,53 @@ def run_prophets(pepxml_files: List[Union[str, PathLike]],
                  iprophet_minprob: float = 0,
                  mzml_directory: Union[str, PathLike] = None,
                  skip_existing_interact_pepxmls: bool = True,
-                 max_peptide_rank: int = 1):
+                 max_peptide_rank: int = 1,
+                 use_cache: bool = False,
+                 journal: Journal = None,
+                 executor: Executor = None):
+    """
+    Run InteractParser and PeptideProphet on each pepXML file, then iProphet on all of them.
+
+    :param journal: Skip the steps the journal says were already done, so that a run which was killed picks up where
+        it left off (see proteotools.journal).
+    :param executor: A concurrent.futures.Executor to run InteractParser and PeptideProphet for each file on, e.g. one
+        from proteotools.executors to run them on other nodes. Every file is handed to it at once. iProphet still
+        runs here.
+    """
     if mzml_directory is None:
         mzml_directory = Path(pepxml_files[0]).parent
 
     if skip_existing_interact_pepxmls:
         pepxml_files = [x for x in pepxml_files if not Path(x).name.startswith('interact-')]
 
-    interact_files = run_interactparser(pepxml_files=pepxml_files,
-                                        fasta=fasta,
-                                        enzyme=enzyme,
-                                        mzml_directory=mzml_directory,
-                                        max_peptide_rank=max_peptide_rank
-                                        )
+    def interact_and_prophet(pepxml):
+        output = Path(pepxml).parent / f'interact-{Path(pepxml).name}'
 
-    run_peptideprophet(interact_files,
-                       decoy_tag=decoy_tag,
-                       additional_args=peptide_prophet_flags)
+        def run():
+            run_on(executor, _interact_and_prophet, pepxml, fasta, enzyme, mzml_directory, max_peptide_rank, decoy_tag,
+                   peptide_prophet_flags)
+
+        # PeptideProphet rewrites the InteractParser output in place, so the two are a single step
+        run_step('InteractParser+PeptideProphetParser',
+                 inputs=[pepxml, *_spectrum_files(pepxml, mzml_directory), fasta, config.tool_path('tpp')],
+                 outputs=[output],
+                 arguments=[mzml_directory, enzyme, max_peptide_rank, decoy_tag, *peptide_prophet_flags],
+                 run=run,
+                 use_cache=use_cache,
+                 journal=journal)
+        return output
+
+    # InteractParser and PeptideProphet are single threaded, so each file gets one of the threads, and then
+    # iProphet gets all of them
+    interact_files = run_parallel(interact_and_prophet, pepxml_files,
+                                  max_parallel=threads if executor is None else len(pepxml_files),
+                                  description='InteractParser/PeptideProphet')
 
     run_iprophet(interact_files,
                  decoy_tag=decoy_tag,
                  threads=threads,
                  minprob=iprophet_minprob,
                  additional_args=iprophet_flags,
-                 output_filename=iprophet_out_filename)
-
+                 output_filename=iprophet_out_filename,
+                 use_cache=use_cache,
+                 journal=journal)
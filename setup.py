@@ -13,5 +13,5 @@ setup(
                 'ThermoRawFileParser, run a few proteomics search engines (Comet, X! Tandem, MS-GF+), and use '
                 'compiled Trans-Proteomic Pipeline (TPP) binaries without needing to '
                 'compile the entire pipeline.',
-    install_requires=['pyteomics.pepxmltk']
+    install_requires=['pyteomics.pepxmltk', 'numpy']
 )
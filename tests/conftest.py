@@ -0,0 +1,92 @@
+from pathlib import Path
+import shutil
+import sys
+import pytest
+from proteotools import software
+
+DATA = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture(autouse=True)
+def tool_dir(tmp_path, monkeypatch):
+    """
+    Point proteotools at an empty tool directory (and no config file), so the tests never touch a real installation.
+    """
+    monkeypatch.setenv('PROTEOTOOLS_CONFIG', str(tmp_path / 'proteotools.ini'))
+    monkeypatch.setenv('PROTEOTOOLS_TOOL_DIR', str(tmp_path / 'tools'))
+    for name in ['cache_dir', 'database_dir']:
+        monkeypatch.delenv(f'PROTEOTOOLS_{name.upper()}', raising=False)
+    return tmp_path / 'tools'
+
+
+@pytest.fixture
+def data(tmp_path) -> Path:
+    """
+    A copy of tests/data, so tests can write next to the files.
+    """
+    return Path(shutil.copytree(DATA, tmp_path / 'data'))
+
+
+class Step:
+    """
+    A pipeline step that writes its input, upper-cased, to its output and counts how often it ran.
+    """
+    def __init__(self, directory: Path):
+        self.input = directory / 'input.txt'
+        self.output = directory / 'output.txt'
+        self.input.write_text('spectra')
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        self.output.write_text(self.input.read_text().upper())
+
+    def corrupt_output(self):
+        # as a tool killed halfway would leave it: a new, shorter file in place of the old one
+        self.output.unlink()
+        self.output.write_text('SPEC')
+
+
+@pytest.fixture
+def step(tmp_path) -> Step:
+    return Step(tmp_path)
+
+
+# what ThermoRawFileParser writes for -i raw -o directory -f format [-g] [-c metadata]
+FAKE_THERMORAWFILEPARSER = '''
+import sys
+from pathlib import Path
+args = sys.argv[2:]
+if sys.argv[-1] == '--version':
+    print('1.4.0')
+    sys.exit(0)
+raw, directory, format = Path(args[args.index('-i') + 1]), Path(args[args.index('-o') + 1]), args[args.index('-f') + 1]
+name = raw.stem + ['.mgf', '.mzML', '.mzML', '.parquet'][int(format)] + ('.gz' if '-g' in args else '')
+(directory / name).write_text(raw.read_text() + format)
+if '-c' in args:
+    Path(args[args.index('-c') + 1]).write_text(raw.name)
+'''
+
+
+@pytest.fixture
+def raw_files(tmp_path, monkeypatch):
+    """
+    Three raw files, and a stand-in for mono and ThermoRawFileParser that converts them.
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    mono = bin_dir / 'mono'
+    mono.write_text(f'#!{sys.executable}\n{FAKE_THERMORAWFILEPARSER}')
+    mono.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}:{Path(sys.executable).parent}')
+    monkeypatch.setenv('PROTEOTOOLS_THERMORAWFILEPARSER', str(tmp_path / 'ThermoRawFileParser.exe'))
+    (tmp_path / 'ThermoRawFileParser.exe').write_text('')
+    software.invalidate()
+
+    files = []
+    for name in ['sample1', 'sample2', 'sample3']:
+        files.append(tmp_path / 'raw' / f'{name}.raw')
+        files[-1].parent.mkdir(exist_ok=True)
+        files[-1].write_text(name)
+    yield files
+    software.invalidate()
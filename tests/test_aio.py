@@ -0,0 +1,86 @@
+from pathlib import Path
+from subprocess import SubprocessError
+import asyncio
+import time
+import sys
+import pytest
+from proteotools import aio, execute
+
+# what Comet writes for -D fasta -P params -N name mzml, failing for files with 'bad' in the name
+FAKE_COMET = '''
+import sys
+from pathlib import Path
+name, mzml = sys.argv[3][2:], sys.argv[4]
+if 'bad' in mzml:
+    sys.exit(1)
+Path(name + '.pep.xml').write_text(mzml)
+'''
+
+
+@pytest.fixture
+def records():
+    """
+    The Records of the tools run while the test runs.
+    """
+    seen = []
+    execute.add_hook(seen.append)
+    yield seen
+    execute.remove_hook(seen.append)
+
+
+def test_run_command(records):
+    record = asyncio.run(aio.run_command([sys.executable, '-c', 'exit(3)'], step='probe'))
+    assert record.returncode == 3
+    assert records == [record]
+
+
+def test_run_command_timeout():
+    start = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(aio.run_command(['sh', '-c', 'sleep 10 & sleep 10'], timeout=0.2))
+    assert time.time() - start < 5
+
+
+def test_run_command_semaphore():
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+        start = time.time()
+        await asyncio.gather(*(aio.run_command(['sleep', '0.3'], semaphore=semaphore) for _ in range(4)))
+        return time.time() - start
+
+    assert asyncio.run(run()) >= 0.6
+
+
+def test_gather():
+    async def check(x):
+        if x % 2:
+            raise ValueError(f'odd {x}')
+        await asyncio.sleep(0.01 * (4 - x))
+        return x
+
+    assert asyncio.run(aio.gather(check, [0, 2, 4], max_parallel=2)) == [0, 2, 4]
+    with pytest.raises(SubprocessError, match='2 of 4 check runs failed'):
+        asyncio.run(aio.gather(check, range(4), description='check'))
+
+
+def test_comet(tool_dir, tmp_path):
+    comet = tool_dir / 'comet' / 'comet.linux.exe'
+    comet.parent.mkdir(parents=True)
+    comet.write_text(f'#!{sys.executable}\n{FAKE_COMET}')
+    comet.chmod(0o755)
+    parameter_file = tmp_path / 'comet.params'
+    parameter_file.write_text('num_threads = 0\n')
+    mzml_files = [str(tmp_path / f'{name}.mzML') for name in ['a', 'b', 'bad']]
+
+    pepxml_files = asyncio.run(aio.comet(parameter_file, 'db.fasta', mzml_files[:2], max_parallel=2, threads=1))
+    assert pepxml_files == [str(tmp_path / 'a-comet.pepXML'), str(tmp_path / 'b-comet.pepXML')]
+    assert Path(pepxml_files[1]).read_text() == mzml_files[1]
+
+    with pytest.raises(SubprocessError, match='1 of 3 Comet runs failed'):
+        asyncio.run(aio.comet(parameter_file, 'db.fasta', mzml_files))
+
+
+def test_run_thermorawfileparser(raw_files):
+    outputs = asyncio.run(aio.run_thermorawfileparser(raw_files, format='mgf', max_parallel=2))
+    assert outputs == [str(x.with_suffix('.mgf')) for x in raw_files]
+    assert all(Path(x).exists() for x in outputs)
@@ -0,0 +1,87 @@
+from proteotools import cache
+import json
+
+
+def cached(step, arguments=()) -> bool:
+    return cache.cached('step', inputs=[step.input], outputs=[step.output], run=step, arguments=arguments)
+
+
+def test_file_hash(tmp_path, tool_dir):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    first = cache.file_hash(path)
+    assert first == cache.file_hash(path)
+    path.write_text('bb')
+    assert cache.file_hash(path) != first
+    # hashes are kept one file each, not in the manifest
+    assert len(list((tool_dir / 'cache' / 'hashes').iterdir())) == 1
+    assert not (tool_dir / 'cache' / 'manifest.json').exists()
+
+
+def test_file_hash_without_writing(tmp_path, tool_dir):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    first = cache.file_hash(path, write=False)
+    assert first == cache.file_hash(path, write=False)
+    path.write_text('bb')
+    assert cache.file_hash(path, write=False) != first
+    assert not (tool_dir / 'cache').exists()
+
+
+def test_cached(step):
+    assert cached(step) is False
+    assert cached(step) is True
+    assert step.runs == 1
+    assert step.output.read_text() == 'SPECTRA'
+
+    assert cached(step, arguments=['--other']) is False
+    assert step.runs == 2
+
+    step.input.write_text('peptides')
+    assert cached(step) is False
+    assert step.output.read_text() == 'PEPTIDES'
+    assert step.runs == 3
+
+
+def test_cached_restores_outputs(step):
+    cached(step)
+
+    step.output.unlink()
+    assert cached(step) is True
+    assert step.output.read_text() == 'SPECTRA'
+
+    step.corrupt_output()
+    assert cached(step) is True
+    assert step.output.read_text() == 'SPECTRA'
+    assert step.runs == 1
+
+
+def test_cached_reruns_when_the_stored_copy_is_bad(step, tool_dir):
+    cached(step)
+    for obj in (tool_dir / 'cache' / 'objects').iterdir():
+        obj.unlink()
+        obj.write_text('garbage')
+    step.corrupt_output()
+    assert cached(step) is False
+    assert step.output.read_text() == 'SPECTRA'
+    assert step.runs == 2
+
+
+def test_evict(step, tool_dir):
+    cached(step)
+    other = step.input.with_name('other.txt')
+    other.write_text('x')
+    cache.file_hash(other)
+    other.unlink()
+
+    cache.evict(max_size=0)
+    assert not list((tool_dir / 'cache' / 'objects').iterdir())
+    assert json.loads((tool_dir / 'cache' / 'manifest.json').read_text())['entries'] == {}
+    # only the hashes of files which still exist are kept
+    assert len(list((tool_dir / 'cache' / 'hashes').iterdir())) == 2
+
+    assert cached(step) is False
+    assert step.runs == 2
+
+    cache.clear()
+    assert not (tool_dir / 'cache' / 'hashes').exists()
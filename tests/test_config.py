@@ -0,0 +1,58 @@
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+import proteotools
+from proteotools import config
+
+
+def test_defaults(tool_dir):
+    assert config.tool_dir() == tool_dir
+    assert config.cache_dir() == tool_dir / 'cache'
+    assert config.database_dir() == tool_dir / 'databases'
+    assert config.tool_path('comet') == tool_dir / 'comet' / 'comet.linux.exe'
+    with pytest.raises(ValueError, match='Unknown tool'):
+        config.tool_path('mascot')
+
+
+def test_config_file_and_environment(tmp_path, tool_dir, monkeypatch):
+    monkeypatch.delenv('PROTEOTOOLS_TOOL_DIR')
+    monkeypatch.delenv('PROTEOTOOLS_COMET', raising=False)
+    config.config_file().write_text('[proteotools]\n'
+                                    f'tool_dir = {tmp_path}/shared\n'
+                                    'cache_dir = ~/cache\n'
+                                    'comet = comet/2023/comet.exe\n'
+                                    'tandem = /opt/tandem.exe\n')
+    assert config.tool_dir() == tmp_path / 'shared'
+    assert config.cache_dir() == Path('~/cache').expanduser()
+    assert config.tool_path('comet') == tmp_path / 'shared' / 'comet' / '2023' / 'comet.exe'
+    assert config.tool_path('tandem') == Path('/opt/tandem.exe')
+    assert config.default_tool_path('tandem') == tmp_path / 'shared' / config.TOOLS['tandem']
+
+    # the environment comes first
+    monkeypatch.setenv('PROTEOTOOLS_COMET', '/usr/local/bin/comet')
+    assert config.tool_path('comet') == Path('/usr/local/bin/comet')
+
+    # and changes to the file are seen right away
+    config.config_file().write_text('[proteotools]\ntool_dir = /elsewhere\n')
+    assert config.tool_dir() == Path('/elsewhere')
+    assert config.tool_path('tandem') == Path('/elsewhere') / config.TOOLS['tandem']
+
+
+def test_paths_on_the_package(tool_dir, monkeypatch):
+    assert proteotools.TOOL_DIR == tool_dir
+    assert proteotools.TPP == tool_dir / config.TOOLS['tpp']
+    monkeypatch.setenv('PROTEOTOOLS_TPP', '/images/tpp.sif')
+    assert proteotools.TPP == Path('/images/tpp.sif')
+    assert proteotools.pepxml.read_pepxml
+    assert {'TOOL_DIR', 'COMET', 'search'} <= set(dir(proteotools))
+    with pytest.raises(AttributeError):
+        proteotools.MASCOT
+
+
+def test_import_is_lazy():
+    code = ('import sys, proteotools; '
+            'print(sorted(x for x in sys.modules if x == "numpy" or x.startswith("proteotools.")))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=Path(__file__).parent.parent)
+    assert out.stdout.strip() == '[]'
@@ -0,0 +1,34 @@
+from pathlib import Path
+import pytest
+from proteotools import convert
+from proteotools.journal import Journal
+
+
+@pytest.mark.parametrize('format, gzip_output, extension', [('indexed_mzml', False, '.mzML'),
+                                                             ('mzml', True, '.mzML.gz'),
+                                                             ('mgf', False, '.mgf'),
+                                                             ('parquet', False, '.parquet')])
+def test_output_names(raw_files, tmp_path, format, gzip_output, extension):
+    outputs = convert.run_thermorawfileparser(raw_files, format=format, gzip_output=gzip_output, use_cache=True,
+                                              journal=Journal(tmp_path / 'study.journal'), max_parallel=3)
+    assert outputs == [str(x.with_suffix(extension)) for x in raw_files]
+    assert all(Path(x).exists() for x in outputs)
+
+
+def test_directory_and_output_directory(raw_files, tmp_path):
+    outputs = convert.run_thermorawfileparser(raw_files[0].parent, output_directory=tmp_path)
+    assert outputs == [str(tmp_path / f'{x.stem}.mzML') for x in raw_files]
+
+
+def test_metadata_file_per_raw_file(raw_files, tmp_path):
+    convert.run_thermorawfileparser(raw_files, metadata_output_file=tmp_path / 'metadata.json', max_parallel=3)
+    assert [(tmp_path / f'metadata-{x.stem}.json').read_text() for x in raw_files] == [x.name for x in raw_files]
+
+    convert.run_thermorawfileparser(raw_files[:1], metadata_output_file=tmp_path / 'one.json', clobber=True)
+    assert (tmp_path / 'one.json').read_text() == 'sample1.raw'
+
+
+def test_iter_thermorawfileparser(raw_files):
+    outputs = convert.iter_thermorawfileparser(raw_files, max_parallel=2)
+    assert not isinstance(outputs, list)
+    assert sorted(outputs) == [str(x.with_suffix('.mzML')) for x in raw_files]
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import pytest
+from proteotools import database
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """
+    Replace BuildSA with something that takes 0.3 s and writes empty index files, and record what it builds.
+    """
+    built = []
+
+    def build(fasta, memory):
+        built.append(fasta.name)
+        time.sleep(0.3)
+        for suffix in database.MSGF_INDEX_SUFFIXES:
+            fasta.with_suffix(suffix).write_text('')
+
+    monkeypatch.setattr(database, '_msgfplus_index', build)
+    return built
+
+
+def test_build_msgfplus_index_once(tmp_path, builds):
+    fasta = tmp_path / 'db.fasta'
+    fasta.write_text('>sp|P1\nPEPTIDEK\n')
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: database.build_msgfplus_index(fasta), range(4)))
+    assert builds == ['db.fasta']
+    assert all(fasta.with_suffix(x).exists() for x in database.MSGF_INDEX_SUFFIXES)
+
+    # rebuilt when the FASTA file is newer than its index
+    time.sleep(0.01)
+    fasta.write_text('>sp|P2\nSAMPLER\n')
+    database.build_msgfplus_index(fasta)
+    assert builds == ['db.fasta', 'db.fasta']
+
+
+def test_build_msgfplus_index_in_parallel(tmp_path, builds):
+    shards = []
+    for i in range(4):
+        shards.append(tmp_path / f'shard{i}.fasta')
+        shards[-1].write_text(f'>sp|P{i}\nPEPTIDEK\n')
+    start = time.time()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(database.build_msgfplus_index, shards))
+    # different files don't wait for each other
+    assert time.time() - start < 0.9
+    assert sorted(builds) == [x.name for x in shards]
+
+
+def test_prepare_database(tmp_path, tool_dir, monkeypatch):
+    monkeypatch.setenv('PROTEOTOOLS_DATABASE_DIR', str(tmp_path / 'databases'))
+    fasta = tmp_path / 'db.fasta'
+    fasta.write_text('>sp|P1\nPEPTIDEK\n>sp|P2\nSAMPLER\n')
+    target_decoy = database.prepare_database(fasta, msgfplus_index=False)
+    assert target_decoy.startswith(str(tmp_path / 'databases'))
+    assert database.prepare_database(fasta, msgfplus_index=False) == target_decoy
+    text = open(target_decoy).read()
+    assert text.count('>sp|') == 2 and text.count('>rev_sp|') == 2
+    # no cache was asked for, so nothing is written there
+    assert not (tool_dir / 'cache').exists()
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import SubprocessError
+import operator
+import pytest
+from proteotools import execute
+from proteotools.executors import run_on, LocalExecutor, CommandExecutor, WorkQueueExecutor
+
+
+@pytest.fixture
+def records():
+    """
+    The Records of the tools run while the test runs, as the hooks in this process see them.
+    """
+    seen = []
+    execute.add_hook(seen.append)
+    yield seen
+    execute.remove_hook(seen.append)
+
+
+@pytest.mark.parametrize('make_executor', [lambda tmp_path: None,
+                                           lambda tmp_path: ThreadPoolExecutor(2),
+                                           lambda tmp_path: LocalExecutor(2),
+                                           lambda tmp_path: CommandExecutor('{command}', work_directory=tmp_path),
+                                           lambda tmp_path: WorkQueueExecutor(local_workers=2)],
+                         ids=['none', 'threads', 'local', 'command', 'work_queue'])
+def test_run_on(tmp_path, records, make_executor):
+    executor = make_executor(tmp_path)
+    try:
+        assert run_on(executor, operator.mul, 6, 7) == 42
+        with pytest.raises(ValueError):
+            run_on(executor, int, 'seven')
+
+        # the tool's measurements reach the hooks here exactly once, wherever it ran
+        record = run_on(executor, execute.run_command, ['true'], 'probe')
+        assert record.returncode == 0
+        assert [x.step for x in records] == ['probe']
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def test_command_executor_failed_job(tmp_path):
+    executor = CommandExecutor('exit 3', work_directory=tmp_path / 'jobs')
+    with pytest.raises(SubprocessError, match='exit status 3'):
+        run_on(executor, operator.mul, 6, 7)
+    executor.shutdown()
+    # the task and result files are removed, and the job wrote no log
+    assert list((tmp_path / 'jobs').iterdir()) == []
+
+
+def test_command_executor_work_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYTHONPATH', str(Path(__file__).resolve().parent.parent))  # the job runs somewhere else
+    monkeypatch.chdir(tmp_path)
+    executor = CommandExecutor('{command} > {log} 2>&1')
+    assert executor.work_directory.parent == tmp_path
+    assert run_on(executor, operator.mul, 6, 7) == 42
+    executor.shutdown()
+    assert not executor.work_directory.exists()
+
+
+def test_work_queue_cancels_waiting_tasks():
+    executor = WorkQueueExecutor()  # no workers, so nothing ever runs
+    future = executor.submit(operator.mul, 6, 7)
+    executor.shutdown(cancel_futures=True)
+    assert future.cancelled()
+    with pytest.raises(RuntimeError):
+        executor.submit(operator.mul, 6, 7)
@@ -0,0 +1,82 @@
+import numpy as np
+from proteotools.fdr import qvalues, is_decoy, best_per_group, filter_psms
+
+
+def test_qvalues():
+    scores = [10, 9, 8, 7, 6]
+    decoy = [False, False, True, False, True]
+    # FDR at each threshold: 0/1, 0/2, 1/2, 1/3, 2/3; q is the lowest FDR at that threshold or below it
+    assert np.allclose(qvalues(scores, decoy), [0, 0, 1 / 3, 1 / 3, 2 / 3])
+
+
+def test_qvalues_keep_input_order():
+    scores = [6, 10, 7, 9, 8]
+    decoy = [True, False, False, False, True]
+    assert np.allclose(qvalues(scores, decoy), [2 / 3, 0, 1 / 3, 0, 1 / 3])
+
+
+def test_qvalues_lower_is_better():
+    expect = [1e-5, 1e-4, 1e-3, 1e-2]
+    decoy = [False, True, False, False]
+    assert np.allclose(qvalues(expect, decoy, higher_is_better=False), [0, 1 / 3, 1 / 3, 1 / 3])
+
+
+def test_qvalues_ties():
+    # the decoy tied with a target must not let that target in at a lower q-value than the decoy
+    scores = [10, 9, 9, 8]
+    decoy = [False, True, False, False]
+    q = qvalues(scores, decoy)
+    assert q[1] == q[2]
+    assert np.allclose(q, [0, 1 / 3, 1 / 3, 1 / 3])
+
+    # every item tied
+    assert np.allclose(qvalues([5, 5, 5], [True, False, False]), [0.5, 0.5, 0.5])
+
+
+def test_qvalues_nan():
+    q = qvalues([10, np.nan, 9, 8], [False, False, True, False])
+    assert q[1] == 1
+    assert np.allclose(q[[0, 2, 3]], [0, 0.5, 0.5])
+    assert np.all(qvalues([np.nan, np.nan], [False, True]) == 1)
+
+
+def test_qvalues_empty_and_decoys_only():
+    assert len(qvalues([], [])) == 0
+    assert np.all(qvalues([3, 2, 1], [True, True, True]) == 1)
+
+
+def test_is_decoy():
+    proteins = ['sp|P1', 'rev_sp|P2', 'rev_sp|P3', 'sp|P4']
+    assert list(is_decoy(proteins)) == [False, True, True, False]
+    assert list(is_decoy(proteins, decoy_tag='DECOY_')) == [False, False, False, False]
+
+
+def test_is_decoy_shared_peptides():
+    proteins = ['rev_sp|P1', 'rev_sp|P2', 'sp|P3', 'rev_sp|P4']
+    alternative_proteins = ['rev_sp|P5;rev_sp|P6',  # only decoy proteins: a decoy
+                            'rev_sp|P7;sp|P8',  # also in a target protein: not a decoy
+                            'rev_sp|P9',  # a target protein first
+                            '']
+    assert list(is_decoy(proteins, alternative_proteins=alternative_proteins)) == [True, False, False, True]
+
+
+def test_best_per_group():
+    keys = np.array(['A', 'B', 'A', 'B', 'C'])
+    scores = np.array([1.0, 5.0, 3.0, np.nan, 2.0])
+    best = best_per_group(keys, scores)
+    assert sorted(best.tolist()) == [1, 2, 4]
+    assert sorted(best_per_group(keys, scores, higher_is_better=False).tolist()) == [0, 1, 4]
+
+
+def test_filter_psms_peptide_level():
+    table = {'modified_peptide': np.array(['PEPK', 'PEPK', 'SAMR', 'DECR', 'OTHK'], dtype=object),
+             'protein': np.array(['sp|P1', 'sp|P1', 'sp|P2', 'rev_sp|P3', 'sp|P4'], dtype=object),
+             'score': np.array([0.99, 0.5, 0.98, 0.97, 0.1])}
+    result = filter_psms(table, fdr=0.5, level='peptide', score='score')
+    # PEPK is represented by its best PSM; OTHK is below the decoy, at FDR 1/3
+    assert list(result['modified_peptide']) == ['PEPK', 'SAMR', 'OTHK']
+    assert np.allclose(result['score'], [0.99, 0.98, 0.1])
+    assert not result['decoy'].any()
+
+    result = filter_psms(table, fdr=0.2, level='peptide', score='score', keep_decoys=True)
+    assert list(result['modified_peptide']) == ['PEPK', 'SAMR']
@@ -0,0 +1,58 @@
+from proteotools.journal import Journal, run_step
+import os
+
+
+def test_journal(step, tmp_path):
+    path = tmp_path / 'study.journal'
+    assert Journal(path).run('step', [step.input], [step.output], step) is False
+    assert Journal(path).run('step', [step.input], [step.output], step) is True
+    assert step.runs == 1
+
+    # a different argument, or a changed input, is a different step
+    assert Journal(path).run('step', [step.input], [step.output], step, arguments=['--other']) is False
+    step.input.write_text('peptides')
+    assert Journal(path).run('step', [step.input], [step.output], step) is False
+    assert step.runs == 3
+
+
+def test_journal_reruns_after_a_corrupted_output(step, tmp_path):
+    journal = Journal(tmp_path / 'study.journal')
+    journal.run('step', [step.input], [step.output], step)
+
+    step.corrupt_output()
+    assert journal.run('step', [step.input], [step.output], step) is False
+    assert step.output.read_text() == 'SPECTRA'
+
+    step.output.unlink()
+    assert Journal(tmp_path / 'study.journal').run('step', [step.input], [step.output], step) is False
+    assert step.runs == 3
+
+
+def test_journal_ignores_a_half_written_line(step, tmp_path):
+    path = tmp_path / 'study.journal'
+    Journal(path).run('step', [step.input], [step.output], step)
+    with open(path, 'a') as f:
+        f.write('{"key": "abc", "st')
+    assert Journal(path).run('step', [step.input], [step.output], step) is True
+
+
+def test_journal_writes_nothing_else(step, tmp_path, tool_dir):
+    tool_dir.mkdir()
+    os.chmod(tool_dir, 0o555)
+    try:
+        run_step('step', [step.input], [step.output], step, journal=Journal(tmp_path / 'study.journal'))
+        run_step('step', [step.input], [step.output], step, journal=Journal(tmp_path / 'study.journal'))
+    finally:
+        os.chmod(tool_dir, 0o755)
+    assert step.runs == 1
+    assert not list(tool_dir.iterdir())
+
+
+def test_run_step_with_cache_and_journal(step, tmp_path):
+    journal = Journal(tmp_path / 'study.journal')
+    run_step('step', [step.input], [step.output], step, use_cache=True, journal=journal)
+    step.output.unlink()
+    # the journal sees the output is gone, and the cache puts it back without running the step
+    run_step('step', [step.input], [step.output], step, use_cache=True, journal=journal)
+    assert step.output.read_text() == 'SPECTRA'
+    assert step.runs == 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from proteotools.mzid import mzid_to_pepxml, PROTON
+from proteotools.pepxml import read_pepxml
+
+
+def test_mzid_to_pepxml(data):
+    pepxml = mzid_to_pepxml(data / 'small.mzid')
+    assert pepxml == str(data / 'small.pepXML')
+    table = read_pepxml(pepxml)
+
+    # one spectrum_query for each spectrum and charge
+    assert list(table['spectrum']) == ['small.00102.00102.2', 'small.00102.00102.3', 'small.00104.00104.2',
+                                       'small.00104.00104.2']
+    assert list(table['start_scan']) == [102, 102, 104, 104]
+    assert list(table['assumed_charge']) == [2, 3, 2, 2]
+    assert list(table['hit_rank']) == [1, 1, 1, 2]
+    assert list(table['base_name']) == ['/data/small'] * 4
+
+    assert list(table['peptide']) == ['PEPTMIDEK', 'SAMPLER', 'SAMPLER', 'PEPTMIDEK']
+    assert list(table['modified_peptide']) == ['PEPTM[147]IDEK', 'SAMPLER', 'SAMPLER', 'PEPTM[147]IDEK']
+    assert list(table['prev_aa']) == ['K', 'K', 'K', 'K']
+    assert list(table['next_aa']) == ['A', 'G', 'G', 'A']
+
+    # a peptide in a target and a decoy protein: the decoy is an alternative protein, not a second hit
+    assert list(table['protein']) == ['sp|P1', 'sp|P2', 'sp|P2', 'sp|P1']
+    assert list(table['alternative_proteins']) == ['rev_sp|P1', '', '', '']
+    assert list(table['num_tot_proteins']) == [2, 1, 1, 1]
+
+    assert np.allclose(table['MS-GF:SpecEValue'], [1.5e-12, 3e-5, 0.2, 0.9])
+    assert table['MS-GF:RawScore'][0] == 120
+    assert np.isnan(table['MS-GF:RawScore'][1])
+
+    assert table['precursor_neutral_mass'][0] == pytest.approx(532.7634 * 2 - 2 * PROTON, abs=1e-5)
+    assert table['massdiff'][0] == pytest.approx((532.7634 - 532.7620) * 2, abs=1e-5)
+    assert table['retention_time_sec'][0] == pytest.approx(61.2)  # in minutes in the mzid
+    assert np.isnan(table['retention_time_sec'][2])
+
+
+def test_mzid_to_pepxml_header(data, tmp_path):
+    pepxml = mzid_to_pepxml(data / 'small.mzid', tmp_path / 'out.pepXML')
+    text = (tmp_path / 'out.pepXML').read_text()
+    assert pepxml == str(tmp_path / 'out.pepXML')
+    assert 'search_engine="MS-GF+"' in text
+    assert '<search_database local_path="/data/db.fasta"' in text
+    assert '<sample_enzyme name="trypsin">' in text
+    assert '<aminoacid_modification aminoacid="M" massdiff="15.9949" mass="147.0354" variable="Y"/>' in text
+    assert not list(tmp_path.glob('.*.tmp*'))
+
+
+def test_mzid_to_pepxml_without_results(data, tmp_path):
+    mzid = tmp_path / 'empty.mzid'
+    text = (data / 'small.mzid').read_text()
+    start, end = text.index('<SpectrumIdentificationResult '), text.rindex('</SpectrumIdentificationResult>')
+    mzid.write_text(text[:start] + text[end + len('</SpectrumIdentificationResult>'):])
+    table = read_pepxml(mzid_to_pepxml(mzid))
+    assert len(table['peptide']) == 0
+    assert (tmp_path / 'empty.pepXML').read_text().rstrip().endswith('</msms_pipeline_analysis>')
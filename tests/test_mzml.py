@@ -0,0 +1,100 @@
+from xml.etree import ElementTree
+from pathlib import Path
+import re
+import numpy as np
+import pytest
+from proteotools.mzml import read_index, split_mzml, remove_chunks, IndexedMzML
+
+SCANS = [101, 102, 103, 104, 105]
+
+
+def scans_in(mzml) -> list:
+    root = ElementTree.parse(mzml).getroot()
+    return [int(re.search(r'scan=(\d+)', x.get('id')).group(1)) for x in root.iter() if x.tag.endswith('}spectrum')]
+
+
+def test_read_index(data):
+    ids, offsets = read_index(data / 'small.mzML')
+    assert ids == [f'controllerType=0 controllerNumber=1 scan={x}' for x in SCANS]
+    content = (data / 'small.mzML').read_bytes()
+    assert all(content[x:x + len(b'<spectrum ')] == b'<spectrum ' for x in offsets)
+
+
+def test_split_mzml_keeps_scan_numbers(data):
+    chunks = split_mzml(data / 'small.mzML', 2)
+    assert len(chunks) == 2
+    assert [Path(x).name for x in chunks] == ['small.chunk1of2.mzML', 'small.chunk2of2.mzML']
+    assert [scans_in(x) for x in chunks] == [[101, 102], [103, 104, 105]]
+
+    for chunk, n in zip(chunks, [2, 3]):
+        root = ElementTree.parse(chunk).getroot()
+        assert root.tag.endswith('}mzML')  # plain mzML, without the index
+        spectrum_list = next(x for x in root.iter() if x.tag.endswith('}spectrumList'))
+        assert spectrum_list.get('count') == str(n)
+
+    remove_chunks(chunks)
+    assert not Path(chunks[0]).parent.exists()
+    assert (data / 'small.mzML').exists()
+
+
+def test_split_mzml_more_chunks_than_spectra(data):
+    chunks = split_mzml(data / 'small.mzML', 10)
+    assert [scans_in(x) for x in chunks] == [[x] for x in SCANS]
+    remove_chunks(chunks)
+
+
+def test_split_mzml_calls_do_not_share_chunks(data):
+    first = split_mzml(data / 'small.mzML', 2)
+    second = split_mzml(data / 'small.mzML', 2)
+    assert Path(first[0]).parent != Path(second[0]).parent
+    remove_chunks(first)
+    assert all(Path(x).exists() for x in second)
+    remove_chunks(second)
+
+
+def test_split_mzml_output_directory(data, tmp_path):
+    chunks = split_mzml(data / 'small.mzML', 3, output_directory=tmp_path / 'chunks')
+    assert all(Path(x).parent == tmp_path / 'chunks' for x in chunks)
+    assert sum(len(scans_in(x)) for x in chunks) == len(SCANS)
+
+
+def test_indexed_mzml(data):
+    with IndexedMzML(data / 'small.mzML') as mzml:
+        assert len(mzml) == 5
+
+        spectrum = mzml.scan(104)
+        assert spectrum.index == 3
+        assert spectrum.ms_level == 2
+        assert spectrum.charge == 2
+        assert spectrum.precursor_mz == pytest.approx(604.25)
+        assert spectrum.retention_time == pytest.approx(1.04 * 60)  # stored in minutes
+        assert np.allclose(spectrum.mz, [204, 304.5, 404.25])  # without compression
+        assert spectrum.mz.dtype == np.float64
+        assert np.allclose(spectrum.intensity, [1040, 20, 30.5])
+        assert spectrum.intensity.dtype == np.float32
+
+        spectrum = mzml.get('controllerType=0 controllerNumber=1 scan=103')
+        assert np.allclose(spectrum.mz, [203, 303.5, 403.25])  # zlib
+
+        ms1 = mzml[0]
+        assert ms1.scan == 101
+        assert ms1.ms_level == 1
+        assert np.isnan(ms1.precursor_mz)
+        assert ms1.charge == 0
+        assert mzml[-1].scan == 105
+
+        with pytest.raises(KeyError):
+            mzml.scan(1)
+
+
+def test_indexed_mzml_batches(data):
+    with IndexedMzML(data / 'small.mzML') as mzml:
+        batches = list(mzml.batches(2))
+        assert [len(x.ids) for x in batches] == [2, 2, 1]
+        assert [scan for x in batches for scan in x.scans] == SCANS
+        mz, intensity = batches[1].peaks(1)
+        assert np.allclose(mz, mzml.scan(104).mz)
+        assert np.allclose(intensity, mzml.scan(104).intensity)
+
+        sample = list(mzml.batches(10, indices=[4, 0]))
+        assert list(sample[0].scans) == [105, 101]
@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import SubprocessError
+import threading
+import time
+import pytest
+from proteotools import parallel
+
+
+def test_run_parallel_keeps_order_and_bound():
+    running, most = [], []
+    lock = threading.Lock()
+
+    def square(x):
+        with lock:
+            running.append(x)
+            most.append(len(running))
+        time.sleep(0.05 * (4 - x))  # the first items finish last
+        with lock:
+            running.remove(x)
+        return x * x
+
+    assert parallel.run_parallel(square, range(4), max_parallel=2) == [0, 1, 4, 9]
+    assert max(most) == 2
+
+
+def test_run_parallel_reports_every_failure():
+    def check(x):
+        if x % 2:
+            raise ValueError(f'odd {x}')
+        return x
+
+    with pytest.raises(SubprocessError) as e:
+        parallel.run_parallel(check, range(5), max_parallel=3, description='check')
+    assert str(e.value) == '2 of 5 check runs failed:\n  1: odd 1\n  3: odd 3'
+
+
+def test_run_parallel_starts_before_the_last_item():
+    started = threading.Event()
+
+    def items():
+        yield 'a'
+        assert started.wait(5)
+        yield 'b'
+
+    def run(x):
+        started.set()
+        return x
+
+    with ThreadPoolExecutor(2) as executor:
+        assert parallel.run_parallel(run, items(), executor=executor) == ['a', 'b']
+
+
+def test_memory_to_mb():
+    assert [parallel.memory_to_mb(x) for x in ['6000M', '8g', '512K', '1T', 2 * 1024 ** 3]] == \
+        [6000, 8192, 0, 1024 * 1024, 2048]
+
+
+def test_budget(monkeypatch):
+    monkeypatch.setattr(parallel, 'available_cores', lambda: 16)
+    monkeypatch.setattr(parallel, 'available_memory_mb', lambda: 20000)
+    assert parallel.budget(4) == (4, 4)
+    assert parallel.budget(4, threads=2) == (4, 2)
+    assert parallel.budget(0) == (1, 16)
+    # only three 6000M heaps fit, and the cores are split between those
+    assert parallel.budget(8, memory='6000M') == (3, 5)
+    assert parallel.budget(8, memory='40G') == (1, 16)
+
+
+def test_fan_out():
+    def items():
+        yield from range(3)
+        raise ValueError('no more')
+
+    iterators = parallel.fan_out(items(), 3)
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(lambda x: [*x], iterator) for iterator in iterators[:2]]
+        assert [str(x.exception()) for x in futures] == ['no more', 'no more']
+    assert next(iterators[2]) == 0
+
+    assert [list(x) for x in parallel.fan_out(['a.mzML', 'b.mzML'], 2)] == [['a.mzML', 'b.mzML']] * 2
+
+
+def test_run_graph():
+    started = {}
+
+    def task(name, seconds):
+        def run():
+            started[name] = time.time()
+            time.sleep(seconds)
+            return name
+        return run
+
+    start = time.time()
+    results = parallel.run_graph({'msconvert': (task('msconvert', 0.1), []),
+                                  'Comet': (task('Comet', 0.3), []),
+                                  'X! Tandem': (task('X! Tandem', 0.1), ['msconvert'])})
+    assert results == {'msconvert': 'msconvert', 'Comet': 'Comet', 'X! Tandem': 'X! Tandem'}
+    # X! Tandem started when msconvert was done, not when Comet was
+    assert started['X! Tandem'] - start < 0.25
+    assert time.time() - start < 0.5
+
+
+def test_run_graph_skips_dependants_of_a_failure():
+    ran = []
+
+    def fail():
+        raise ValueError('no spectra')
+
+    with pytest.raises(SubprocessError) as e:
+        parallel.run_graph({'msconvert': (fail, []),
+                            'X! Tandem': (lambda: ran.append('X! Tandem'), ['msconvert']),
+                            'Comet': (lambda: ran.append('Comet'), [])})
+    assert ran == ['Comet']
+    assert 'msconvert: no spectra' in str(e.value)
+    assert 'X! Tandem: skipped' in str(e.value)
+
+
+def test_run_graph_checks_dependencies():
+    with pytest.raises(ValueError, match='unknown'):
+        parallel.run_graph({'a': (lambda: 1, ['b'])})
+    with pytest.raises(ValueError, match='Circular'):
+        parallel.run_graph({'a': (lambda: 1, ['b']), 'b': (lambda: 2, ['a'])})
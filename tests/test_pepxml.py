@@ -0,0 +1,66 @@
+import re
+import numpy as np
+import pytest
+from proteotools.pepxml import read_pepxml, iter_pepxml, merge_pepxml, _header_and_footer
+
+
+def test_read_pepxml(data):
+    table = read_pepxml(data / 'shard1.pepXML')
+    assert list(table['peptide']) == ['PEPTIDEK', 'PEPTIDR', 'SAMPLER', 'ONLYONEK']
+    assert list(table['start_scan']) == [102, 102, 103, 105]
+    assert list(table['hit_rank']) == [1, 2, 1, 1]
+    assert list(table['base_name']) == ['/data/small'] * 4
+    assert np.allclose(table['expect'], [0.001, 0.5, 2.0, 0.01])
+    assert np.isnan(table['iprophet_probability']).all()
+
+    assert len(read_pepxml(data / 'shard1.pepXML', max_rank=1)['peptide']) == 3
+    assert len(read_pepxml([data / 'shard1.pepXML', data / 'shard2.pepXML'])['peptide']) == 8
+    assert [len(x['peptide']) for x in iter_pepxml(data / 'shard1.pepXML', chunk_size=2)] == [2, 2]
+
+
+def test_merge_pepxml_keeps_best_hit(data, tmp_path):
+    merged = merge_pepxml([data / 'shard1.pepXML', data / 'shard2.pepXML'], tmp_path / 'merged.pepXML')
+    table = read_pepxml(merged)
+    # scan 102 comes from shard 1 and 103 from shard 2, each with its rank 2 hit; 104 and 105 are in only one shard
+    assert list(table['start_scan']) == [102, 102, 103, 103, 104, 105]
+    assert list(table['peptide']) == ['PEPTIDEK', 'PEPTIDR', 'BETTERK', 'WORSEK', 'NEWK', 'ONLYONEK']
+    assert list(table['hit_rank']) == [1, 2, 1, 2, 1, 1]
+
+    text = (tmp_path / 'merged.pepXML').read_text()
+    assert [int(x) for x in re.findall(r' index="(\d+)"', text)] == [1, 2, 3, 4]
+    assert 'OTHERK' not in text and 'SAMPLER' not in text  # the spectrum_queries that lost
+    assert text.rstrip().endswith('</msms_pipeline_analysis>')
+
+
+def test_merge_pepxml_higher_is_better(data, tmp_path):
+    merged = merge_pepxml([data / 'shard1.pepXML', data / 'shard2.pepXML'], tmp_path / 'merged.pepXML',
+                          score='xcorr', higher_is_better=True)
+    table = read_pepxml(merged, max_rank=1)
+    assert list(table['peptide']) == ['PEPTIDEK', 'BETTERK', 'NEWK', 'ONLYONEK']
+
+
+def test_merge_pepxml_replace(data, tmp_path):
+    merged = merge_pepxml([data / 'shard1.pepXML', data / 'shard2.pepXML'], tmp_path / 'merged.pepXML',
+                          replace={'/data/small': '/study/run1'})
+    assert set(read_pepxml(merged)['base_name']) == {'/study/run1'}
+
+
+@pytest.mark.parametrize('padding', range(4))
+def test_header_and_footer_with_multibyte_characters(tmp_path, padding):
+    pepxml = tmp_path / 'accents.pepXML'
+    # the padding after the 2 byte characters moves the start of the last 64 KB to each byte of one of them
+    query = '<spectrum_query spectrum="é">' + 'é' * 40000 + '</spectrum_query>\n' + ' ' * padding
+    pepxml.write_text('<msms_pipeline_analysis>\n<msms_run_summary base_name="é">\n' + query +
+                      '</msms_run_summary>\n</msms_pipeline_analysis>\n', encoding='utf-8')
+    header, footer = _header_and_footer(pepxml)
+    assert header.endswith('<msms_run_summary base_name="é">\n')
+    assert footer == '</msms_run_summary>\n</msms_pipeline_analysis>\n'
+
+
+def test_merge_pepxml_base_name_and_database(data, tmp_path):
+    merged = merge_pepxml([data / 'shard1.pepXML', data / 'shard2.pepXML'], tmp_path / 'merged.pepXML',
+                          base_name='/study/"run1"', database='/study/db.fasta')
+    assert set(read_pepxml(merged)['base_name']) == {'/study/"run1"'}
+    text = (tmp_path / 'merged.pepXML').read_text()
+    assert text.count('base_name=\'/study/"run1"\'') == 2  # msms_run_summary and search_summary
+    assert '<search_database local_path="/study/db.fasta"' in text
@@ -0,0 +1,125 @@
+from pathlib import Path
+from subprocess import SubprocessError
+import shutil
+import threading
+import pytest
+from proteotools import search
+from proteotools.pepxml import read_pepxml
+
+
+@pytest.fixture
+def fake_msgfplus(monkeypatch):
+    """
+    MS-GF+ that writes nothing, and a pepXML conversion that fails for files with 'bad' in the name.
+    """
+    def convert(mzid, pepxml_converter):
+        if 'bad' in Path(mzid).name:
+            raise ValueError(f'cannot read {mzid}')
+        return str(mzid).replace('.mzid', '.pepXML')
+
+    monkeypatch.setattr(search, 'check_for_msgfplus', lambda: None)
+    monkeypatch.setattr(search, '_run_msgfplus', lambda mzml, *args: Path(mzml).with_suffix('.mzid'))
+    monkeypatch.setattr(search, '_mzid_to_pepxml', convert)
+
+
+def test_msgfplus_conversions(fake_msgfplus):
+    assert search.msgfplus('params.txt', 'db.fasta', ['a.mzML', 'b.mzML']) == ['a.pepXML', 'b.pepXML']
+
+
+def test_msgfplus_reports_every_failed_conversion(fake_msgfplus):
+    with pytest.raises(SubprocessError) as e:
+        search.msgfplus('params.txt', 'db.fasta', ['a.mzML', 'bad1.mzML', 'b.mzML', 'bad2.mzML'], max_parallel=2)
+    assert '2 of 4 mzid to pepXML conversion runs failed' in str(e.value)
+    assert 'bad1.mzid' in str(e.value) and 'bad2.mzid' in str(e.value)
+
+
+def test_search_shards_from_somewhere_else(data, tmp_path):
+    mzml = tmp_path / 'run1.mzML'
+    mzml.write_text('')
+    fasta = tmp_path / 'db.fasta'
+    fasta.write_text('>sp|P1\nPEPTIDEK\n>sp|P2\nSAMPLER\n')
+
+    # results like the ones the cache restores: searched in another directory against another run's shards
+    def search_shard(mzml, shard, directory):
+        return str(shutil.copy(data / f'{directory.name}.pepXML', directory / 'run1-comet.pepXML'))
+
+    merged = search._search_shards('comet', search_shard, [mzml], fasta, 2,
+                                   output_name=lambda x: str(x).replace('.mzML', '.pepXML'),
+                                   score='expect', max_parallel=1, executor=None)
+    assert merged == [str(tmp_path / 'run1.pepXML')]
+    assert set(read_pepxml(merged[0])['base_name']) == {str(tmp_path / 'run1')}
+    assert f'local_path="{fasta}"' in (tmp_path / 'run1.pepXML').read_text()
+    assert not (tmp_path / 'run1-comet-shards').exists()
+
+
+def test_tandem_from_a_generator(tmp_path, monkeypatch):
+    batches = []
+    searched = threading.Event()
+
+    def run_tandem(parameter_file, database, directory, batch, txml_files, pepxml_files, tandem2xml_parallel):
+        batches.append([Path(x).name for x in batch])
+        searched.set()
+
+    def mgf_files():
+        yield str(tmp_path / 'a.mgf')
+        # the first file is searched before the generator is done
+        assert searched.wait(5)
+        yield str(tmp_path / 'b.mgf')
+
+    parameter_file = tmp_path / 'params.xml'
+    parameter_file.write_text('<bioml>\n</bioml>\n')
+    monkeypatch.setattr(search, 'check_for_tandem', lambda: None)
+    monkeypatch.setattr(search, '_run_tandem', run_tandem)
+    pepxml_files = search.tandem(parameter_file, 'db.fasta', mgf_files(), max_parallel=2, threads=1)
+    assert pepxml_files == [str(tmp_path / 'a-tandem.pepXML'), str(tmp_path / 'b-tandem.pepXML')]
+    assert batches == [['a.mgf'], ['b.mgf']]
+
+
+def test_run_all_with_defaults_from_a_generator(monkeypatch):
+    read = []
+    started = threading.Semaphore(0)
+
+    def mzml_files(concurrent):
+        yield 'a.mzML'
+        read.append('a.mzML')
+        # running concurrently, every engine has the first file before the second one is there
+        assert not concurrent or all(started.acquire(timeout=5) for _ in range(3))
+        yield 'b.mzML'
+        read.append('b.mzML')
+
+    def engine(name):
+        def search(**kwargs):
+            results = []
+            for x in kwargs.get('mzml_files', kwargs.get('ms_files')):
+                started.release()
+                results.append(f'{name}:{x}')
+            return results
+        return search
+
+    for name in ('comet', 'msgfplus', 'tandem'):
+        monkeypatch.setattr(search, name, engine(name))
+    for concurrent in (True, False):
+        read.clear()
+        results = search.run_all_with_defaults('comet.params', 'msgf.txt', 'tandem.xml', 'db.fasta',
+                                               mzml_files(concurrent), concurrent=concurrent)
+        assert results == [f'{engine}:{x}' for engine in ('comet', 'msgfplus', 'tandem') for x in ('a.mzML', 'b.mzML')]
+        assert read == ['a.mzML', 'b.mzML']  # read once, for all of the engines
+
+
+@pytest.mark.parametrize('concurrent, max_parallel, threads', [(True, 2, 8), (False, 6, 8)])
+def test_run_all_with_defaults_splits_the_cores(monkeypatch, concurrent, max_parallel, threads):
+    calls = {}
+
+    def engine(name):
+        def search(**kwargs):
+            calls[name] = (kwargs['max_parallel'], kwargs['threads'])
+            return [name]
+        return search
+
+    for name in ('comet', 'msgfplus', 'tandem'):
+        monkeypatch.setattr(search, name, engine(name))
+    monkeypatch.setattr(search, 'msconvert_to_mgf', lambda *args, **kwargs: [])
+    results = search.run_all_with_defaults('comet.params', 'msgf.txt', 'tandem.xml', 'db.fasta', ['a.mzML'],
+                                           threads=48, max_parallel=6, concurrent=concurrent)
+    assert results == ['comet', 'msgfplus', 'tandem']
+    assert calls == {name: (max_parallel, threads) for name in ('comet', 'msgfplus', 'tandem')}
@@ -0,0 +1,107 @@
+from pathlib import Path
+import hashlib
+import sys
+import pytest
+from proteotools import software
+
+COMET = b'#!/bin/sh\necho comet\n'
+
+# what wget -c -O partial url does: download whatever partial doesn't have yet
+FAKE_WGET = '''
+import sys
+from pathlib import Path
+partial, url = Path(sys.argv[sys.argv.index('-O') + 1]), sys.argv[-1]
+source = Path(url[len('file://'):]) if url.startswith('file://') else Path(__file__).parent / 'upstream'
+have = partial.read_bytes() if partial.exists() else b''
+with open(Path(__file__).parent / 'wget.log', 'a') as log:
+    log.write(f'{url} {len(have)}\\n')
+partial.write_bytes(have + source.read_bytes()[len(have):])
+'''
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def wget(tmp_path, monkeypatch):
+    """
+    A wget on the PATH that serves tmp_path/bin/upstream for any URL but file:// ones. Returns the bin directory.
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'wget').write_text(f'#!{sys.executable}\n{FAKE_WGET}')
+    (bin_dir / 'wget').chmod(0o755)
+    (bin_dir / 'upstream').write_bytes(COMET)
+    monkeypatch.setenv('PATH', f'{bin_dir}:{Path(sys.executable).parent}')
+    return bin_dir
+
+
+@pytest.fixture
+def mirror(tmp_path) -> Path:
+    directory = tmp_path / 'mirror'
+    directory.mkdir()
+    (directory / 'comet.linux.exe').write_bytes(COMET)
+    return directory
+
+
+def test_install_refuses_unpinned_download(wget, tool_dir):
+    with pytest.raises(ValueError, match='allow_unpinned=True'):
+        software.install('Comet')
+    assert not (wget / 'wget.log').exists()
+    assert not (tool_dir / 'comet').exists()
+
+
+def test_install_unpinned(wget, tool_dir):
+    assert software.install('Comet', allow_unpinned=True)
+    assert (tool_dir / 'comet' / 'comet.linux.exe').read_bytes() == COMET
+    assert software.installed_tools()['Comet']['sha256'] == sha256(COMET)
+    assert not software.install('Comet')
+
+    # the recorded checksum is what the next download is verified against
+    (tool_dir / 'downloads' / 'comet.linux.exe').unlink()
+    (wget / 'upstream').write_bytes(b'something else')
+    with pytest.raises(ConnectionError, match=sha256(COMET)):
+        software.install('Comet', force=True)
+    assert (tool_dir / 'comet' / 'comet.linux.exe').read_bytes() == COMET
+
+
+def test_install_pinned_resumes_download(wget, tool_dir, monkeypatch):
+    monkeypatch.setitem(software.PACKAGES, 'Comet', software.PACKAGES['Comet']._replace(sha256=sha256(COMET)))
+    (tool_dir / 'downloads').mkdir(parents=True)
+    (tool_dir / 'downloads' / 'comet.linux.exe.part').write_bytes(COMET[:5])
+    assert software.install('Comet')
+    assert (wget / 'wget.log').read_text() == f'{software.PACKAGES["Comet"].url} 5\n'
+    assert (tool_dir / 'comet' / 'comet.linux.exe').read_bytes() == COMET
+    assert not (tool_dir / 'downloads' / 'comet.linux.exe.part').exists()
+
+
+def test_install_pinned_mismatch(wget, tool_dir, monkeypatch):
+    monkeypatch.setitem(software.PACKAGES, 'Comet', software.PACKAGES['Comet']._replace(sha256=sha256(b'other')))
+    with pytest.raises(ConnectionError, match='was deleted'):
+        software.install('Comet')
+    assert not (tool_dir / 'downloads' / 'comet.linux.exe').exists()
+    assert not (tool_dir / 'downloads' / 'comet.linux.exe.part').exists()
+    assert not (tool_dir / 'comet').exists()
+
+
+@pytest.mark.parametrize('url', [False, True])
+def test_install_from_mirror(wget, tool_dir, mirror, url):
+    source = f'file://{mirror}' if url else mirror
+    with pytest.raises(ValueError):
+        software.install('Comet', mirror=source)
+
+    (mirror / 'SHA256SUMS').write_text(f'{sha256(COMET)}  comet.linux.exe\n')
+    assert software.install('Comet', mirror=source)
+    assert (tool_dir / 'comet' / 'comet.linux.exe').read_bytes() == COMET
+
+    (mirror / 'SHA256SUMS').write_text(f'{sha256(b"other")}  comet.linux.exe\n')
+    with pytest.raises(ConnectionError):
+        software.install('Comet', mirror=source, force=True)
+
+
+def test_make_mirror(wget, tool_dir, tmp_path):
+    software.install('Comet', allow_unpinned=True)
+    directory = software.make_mirror(tmp_path / 'made')
+    assert (directory / 'comet.linux.exe').read_bytes() == COMET
+    assert (directory / 'SHA256SUMS').read_text() == f'{sha256(COMET)}  comet.linux.exe\n'
@@ -0,0 +1,26 @@
+from proteotools import tpp
+
+
+def test_spectrum_files(data, tmp_path):
+    # base_name="/data/small"
+    assert tpp._spectrum_files(data / 'shard1.pepXML', data) == [data / 'small.mzML']
+    assert tpp._spectrum_files(data / 'shard1.pepXML', tmp_path) == []
+
+
+def test_run_prophets_inputs(data, monkeypatch):
+    steps = []
+    monkeypatch.setattr(tpp, 'run_step', lambda name, inputs, **kwargs: steps.append((name, inputs)))
+    tpp.run_prophets([data / 'shard1.pepXML', data / 'shard2.pepXML'], data / 'db.fasta', mzml_directory=data)
+
+    # a changed mzML file means InteractParser and PeptideProphet have to run again
+    assert [x[0] for x in steps] == ['InteractParser+PeptideProphetParser'] * 2 + ['InterProphetParser']
+    # the files are done in parallel, so in any order
+    for (_, inputs), pepxml in zip(sorted(steps[:2], key=lambda x: x[1][0]), ['shard1.pepXML', 'shard2.pepXML']):
+        assert inputs[:3] == [data / pepxml, data / 'small.mzML', data / 'db.fasta']
+
+
+def test_run_interactparser_inputs(data, monkeypatch):
+    steps = []
+    monkeypatch.setattr(tpp, 'run_step', lambda name, inputs, **kwargs: steps.append(inputs))
+    tpp.run_interactparser([data / 'shard1.pepXML'], data / 'db.fasta', mzml_directory=data)
+    assert steps[0][:3] == [data / 'shard1.pepXML', data / 'small.mzML', data / 'db.fasta']